@@ -0,0 +1,270 @@
+"""
+Benchmark: holding a key with client-side repeat vs kdown/kup.
+
+A phone holds an arrow key for HOLD seconds, over a TCP link that delays
+each write by a random 1-JITTER ms (in order, like Wi-Fi with power
+save and retries), two ways:
+
+  spam  what clients had to do before: a 'kpress' every 1/REPEAT_RATE s
+        after REPEAT_DELAY, so every repeat crosses the network
+  hold  'kdown' and 'kup'; HeldInputs repeats on the server
+
+The server side is the real SessionLink + HeldInputs with a null backend
+that records every key event. Reported: messages sent, repeats injected,
+the spread of the gaps between repeats (network jitter shows up here),
+and how late the key stops after the user lets go.
+
+Also checked: the safety timeout releases a key whose 'kup' never comes
+when there is no session, leaves a button held in a session alone (a long
+drag), and a session that disconnects while holding a key gets it
+released after SESSION_IDLE_TIMEOUT (timeouts shortened here).
+
+Run from the repository root:  python benchmarks/bench_held_inputs.py
+"""
+
+import contextlib
+import io
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import client_sessions
+from client_sessions import SessionLink, SessionRegistry
+from held_inputs import HeldInputs, HOLD_COMMANDS, REPEAT_DELAY, REPEAT_RATE
+
+HOLD = 2.0
+JITTER = 0.015
+RUNS = 3
+LOCALHOST = '127.0.0.1'
+
+
+# --- Server (null backend that records key events) ---
+
+class Server:
+    def __init__(self, hold_timeout=30.0):
+        self.events = []    # ('down' | 'up', key, at); a 'down' while held is a repeat
+        self.lock = threading.Lock()
+        self.held = HeldInputs(self._record('down'), self._record('up'), self._record('mdown'),
+                               self._record('mup'), autorepeat=True, hold_timeout=hold_timeout)
+        self.held.start()
+        self.sessions = SessionRegistry(None, self.held.up)
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.bind((LOCALHOST, 0))
+        self.tcp.listen(4)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _record(self, kind):
+        def record(name):
+            with self.lock:
+                self.events.append((kind, name, time.perf_counter()))
+        return record
+
+    def _accept(self):
+        while True:
+            conn, _ = self.tcp.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        # Mirrors windowsmac_server.handle_tcp_client / handle_tcp_command
+        link = SessionLink(self.sessions, 'TCP')
+        buffer = ''
+        try:
+            while True:
+                data = conn.recv(1024)
+                if not data:
+                    break
+                buffer += data.decode()
+                while '\n' in buffer:
+                    command_str, buffer = buffer.split('\n', 1)
+                    reply, command_str = link.handle(command_str)
+                    if reply:
+                        conn.sendall((reply + '\n').encode())
+                    if not command_str:
+                        continue
+                    command = command_str.split(',')
+                    if command[0] == 'kpress':
+                        self._record('down')(command[1])
+                        self._record('up')(command[1])
+                    elif command[0] in HOLD_COMMANDS:
+                        self.held.command(command[0], command[1], link.session)
+        except OSError:
+            pass
+        finally:
+            link.close()
+
+
+class JitteryLink:
+    """Forwards one TCP connection, delaying each write by 1..JITTER ms, in order."""
+    def __init__(self, server_address, rng):
+        self.rng = rng
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind((LOCALHOST, 0))
+        self.listener.listen(1)
+        self.address = self.listener.getsockname()
+        self.upstream = socket.create_connection(server_address)
+        self.upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.queue = []
+        self.cond = threading.Condition()
+        threading.Thread(target=self._accept, daemon=True).start()
+        threading.Thread(target=self._deliver, daemon=True).start()
+
+    def _accept(self):
+        conn, _ = self.listener.accept()
+        last = 0.0
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            last = max(last, time.perf_counter() + self.rng.uniform(0.001, JITTER))
+            with self.cond:
+                self.queue.append((last, data))
+                self.cond.notify()
+        with self.cond:
+            self.queue.append((last, None))
+            self.cond.notify()
+
+    def _deliver(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                deliver_at, data = self.queue.pop(0)
+            delay = deliver_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if data is None:
+                self.upstream.close()
+                return
+            self.upstream.sendall(data)
+
+
+# --- Phone ---
+
+def hold_key(mode, seed):
+    server = Server()
+    link = JitteryLink(server.tcp.getsockname(), random.Random(seed))
+    conn = socket.create_connection(link.address)
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    messages = 0
+    start = time.perf_counter()
+    if mode == 'hold':
+        conn.sendall(b"kdown,right\n")
+        messages += 1
+        time.sleep(HOLD)
+        conn.sendall(b"kup,right\n")
+        messages += 1
+    else:
+        # Press, then repeat at the OS rate until the finger lifts.
+        next_press = start
+        while next_press < start + HOLD:
+            delay = next_press - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            conn.sendall(b"kpress,right\n")
+            messages += 1
+            next_press += REPEAT_DELAY if messages == 1 else 1 / REPEAT_RATE
+    lifted = start + HOLD
+    time.sleep(0.3)
+    conn.close()
+
+    with server.lock:
+        downs = [t for kind, name, t in server.events if kind == 'down']
+        last_event = max(t for kind, name, t in server.events)
+    gaps = sorted(b - a for a, b in zip(downs[1:], downs[2:]))
+    return {
+        'messages': messages,
+        'repeats': len(downs) - 1,
+        'gap_p50': statistics.median(gaps),
+        'gap_spread': gaps[-1] - gaps[0],
+        'late': last_event - lifted,
+    }
+
+
+def safety_timeout():
+    """Seconds until a 'kdown' without a 'kup' is released, with a 0.3 s timeout."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = Server(hold_timeout=0.3)
+        conn = socket.create_connection(server.tcp.getsockname())
+        start = time.perf_counter()
+        conn.sendall(b"kdown,shift\n")
+        deadline = start + 5
+        while time.perf_counter() < deadline:
+            with server.lock:
+                ups = [t for kind, _, t in server.events if kind == 'up']
+            if ups:
+                conn.close()
+                return ups[0] - start
+            time.sleep(0.005)
+    return None
+
+
+def session_hold_kept(seconds=1.0):
+    """Whether a session's 'mdown' is still held after seconds, with a 0.3 s hold timeout."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = Server(hold_timeout=0.3)
+        conn = socket.create_connection(server.tcp.getsockname())
+        conn.sendall(b"session\nmdown,left\n")
+        while not server.held.buttons():
+            time.sleep(0.001)
+        time.sleep(seconds)
+        kept = server.held.buttons() == ['left']
+        conn.close()
+    return kept
+
+
+def idle_release():
+    """Seconds from disconnect until a held button is released, with a 0.2 s idle timeout."""
+    idle_timeout, sweep_interval = client_sessions.SESSION_IDLE_TIMEOUT, client_sessions.SWEEP_INTERVAL
+    client_sessions.SESSION_IDLE_TIMEOUT, client_sessions.SWEEP_INTERVAL = 0.2, 0.01
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            server = Server()
+            server.sessions.start()
+            conn = socket.create_connection(server.tcp.getsockname())
+            conn.sendall(b"session\nmdown,left\n")
+            while not server.held.buttons():
+                time.sleep(0.001)
+            start = time.perf_counter()
+            conn.close()
+            deadline = start + 5
+            while time.perf_counter() < deadline:
+                with server.lock:
+                    ups = [t for kind, _, t in server.events if kind == 'mup']
+                if ups:
+                    return client_sessions.SESSION_IDLE_TIMEOUT, ups[0] - start
+                time.sleep(0.005)
+        return client_sessions.SESSION_IDLE_TIMEOUT, None
+    finally:
+        client_sessions.SESSION_IDLE_TIMEOUT, client_sessions.SWEEP_INTERVAL = idle_timeout, sweep_interval
+
+
+def main():
+    print(f"holding a key for {HOLD:.0f} s, repeat after {REPEAT_DELAY * 1e3:.0f} ms at {REPEAT_RATE:.0f}/s, "
+          f"1-{JITTER * 1e3:.0f} ms link jitter\n")
+    print(f"{'mode':<5} {'run':>3} {'messages':>9} {'repeats':>8} {'gap p50 ms':>11} {'gap spread ms':>14} "
+          f"{'stops late ms':>14}")
+    for mode in ('spam', 'hold'):
+        for run in range(RUNS):
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = hold_key(mode, run)
+            print(f"{mode:<5} {run:>3} {result['messages']:>9} {result['repeats']:>8} "
+                  f"{result['gap_p50'] * 1e3:>11.1f} {result['gap_spread'] * 1e3:>14.1f} "
+                  f"{result['late'] * 1e3:>14.1f}")
+
+    seconds = safety_timeout()
+    print(f"\nkdown without kup released after {seconds * 1e3:.0f} ms (hold timeout 300 ms)")
+    kept = session_hold_kept()
+    print(f"mdown in a session still held after 1000 ms (hold timeout 300 ms): {'yes' if kept else 'no'}")
+    timeout, seconds = idle_release()
+    print(f"mdown released {seconds * 1e3:.0f} ms after its session disconnected (idle timeout {timeout * 1e3:.0f} ms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Benchmark: what the runtime profiler costs the UDP loop.
+
+A loop like the servers' (DatagramReceiver, parse_csv, one injection call
+per 'mmove' on a null backend) handles DATAGRAMS moves sent over loopback
+in batches, with IDLE_CLIENTS threads blocked in recv() like per-client
+TCP handlers. It runs under four setups:
+
+  none      no profiler at all
+  off       RuntimeProfiler built and its signal handlers installed, as
+            in every server, but not switched on
+  sample    sampling every thread at SAMPLE_RATE
+  inject    timing wrapper on the backend's injection call
+
+The setups take turns, run by run, so drift on a busy host hits them all
+alike. Reported: microseconds per datagram (median of RUNS) and the
+overhead over 'none'. The null backend makes the timing wrapper look
+expensive; next to a real injection call (tens of microseconds for
+pyautogui, milliseconds for xdotool) its cost is the '+us' column.
+
+Also checked: SIGUSR1 starts a profile, the collapsed stacks include the
+UDP loop's thread, and the injection call is the original function again
+once timing ends.
+
+Run from the repository root:  python benchmarks/bench_profiler.py
+"""
+
+import contextlib
+import io
+import os
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import runtime_profiler
+from runtime_profiler import RuntimeProfiler, injection_targets, MAX_PROFILE_SECONDS, SAMPLE_RATE
+from udp_fastpath import DatagramReceiver, MMOVE
+
+DATAGRAMS = 20000
+BATCH = 200
+RUNS = 9
+IDLE_CLIENTS = 8
+LOCALHOST = '127.0.0.1'
+
+
+# --- Server (null backend) ---
+
+class NullBackend:
+    def __init__(self):
+        self.position = 0
+
+    def move_mouse(self, dx, dy):
+        self.position += dx
+
+
+class Server:
+    def __init__(self):
+        self.backend = NullBackend()
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.udp.bind((LOCALHOST, 0))
+        self.handled = 0
+        self.cond = threading.Condition()
+        threading.Thread(target=self._udp_loop, daemon=True, name='udp-loop').start()
+
+    def _udp_loop(self):
+        # Mirrors the servers' fast path
+        receiver = DatagramReceiver(self.udp)
+        fields = receiver.fields
+        backend = self.backend
+        while True:
+            receiver.receive()
+            if receiver.parse_csv() == MMOVE:
+                backend.move_mouse(fields[0], fields[1])
+            with self.cond:
+                self.handled += 1
+                if self.handled % BATCH == 0:
+                    self.cond.notify()
+
+
+def idle_clients(count):
+    """Threads blocked in recv(), like idle per-client TCP handlers."""
+    pairs = [socket.socketpair() for _ in range(count)]
+    for index, (a, _) in enumerate(pairs):
+        threading.Thread(target=a.recv, args=(1,), daemon=True, name=f'tcp-client-{index}').start()
+    return pairs
+
+
+def push(server):
+    """Seconds to push DATAGRAMS moves through the server's UDP loop."""
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = server.udp.getsockname()
+    payload = b"mmove,1,0"
+    with server.cond:
+        target = server.handled
+    start = time.perf_counter()
+    for _ in range(DATAGRAMS // BATCH):
+        for _ in range(BATCH):
+            sender.sendto(payload, address)
+        target += BATCH
+        with server.cond:
+            while server.handled < target:
+                server.cond.wait()
+    elapsed = time.perf_counter() - start
+    sender.close()
+    return elapsed
+
+
+def measure(setup, server, profiler):
+    """Seconds per datagram for one push, with the profile (if any) running during it."""
+    if setup in ('sample', 'inject'):
+        profiler.start(setup, MAX_PROFILE_SECONDS)
+        time.sleep(0.05)  # Let the sampler or the wrappers get going
+    seconds = push(server)
+    if setup in ('sample', 'inject'):
+        profiler.stop()
+        wait_for(lambda: profiler.running is None)
+    return seconds / DATAGRAMS
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def newest(out_dir, extension):
+    paths = [os.path.join(out_dir, name) for name in os.listdir(out_dir) if name.endswith(extension)]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def checks(out_dir):
+    """Signal trigger, thread coverage of the collapsed stacks, and restoring the original function."""
+    server = Server()
+    original = NullBackend.move_mouse
+    profiler = RuntimeProfiler(injection_targets(server.backend, 'move_mouse'), out_dir)
+    lines = []
+    if profiler.install_signals():
+        runtime_profiler.PROFILE_SECONDS, seconds = 0.3, runtime_profiler.PROFILE_SECONDS
+        try:
+            os.kill(os.getpid(), signal.SIGUSR1)
+            started = wait_for(lambda: profiler.running == 'sample', 1.0)
+        finally:
+            runtime_profiler.PROFILE_SECONDS = seconds
+        push(server)
+        wait_for(lambda: profiler.running is None)
+        with open(newest(out_dir, '.collapsed'), encoding='utf-8') as f:
+            stacks = f.read().splitlines()
+        loop = [line for line in stacks if line.startswith('udp-loop;')]
+        lines.append(f"SIGUSR1 started sampling: {'yes' if started else 'no'}; "
+                     f"{len(stacks)} distinct stacks, {len(loop)} of them in the UDP loop thread")
+    else:
+        lines.append("no SIGUSR1 on this platform; skipped the signal check")
+
+    profiler.start('inject', 0.3)
+    push(server)
+    wait_for(lambda: profiler.running is None)
+    restored = 'move_mouse' not in vars(server.backend) and type(server.backend).move_mouse is original
+    with open(newest(out_dir, '.txt'), encoding='utf-8') as f:
+        summary = f.read().splitlines()[-1].split()
+    lines.append(f"injection timing saw {summary[1]} calls to {summary[0]}; "
+                 f"original method back afterwards: {'yes' if restored else 'no'}")
+    return lines
+
+
+def main():
+    out_dir = tempfile.mkdtemp(prefix='bench-profiler-')
+    setups = ('none', 'off', 'sample', 'inject')
+    servers = {}
+    times = {setup: [] for setup in setups}
+    with contextlib.redirect_stdout(io.StringIO()):
+        clients = idle_clients(IDLE_CLIENTS)
+        for setup in setups:
+            server = Server()
+            profiler = None
+            if setup != 'none':
+                profiler = RuntimeProfiler(injection_targets(server.backend, 'move_mouse'), out_dir)
+                profiler.install_signals()
+            push(server)  # Warm up
+            servers[setup] = (server, profiler)
+        for _ in range(RUNS):
+            for setup in setups:
+                times[setup].append(measure(setup, *servers[setup]))
+
+    print(f"{DATAGRAMS} mmove datagrams per run over loopback, median of {RUNS}, "
+          f"{IDLE_CLIENTS} idle client threads, sampling at {SAMPLE_RATE}/s\n")
+    print(f"{'profiler':<8} {'us/datagram':>12} {'+us':>6} {'overhead':>9}")
+    baseline = statistics.median(times['none'])
+    for setup in setups:
+        seconds = statistics.median(times[setup])
+        print(f"{setup:<8} {seconds * 1e6:>12.2f} {(seconds - baseline) * 1e6:>+6.2f} "
+              f"{(seconds / baseline - 1) * 100:>+8.1f}%")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        lines = checks(out_dir)
+    print()
+    for line in lines:
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
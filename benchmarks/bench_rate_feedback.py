@@ -0,0 +1,223 @@
+"""
+Benchmark: pointer lag with and without adaptive send-rate feedback.
+
+A phone sends a touch delta every TOUCH_INTERVAL (120 Hz) for DURATION to
+a local server whose UDP loop mirrors the real ones (RateController
+around DatagramReceiver) and injects each move with either the null
+backend or a simulated slow injector that takes SERVICE_TIMES per move,
+the way xdotool forking a process per move does on a loaded host.
+
+  ignore   the phone sends every touch as its own 'mmove', as today
+  follow   the phone reads 'rate,...' advice from its TCP connection and
+           coalesces touches into one 'mmove' per recommended interval
+           (rate_feedback.MoveCoalescer)
+
+Moves go over UDP, or over the TCP connection itself the way the browser
+client sends them over its WebSocket (handled under RateController.command).
+
+Every touch moves the pointer by 1 in x, so the server's running total
+says which touch has been applied. Lag is the time from a touch to the
+move that contains it; lost touches were dropped by a full socket buffer.
+
+Run from the repository root:  python benchmarks/bench_rate_feedback.py
+"""
+
+import contextlib
+import io
+import os
+import select
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client_sessions import SessionLink, SessionRegistry
+from rate_feedback import MoveCoalescer, RateController
+from udp_fastpath import DatagramReceiver, MMOVE
+
+SERVICE_TIMES = (0.0, 0.005, 0.012, 0.025)
+TCP_SERVICE_TIMES = (0.0, 0.012)
+TOUCH_INTERVAL = 1 / 120
+DURATION = 4.0
+DRAIN_IDLE = 0.5       # Stop waiting once nothing has been applied for this long
+LOCALHOST = '127.0.0.1'
+
+
+# --- Server (null or slow injector that records the pointer position) ---
+
+class Server:
+    def __init__(self, service_time):
+        self.service_time = service_time
+        self.sessions = SessionRegistry()
+        self.rate = RateController(self.sessions)
+        self.rate.start()
+        self.position = 0
+        self.applied = []       # (position after the move, applied at)
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.bind((LOCALHOST, 0))
+        self.tcp.listen(1)
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind((LOCALHOST, 0))
+        self.udp.settimeout(0.05)
+        self.running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        threading.Thread(target=self._udp_loop, daemon=True).start()
+
+    def inject(self, dx, dy):
+        if self.service_time:
+            time.sleep(self.service_time)
+        self.position += dx
+        self.applied.append((self.position, time.perf_counter()))
+
+    def _accept(self):
+        conn, _ = self.tcp.accept()
+        send = lambda line: conn.sendall((line + '\n').encode())
+        link = SessionLink(self.sessions, 'TCP', None, send)
+        buffer = ''
+        try:
+            while True:
+                data = conn.recv(1024)
+                if not data:
+                    break
+                buffer += data.decode()
+                while '\n' in buffer:
+                    command_str, buffer = buffer.split('\n', 1)
+                    reply, command_str = link.handle(command_str)
+                    if reply:
+                        send(reply)
+                    if command_str and command_str.startswith('mmove,'):
+                        # Mirrors remo_websocket_server's WebSocket / TCP command path
+                        with self.rate.command(link.session):
+                            _, dx, dy = command_str.split(',')
+                            self.inject(int(dx), int(dy))
+        except OSError:
+            pass
+        finally:
+            link.close()
+
+    def _udp_loop(self):
+        receiver = DatagramReceiver(self.udp)
+        rate = self.rate
+        fields = receiver.fields
+        while self.running:
+            rate.waiting()
+            try:
+                receiver.receive()
+            except socket.timeout:
+                continue
+            rate.received(receiver)
+            if receiver.buffer.startswith(b'session,', 0, receiver.length):
+                self.sessions.bind_address(receiver.text(8).strip(), receiver.address)
+            elif receiver.parse_csv() == MMOVE:
+                self.inject(fields[0], fields[1])
+
+    def close(self):
+        self.running = False
+
+
+# --- Phone ---
+
+def run(service_time, follow, transport='udp'):
+    server = Server(service_time)
+    tcp = socket.create_connection(server.tcp.getsockname())
+    tcp.sendall(b"session\n")
+    tcp_buffer = b''
+    while not tcp_buffer.endswith(b'\n'):
+        tcp_buffer += tcp.recv(1024)
+    token = tcp_buffer.decode().split(',')[1]
+    tcp_buffer = b''
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = server.udp.getsockname()
+    udp.sendto(f"session,{token}".encode(), address)
+    if transport == 'tcp':
+        send = lambda command: tcp.sendall((command + '\n').encode())
+    else:
+        send = lambda command: udp.sendto(command.encode(), address)
+
+    coalescer = MoveCoalescer()
+    touches = []        # touch k (1-based) happened at touches[k - 1]
+    datagrams = 0
+    advice = []
+    start = time.perf_counter()
+    next_touch = start
+    while True:
+        now = time.perf_counter()
+        if now >= next_touch and now - start < DURATION:
+            touches.append(now)
+            command = coalescer.add(1, 0, now) if follow else "mmove,1,0"
+            if command:
+                send(command)
+                datagrams += 1
+            next_touch += TOUCH_INTERVAL
+        if follow:
+            command = coalescer.flush(now)
+            if command:
+                send(command)
+                datagrams += 1
+        if now - start >= DURATION and coalescer.next_due(now) is None:
+            break
+
+        wait = next_touch - now if now - start < DURATION else 0.005
+        if follow:
+            due = coalescer.next_due(now)
+            if due is not None:
+                wait = min(wait, due)
+        readable, _, _ = select.select([tcp], [], [], max(0.0, wait))
+        if readable:
+            tcp_buffer += tcp.recv(1024)
+            while b'\n' in tcp_buffer:
+                line, tcp_buffer = tcp_buffer.split(b'\n', 1)
+                advice.append(line.decode())
+                if follow:
+                    coalescer.on_advice(line.decode())
+
+    # Let the backlog drain.
+    last_count, last_change = 0, time.perf_counter()
+    while time.perf_counter() - last_change < DRAIN_IDLE:
+        time.sleep(0.05)
+        if len(server.applied) != last_count:
+            last_count, last_change = len(server.applied), time.perf_counter()
+    server.close()
+    tcp.close()
+    udp.close()
+    return summarize(touches, list(server.applied), datagrams, advice)
+
+
+def summarize(touches, applied, datagrams, advice):
+    lags = []
+    covered = 0
+    for position, applied_at in applied:
+        for k in range(covered, min(position, len(touches))):
+            lags.append(applied_at - touches[k])
+        covered = max(covered, position)
+    lags.sort()
+    return {
+        'datagrams': datagrams,
+        'lost': len(touches) - (applied[-1][0] if applied else 0),
+        'p50': statistics.median(lags) if lags else 0.0,
+        'p99': lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0,
+        'max': lags[-1] if lags else 0.0,
+        'advice': advice[-1].split(',')[1] if advice else '-',
+    }
+
+
+def main():
+    touches = int(DURATION / TOUCH_INTERVAL)
+    print(f"{touches} touches at {1 / TOUCH_INTERVAL:.0f} Hz over {DURATION:.0f} s, loopback\n")
+    print(f"{'moves':<5} {'inject ms':>9} {'phone':<7} {'messages':>9} {'lost':>6} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'advice ms':>10}")
+    runs = [('udp', t) for t in SERVICE_TIMES] + [('tcp', t) for t in TCP_SERVICE_TIMES]
+    for transport, service_time in runs:
+        for follow in (False, True):
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run(service_time, follow, transport)
+            print(f"{transport:<5} {service_time * 1e3:>9.0f} {'follow' if follow else 'ignore':<7} "
+                  f"{result['datagrams']:>9} {result['lost']:>6} {result['p50'] * 1e3:>8.1f} "
+                  f"{result['p99'] * 1e3:>8.1f} {result['max'] * 1e3:>8.1f} {result['advice']:>10}")
+
+
+if __name__ == '__main__':
+    main()
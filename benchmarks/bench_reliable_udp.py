@@ -0,0 +1,342 @@
+"""
+Benchmark: click latency and placement under packet loss, reliable UDP vs TCP.
+
+A phone sends moves at 120 Hz and a click every CLICK_INTERVAL through a
+local relay that drops packets at random in both directions and adds a
+fixed one-way delay. Two ways of sending the clicks are compared:
+
+  udp  reliable mode (reliable_udp.py): clicks as 'rel' datagrams, moves
+       tagged 'after', all through a lossy UDP relay to a real
+       DatagramReceiver + ReliableChannel loop
+  tcp* the existing split: moves as plain UDP datagrams through the same
+       lossy relay, clicks over a real TCP connection whose losses are
+       modelled, not measured (see below)
+
+For each click it records the time from sending to being applied, and
+whether it was misplaced: applied after a move the phone sent after it.
+The udp rows are measured end to end and checked: at every loss rate each
+click must be applied exactly once, in the order sent, and none misplaced.
+
+The tcp* rows are a model. Userspace can't drop TCP segments (that takes
+netem and root), so TcpLossRelay stands in for the kernel's recovery: a
+'lost' chunk is delivered TCP_RECOVERY later (about Linux's 200 ms minimum
+RTO, roughly what a tail-loss probe takes for a lone segment), doubling
+if the retransmission is lost too, with every later byte queued behind
+it. Their latencies are only as good as that assumption.
+
+Run from the repository root:  python benchmarks/bench_reliable_udp.py
+"""
+
+import contextlib
+import heapq
+import io
+import os
+import random
+import select
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reliable_udp import ReliableChannel, ReliableSender
+from udp_fastpath import DatagramReceiver, MMOVE
+
+LOSS_RATES = (0.0, 0.02, 0.05, 0.10)
+ONE_WAY_DELAY = 0.002      # Wi-Fi LAN
+MOVE_INTERVAL = 1 / 120
+CLICK_INTERVAL = 0.03
+CLICKS = 200
+TCP_RECOVERY = 0.2         # Modelled delay of a lost TCP segment; see TcpLossRelay
+LOCALHOST = '127.0.0.1'
+
+
+# --- Lossy links ---
+
+class LossyUdpRelay:
+    """Forwards datagrams client <-> server, dropping each with probability loss."""
+    def __init__(self, server_address, loss, rng):
+        self.server_address = server_address
+        self.loss = loss
+        self.rng = rng
+        self.front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.front.bind((LOCALHOST, 0))
+        self.back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.back.bind((LOCALHOST, 0))
+        self.address = self.front.getsockname()
+        self.client_address = None
+        self.queue = []  # (deliver at, counter, socket, data, destination)
+        self.counter = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _schedule(self, sock, data, destination):
+        if self.rng.random() < self.loss:
+            return
+        self.counter += 1
+        heapq.heappush(self.queue, (time.perf_counter() + ONE_WAY_DELAY, self.counter, sock, data, destination))
+
+    def _run(self):
+        while self.running:
+            timeout = 0.01
+            if self.queue:
+                timeout = max(0.0, self.queue[0][0] - time.perf_counter())
+            readable, _, _ = select.select([self.front, self.back], [], [], timeout)
+            for sock in readable:
+                data, address = sock.recvfrom(2048)
+                if sock is self.front:
+                    self.client_address = address
+                    self._schedule(self.back, data, self.server_address)
+                elif self.client_address is not None:
+                    self._schedule(self.front, data, self.client_address)
+            now = time.perf_counter()
+            while self.queue and self.queue[0][0] <= now:
+                _, _, sock, data, destination = heapq.heappop(self.queue)
+                sock.sendto(data, destination)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.front.close()
+        self.back.close()
+
+
+class TcpLossRelay:
+    """
+    Forwards one TCP connection to the server, modelling loss rather than
+    causing it. Each chunk the client writes is 'lost' with probability
+    loss and then arrives TCP_RECOVERY late; in order delivery means
+    everything written after it waits too.
+    """
+    def __init__(self, server_address, loss, rng):
+        self.loss = loss
+        self.rng = rng
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind((LOCALHOST, 0))
+        self.listener.listen(1)
+        self.address = self.listener.getsockname()
+        self.upstream = socket.create_connection(server_address)
+        self.upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.queue = []
+        self.cond = threading.Condition()
+        self.running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        threading.Thread(target=self._deliver, daemon=True).start()
+
+    def _accept(self):
+        conn, _ = self.listener.accept()
+        last_delivery = 0.0
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            deliver_at = time.perf_counter() + ONE_WAY_DELAY
+            penalty = TCP_RECOVERY
+            while self.rng.random() < self.loss:
+                deliver_at += penalty
+                penalty *= 2
+            last_delivery = max(last_delivery, deliver_at)  # Head-of-line blocking
+            with self.cond:
+                self.queue.append((last_delivery, data))
+                self.cond.notify()
+
+    def _deliver(self):
+        while self.running:
+            with self.cond:
+                while not self.queue and self.running:
+                    self.cond.wait(0.05)
+                if not self.queue:
+                    continue
+                deliver_at, data = self.queue[0]
+            delay = deliver_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            with self.cond:
+                self.queue.pop(0)
+            self.upstream.sendall(data)
+
+    def close(self):
+        self.running = False
+        self.upstream.close()
+        self.listener.close()
+
+
+# --- Server (null injector that logs what it applies) ---
+
+class Server:
+    def __init__(self):
+        self.events = []  # ('move' | 'click', id, applied at)
+        self.lock = threading.Lock()
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind((LOCALHOST, 0))
+        self.udp.settimeout(0.05)
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.bind((LOCALHOST, 0))
+        self.tcp.listen(1)
+        self.running = True
+        threading.Thread(target=self._udp_loop, daemon=True).start()
+        threading.Thread(target=self._tcp_loop, daemon=True).start()
+
+    def _log(self, kind, ident):
+        with self.lock:
+            self.events.append((kind, ident, time.perf_counter()))
+
+    def _apply(self, command_str):
+        command = command_str.strip().split(',')
+        if command[0] == 'kpress':
+            self._log('click', int(command[1]))
+        elif command[0] == 'mmove':
+            self._log('move', int(command[1]))
+
+    def _udp_loop(self):
+        receiver = DatagramReceiver(self.udp)
+        reliable = ReliableChannel(self.udp)
+        while self.running:
+            try:
+                receiver.receive()
+            except socket.timeout:
+                continue
+            start = reliable.feed(receiver, self._apply)
+            if start >= 0 and receiver.parse_csv(start) == MMOVE:
+                self._log('move', receiver.fields[0])
+
+    def _tcp_loop(self):
+        conn, _ = self.tcp.accept()
+        buffer = b''
+        while self.running:
+            data = conn.recv(4096)
+            if not data:
+                return
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                self._apply(line.decode())
+
+    def close(self):
+        self.running = False
+
+
+# --- Phone ---
+
+def run(path, loss, seed):
+    rng = random.Random(seed)
+    server = Server()
+    udp_relay = LossyUdpRelay(server.udp.getsockname(), loss, rng)
+    phone = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    phone.bind((LOCALHOST, 0))
+    tcp_relay = tcp = None
+    if path == 'tcp':
+        tcp_relay = TcpLossRelay(server.tcp.getsockname(), loss, rng)
+        tcp = socket.create_connection(tcp_relay.address)
+        tcp.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    sender = ReliableSender()
+    sent = []          # ('move' | 'click', id, sent at), in send order
+    move_id = click_id = 0
+    start = time.perf_counter()
+    next_move = next_click = start
+    while click_id < CLICKS or (path == 'udp' and sender.outstanding):
+        now = time.perf_counter()
+        if now >= next_move:
+            move_id += 1
+            command = f"mmove,{move_id},0"
+            phone.sendto((sender.ordered(command) if path == 'udp' else command).encode(), udp_relay.address)
+            sent.append(('move', move_id, now))
+            next_move += MOVE_INTERVAL
+        if now >= next_click and click_id < CLICKS:
+            click_id += 1
+            command = f"kpress,{click_id}"
+            if path == 'udp':
+                phone.sendto(sender.reliable(command, now).encode(), udp_relay.address)
+            else:
+                tcp.sendall((command + '\n').encode())
+            sent.append(('click', click_id, now))
+            next_click += CLICK_INTERVAL
+
+        wait = min(next_move, next_click) - time.perf_counter()
+        if path == 'udp':
+            timeout = sender.next_timeout(time.perf_counter())
+            if timeout is not None:
+                wait = min(wait, timeout)
+        readable, _, _ = select.select([phone], [], [], max(0.0, wait))
+        if readable:
+            ack = phone.recv(256).decode()
+            for datagram in sender.on_ack(ack, time.perf_counter()):
+                phone.sendto(datagram.encode(), udp_relay.address)
+        if path == 'udp':
+            for datagram in sender.poll(time.perf_counter()):
+                phone.sendto(datagram.encode(), udp_relay.address)
+
+    # Let the TCP stragglers arrive.
+    deadline = time.perf_counter() + 5
+    while time.perf_counter() < deadline:
+        with server.lock:
+            if sum(1 for kind, _, _ in server.events if kind == 'click') >= CLICKS:
+                break
+        time.sleep(0.01)
+    server.close()
+    udp_relay.close()
+    if tcp_relay:
+        tcp.close()
+        tcp_relay.close()
+    return summarize(sent, server.events)
+
+
+def summarize(sent, events):
+    sent_at = {(kind, ident): t for kind, ident, t in sent}
+    latencies = []
+    misplaced = 0
+    applied_moves = set()
+    clicks = [(ident, t) for kind, ident, t in events if kind == 'click']
+    for kind, ident, t in events:
+        if kind == 'move':
+            applied_moves.add(ident)
+            continue
+        latencies.append(t - sent_at[('click', ident)])
+        # Moves sent after this click must not have been applied before it.
+        click_sent = sent_at[('click', ident)]
+        if any(sent_at[('move', m)] > click_sent for m in applied_moves):
+            misplaced += 1
+    latencies.sort()
+    return {
+        'order': [ident for ident, _ in clicks],
+        'clicks': len(clicks),
+        'duplicates': len(clicks) - len({ident for ident, _ in clicks}),
+        'p50': statistics.median(latencies),
+        'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        'max': latencies[-1],
+        'misplaced': misplaced / len(clicks),
+    }
+
+
+def check_reliable(loss, result):
+    """Reliable UDP's promise: every click exactly once, in order, never overtaken by a later move."""
+    order = result['order']
+    assert len(order) == len(set(order)), f"{loss:.0%} loss: a click was applied twice"
+    assert sorted(order) == list(range(1, CLICKS + 1)), f"{loss:.0%} loss: {CLICKS - len(set(order))} clicks lost"
+    assert order == sorted(order), f"{loss:.0%} loss: clicks applied out of order"
+    assert result['misplaced'] == 0, f"{loss:.0%} loss: {result['misplaced']:.1%} of clicks misplaced"
+
+
+def main():
+    print(f"one-way delay {ONE_WAY_DELAY * 1e3:.0f} ms, {CLICKS} clicks every {CLICK_INTERVAL * 1e3:.0f} ms, "
+          f"moves at {1 / MOVE_INTERVAL:.0f} Hz\n")
+    print(f"{'loss':>5} {'path':<5} {'clicks':>7} {'dups':>5} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'misplaced':>10}")
+    for seed, loss in enumerate(LOSS_RATES):
+        for path in ('tcp', 'udp'):
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run(path, loss, seed)
+            if path == 'udp':
+                check_reliable(loss, result)
+            print(f"{loss:>5.0%} {path if path == 'udp' else 'tcp*':<5} {result['clicks']:>7} {result['duplicates']:>5} "
+                  f"{result['p50'] * 1e3:>8.1f} {result['p99'] * 1e3:>8.1f} {result['max'] * 1e3:>8.1f} "
+                  f"{result['misplaced']:>10.1%}")
+    print("\nudp: every click applied exactly once and in order, none misplaced, at every loss rate.")
+    print(f"tcp*: modelled, assuming a lost segment costs {TCP_RECOVERY * 1e3:.0f} ms, doubling per retransmission.")
+
+
+if __name__ == '__main__':
+    main()
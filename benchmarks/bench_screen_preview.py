@@ -0,0 +1,208 @@
+"""
+Benchmark: screen preview on the synthetic source, without a display.
+
+Encoder: SyntheticSource frames (a square moving over a gradient) go
+through TileEncoder. Every frame message is parsed back, and the tiles it
+carries must be exactly the tiles that differ from the previous frame
+(recomputed here independently); an unchanged frame must produce no
+message at all. Reported: tiles and bytes per keyframe and per delta.
+
+Pipeline: PreviewHub runs the 'synthetic' worker process on an event
+loop shared with a ticker that stands in for input injection (it wakes
+every TICK and records how late it woke). A client subscribes, acks
+every frame for STREAM seconds, then leaves. Reported: frames received
+and the ticker's worst lateness while the worker starts, while frames
+stream, and while the worker stops. Starting and stopping the worker
+block for a good while, so they must not happen on the loop. Also
+checked: a stream that fails clears the hub's task, so the next
+subscriber starts a new worker.
+
+Rate control: acks are replayed for a link of LINK_RATE bytes/s and
+LINK_RTT round trip, a keyframe then deltas of the sizes the encoder
+produced, REPLAYS times over. Reported: the hub's bandwidth estimate next
+to one that takes every ack as bytes / round trip, where latency drags it
+far below the link.
+
+Run from the repository root:  python benchmarks/bench_screen_preview.py
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from screen_preview import (FLAG_KEYFRAME, FRAME_HEADER, PREVIEW_BANDWIDTH_SMOOTHING, PREVIEW_SCALE,
+                            PREVIEW_TILE, TILE_HEADER, PreviewHub, SyntheticSource, TileEncoder,
+                            _Subscriber, changed_tiles, downsample)
+
+FRAMES = 60
+STREAM = 2.0
+TICK = 0.001
+LINK_RATE = 2_000_000
+LINK_RTT = 0.030
+REPLAYS = 3
+
+
+# --- Encoder ---
+
+def parse_tiles(message):
+    """(flags, {(row, column), ...}) carried by one frame message."""
+    _, _, flags, _, _, _, _, count = FRAME_HEADER.unpack_from(message)
+    offset = FRAME_HEADER.size
+    tiles = set()
+    for _ in range(count):
+        col, row, length = TILE_HEADER.unpack_from(message, offset)
+        tiles.add((row, col))
+        offset += TILE_HEADER.size + length
+    assert offset == len(message), "trailing bytes after the last tile"
+    return flags, tiles
+
+
+def check_encoder():
+    source = SyntheticSource()
+    encoder = TileEncoder()
+    previous = None
+    keyframe, deltas = None, []
+    for _ in range(FRAMES):
+        frame = source.capture()
+        small = downsample(frame, PREVIEW_SCALE, PREVIEW_TILE)
+        message = encoder.encode(frame)
+        flags, tiles = parse_tiles(message)
+        if previous is None:
+            assert flags & FLAG_KEYFRAME, "first frame is not a keyframe"
+            rows, cols = small.shape[0] // PREVIEW_TILE, small.shape[1] // PREVIEW_TILE
+            assert len(tiles) == rows * cols, "keyframe is missing tiles"
+            keyframe = (len(tiles), len(message))
+        else:
+            expected = {tuple(t) for t in changed_tiles(previous, small, PREVIEW_TILE)}
+            assert not flags & FLAG_KEYFRAME, "unexpected keyframe"
+            assert tiles == expected, f"sent {sorted(tiles ^ expected)} that did not change or missed them"
+            deltas.append((len(tiles), len(message)))
+        previous = small
+
+    # The same picture again changes nothing, so nothing is sent.
+    source.frame_number -= 1
+    assert encoder.encode(source.capture()) is None, "unchanged frame produced a message"
+    total = (small.shape[0] // PREVIEW_TILE) * (small.shape[1] // PREVIEW_TILE)
+    return total, keyframe, deltas
+
+
+# --- Pipeline ---
+
+class Ticker:
+    """Wakes every TICK on the loop and remembers its worst lateness per phase."""
+    def __init__(self):
+        self.phase = None
+        self.worst = {}
+
+    async def run(self):
+        while True:
+            due = time.perf_counter() + TICK
+            await asyncio.sleep(TICK)
+            late = time.perf_counter() - due
+            if self.phase is not None:
+                self.worst[self.phase] = max(self.worst.get(self.phase, 0.0), late)
+
+
+async def run_pipeline():
+    ticker = Ticker()
+    ticker_task = asyncio.get_running_loop().create_task(ticker.run())
+    hub = PreviewHub('synthetic')
+    frames = []
+    first_frame = asyncio.Event()
+
+    async def send(message):
+        frames.append(message)
+        first_frame.set()
+        _, _, _, frame_id = FRAME_HEADER.unpack_from(message)[:4]
+        asyncio.get_running_loop().call_soon(hub.ack, 'client', frame_id)
+
+    ticker.phase = 'start'
+    started = time.perf_counter()
+    hub.subscribe('client', send)
+    await first_frame.wait()
+    first = time.perf_counter() - started
+
+    ticker.phase = 'stream'
+    frames.clear()
+    await asyncio.sleep(STREAM)
+    streamed = len(frames)
+
+    ticker.phase = 'stop'
+    hub.unsubscribe('client')
+    await asyncio.sleep(2.5)  # Long enough for the worker to be joined in the background
+    ticker.phase = None
+    ticker_task.cancel()
+    return first, streamed, ticker.worst
+
+
+async def check_failed_stream():
+    """Whether the hub forgets a task whose stream raised."""
+    hub = PreviewHub('synthetic')
+
+    async def fail(loop, worker):
+        raise OSError("link gone")
+    hub._forward = fail
+
+    async def send(message):
+        pass
+
+    hub.subscribe('client', send)
+    task = hub.task
+    await task
+    await asyncio.sleep(2.5)  # Let the worker stop in the background
+    return hub.task is None
+
+
+# --- Rate control ---
+
+def bandwidth_estimates(keyframe_bytes, delta_bytes):
+    """(hub estimate, every-ack estimate) in bytes/s after replaying the acks."""
+    hub = PreviewHub('synthetic')
+    hub.subscribers['client'] = subscriber = _Subscriber(None)
+    naive = None
+    for frame_id, size in enumerate(([keyframe_bytes] + delta_bytes) * REPLAYS):
+        elapsed = LINK_RTT + size / LINK_RATE
+        subscriber.awaiting = frame_id
+        subscriber.sent_at = time.monotonic() - elapsed
+        subscriber.sent_bytes = size
+        hub.ack('client', frame_id)
+        sample = size / elapsed
+        naive = sample if naive is None else naive + PREVIEW_BANDWIDTH_SMOOTHING * (sample - naive)
+    return subscriber.bandwidth, naive
+
+
+def main():
+    total, keyframe, deltas = check_encoder()
+    print(f"encoder: {FRAMES} synthetic frames, {total} tiles per frame")
+    print(f"  keyframe   {keyframe[0]:>4} tiles {keyframe[1]:>8} bytes")
+    print(f"  delta avg  {np.mean([t for t, _ in deltas]):>4.1f} tiles {np.mean([b for _, b in deltas]):>8.0f} bytes")
+    print("  only changed tiles emitted: yes; unchanged frame sent nothing: yes\n")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        first, streamed, worst = asyncio.run(run_pipeline())
+    print(f"pipeline: first frame after {first * 1e3:.0f} ms, {streamed / STREAM:.1f} frames/s while acking")
+    print(f"{'phase':<8} {'worst loop stall ms':>20}")
+    for phase in ('start', 'stream', 'stop'):
+        print(f"{phase:<8} {worst.get(phase, 0.0) * 1e3:>20.1f}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        cleared = asyncio.run(check_failed_stream())
+    assert cleared, "failed stream left its task on the hub"
+    print("failed stream cleared the hub's task: yes\n")
+
+    hub_rate, naive_rate = bandwidth_estimates(keyframe[1], [b for _, b in deltas])
+    assert abs(hub_rate - LINK_RATE) < 0.25 * LINK_RATE, "hub bandwidth estimate is off"
+    print(f"rate control: {LINK_RATE / 1e6:.1f} MB/s link, {LINK_RTT * 1e3:.0f} ms round trip")
+    print(f"  hub estimate        {hub_rate / 1e6:>6.2f} MB/s")
+    print(f"  every-ack estimate  {naive_rate / 1e6:>6.2f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
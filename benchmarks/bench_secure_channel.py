@@ -0,0 +1,79 @@
+"""
+Benchmark: per-packet cost of the sealed transport (secure_channel.py).
+
+Measures the server-side receive path for one 'mmove' datagram with and
+without pairing, then projects the CPU share needed for many phones each
+sending at 120 Hz.
+
+Run from the repository root:  python benchmarks/bench_secure_channel.py
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from secure_channel import PairingClient, PairingServer, SecureStream
+
+RATE_HZ = 120
+CLIENT_COUNTS = (1, 10, 50, 200)
+PACKETS = 200_000
+
+
+def pair(server):
+    client = PairingClient(server.code)
+    stream = SecureStream(server)
+    reply, _ = stream.feed((client.start() + '\n').encode())
+    stream.feed((client.finish(reply.decode()) + '\n').encode())
+    return client
+
+
+def time_plain(datagrams):
+    start = time.process_time()
+    for data in datagrams:
+        data.decode('utf-8').strip().split(',')
+    return (time.process_time() - start) / len(datagrams)
+
+
+def time_sealed(server, datagrams):
+    start = time.process_time()
+    for data in datagrams:
+        plaintext = server.open_datagram(data, len(data))
+        str(plaintext, 'utf-8').strip().split(',')
+    return (time.process_time() - start) / len(datagrams)
+
+
+def main():
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = PairingServer()
+        clients = [pair(server) for _ in range(8)]
+
+    plain = [f'mmove,{i % 7 - 3},{i % 5 - 2}'.encode() for i in range(PACKETS)]
+    # Interleave clients so session lookups aren't all cache-hot on one entry.
+    sealed = [clients[i % len(clients)].seal_datagram(data.decode()) for i, data in enumerate(plain)]
+
+    plain_cost = time_plain(plain)
+    sealed_cost = time_sealed(server, sealed)
+    added = sealed_cost - plain_cost
+    print(f"payload {len(plain[0])} B -> sealed {len(sealed[0])} B")
+    print(f"plain receive+parse    {plain_cost * 1e6:7.2f} us/packet")
+    print(f"sealed receive+parse   {sealed_cost * 1e6:7.2f} us/packet  (+{added * 1e6:.2f} us)")
+    print()
+    print(f"{'clients @ 120 Hz':>18} {'packets/s':>10} {'added CPU':>10} {'total CPU':>10}")
+    for count in CLIENT_COUNTS:
+        rate = count * RATE_HZ
+        print(f"{count:>18} {rate:>10} {rate * added * 100:>9.2f}% {rate * sealed_cost * 100:>9.2f}%")
+
+    # Replays are rejected before any decryption work.
+    replay = sealed[-1]
+    start = time.process_time()
+    for _ in range(PACKETS):
+        server.open_datagram(replay, len(replay))
+    print(f"\nreplayed packet reject {(time.process_time() - start) / PACKETS * 1e6:7.2f} us/packet")
+
+
+if __name__ == '__main__':
+    main()
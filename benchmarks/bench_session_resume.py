@@ -0,0 +1,280 @@
+"""
+Benchmark: reconnect-to-first-input latency with and without session resume.
+
+A phone that roams or wakes from sleep opens a new TCP connection. This
+measures the time from starting connect() to the server applying the
+first command on the new connection, against a local server running the
+same SecureStream + SessionLink handling as the real ones (with a null
+injector):
+
+  unpaired  fresh       plain command, nothing to restore
+  unpaired  resume      'session,<token>' pipelined with the command
+  paired    pair again  the full pairing handshake (two round trips and
+                        PBKDF2 on both sides; a human typing the new code
+                        would come on top of this)
+  paired    resume      'resume,...' pipelined with the sealed command
+
+Reliable-UDP state after a change of address is measured separately: the
+phone sends some clicks from one UDP socket, then a click from a new one.
+Without sessions the server sees a new peer whose seq doesn't start at 1
+and holds the click until GAP_LIMIT; with sessions the sequence state
+follows the client.
+
+Finally the idle timeout is checked: a disconnected session holding a key
+gets it released after SESSION_IDLE_TIMEOUT (shortened here).
+
+Run from the repository root:  python benchmarks/bench_session_resume.py
+"""
+
+import contextlib
+import io
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import client_sessions
+from client_sessions import SessionLink, SessionRegistry
+from reliable_udp import ReliableChannel, ReliableSender
+from secure_channel import PairingClient, PairingServer, SecureStream
+from udp_fastpath import DatagramReceiver
+
+RECONNECTS = 20       # Pairing again runs PBKDF2 twice per reconnect
+ROAM_CLICKS = 5
+ROAM_WAIT = 1.0        # Give up waiting for a held click after this long
+LOCALHOST = '127.0.0.1'
+
+
+# --- Server (null injector that records when each command is applied) ---
+
+class Server:
+    def __init__(self, pairing, use_sessions=True):
+        self.pairing = pairing
+        self.sessions = SessionRegistry(pairing) if use_sessions else None
+        self.applied = {}   # command -> applied at
+        self.cond = threading.Condition()
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.bind((LOCALHOST, 0))
+        self.tcp.listen(16)
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind((LOCALHOST, 0))
+        threading.Thread(target=self._accept, daemon=True).start()
+        threading.Thread(target=self._udp_loop, daemon=True).start()
+
+    def apply(self, command_str):
+        with self.cond:
+            self.applied[command_str.strip()] = time.perf_counter()
+            self.cond.notify_all()
+
+    def wait_for(self, command, timeout=5.0):
+        """Returns when command was applied, or None."""
+        with self.cond:
+            self.cond.wait_for(lambda: command in self.applied, timeout)
+            return self.applied.get(command)
+
+    def _accept(self):
+        while True:
+            conn, _ = self.tcp.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        # Mirrors windowsmac_server.handle_tcp_client
+        buffer = ''
+        stream = SecureStream(self.pairing) if self.pairing else None
+        link = SessionLink(self.sessions, 'TCP', stream) if self.sessions else None
+        try:
+            while True:
+                data = conn.recv(1024)
+                if not data:
+                    break
+                if stream is None:
+                    buffer += data.decode('utf-8')
+                    commands = []
+                    while '\n' in buffer:
+                        command_str, buffer = buffer.split('\n', 1)
+                        commands.append(command_str)
+                else:
+                    reply, commands = stream.feed(data)
+                    if reply:
+                        conn.sendall(reply)
+                    if stream.closed:
+                        break
+                for command_str in commands:
+                    if link is not None:
+                        reply, command_str = link.handle(command_str)
+                        if reply:
+                            conn.sendall((reply + '\n').encode())
+                    if command_str:
+                        self.apply(command_str)
+        except OSError:
+            pass
+        finally:
+            if link is not None:
+                link.close()
+            conn.close()
+
+    def _udp_loop(self):
+        receiver = DatagramReceiver(self.udp, self.pairing)
+        reliable = ReliableChannel(self.udp, self.pairing, self.sessions)
+        while True:
+            if not receiver.receive():
+                continue
+            reliable.feed(receiver, self.apply)
+
+
+# --- Phone ---
+
+def read_line(sock):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(1024)
+        if not chunk:
+            break
+        data += chunk
+    return data.decode()
+
+
+def pair(server):
+    """Pairs a PairingClient over a new connection. Returns (client, connection)."""
+    client = PairingClient(server.pairing.code)
+    conn = socket.create_connection(server.tcp.getsockname())
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    conn.sendall((client.start() + '\n').encode())
+    conn.sendall((client.finish(read_line(conn)) + '\n').encode())
+    read_line(conn)  # paired
+    return client, conn
+
+
+def reconnect(server, mode, state, ident):
+    """Opens a new connection and sends one command. Returns seconds until it was applied."""
+    command = f"mclick,probe{ident}"
+    start = time.perf_counter()
+    if mode == 'pair again':
+        client, conn = pair(server)
+        conn.sendall(client.seal_frame(command))
+    else:
+        conn = socket.create_connection(server.tcp.getsockname())
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if mode == 'fresh':
+            conn.sendall((command + '\n').encode())
+        elif mode == 'unpaired resume':
+            conn.sendall(f"session,{state['token']}\n{command}\n".encode())
+        else:
+            client = state['client']
+            conn.sendall((client.resume() + '\n').encode() + client.seal_frame(command))
+    applied = server.wait_for(command)
+    conn.close()
+    return applied - start
+
+
+def measure_reconnects():
+    rows = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        plain = Server(None)
+        paired = Server(PairingServer())
+        # Open the sessions to resume.
+        conn = socket.create_connection(plain.tcp.getsockname())
+        conn.sendall(b"session\n")
+        token = read_line(conn).split(',')[1]
+        conn.close()
+        client, conn = pair(paired)
+        conn.close()
+
+        cases = [
+            ('unpaired', 'fresh', plain, {}),
+            ('unpaired', 'resume', plain, {'token': token}),
+            ('paired', 'pair again', paired, {}),
+            ('paired', 'resume', paired, {'client': client}),
+        ]
+        for pairing, label, server, state in cases:
+            mode = 'unpaired resume' if (pairing, label) == ('unpaired', 'resume') else label
+            samples = sorted(reconnect(server, mode, state, f"{pairing}{label}{i}") for i in range(RECONNECTS))
+            rows.append((pairing, label, samples))
+    return rows
+
+
+def measure_roam(paired, use_sessions):
+    """Clicks from a new UDP socket after some from an old one. Returns seconds until applied, or None."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = Server(PairingServer() if paired else None, use_sessions)
+        address = server.udp.getsockname()
+        client = token = None
+        if paired:
+            client, conn = pair(server)
+        else:
+            conn = socket.create_connection(server.tcp.getsockname())
+            if use_sessions:
+                conn.sendall(b"session\n")
+                token = read_line(conn).split(',')[1]
+        seal = client.seal_datagram if paired else str.encode
+
+        sender = ReliableSender()
+        old = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if not paired and use_sessions:
+            old.sendto(seal(f"session,{token}"), address)  # Announce the session before the first click
+        for i in range(ROAM_CLICKS):
+            old.sendto(seal(sender.reliable(f"kpress,old{i}", time.perf_counter())), address)
+            server.wait_for(f"kpress,old{i}")
+        old.close()
+
+        new = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        start = time.perf_counter()
+        if not paired and use_sessions:
+            new.sendto(seal(f"session,{token}"), address)
+        new.sendto(seal(sender.reliable("kpress,roamed", start)), address)
+        applied = server.wait_for("kpress,roamed", ROAM_WAIT)
+        new.close()
+        conn.close()
+    return None if applied is None else applied - start
+
+
+def measure_idle_release():
+    """Seconds from disconnect until a held key is released, with a shortened idle timeout."""
+    idle_timeout, sweep_interval = client_sessions.SESSION_IDLE_TIMEOUT, client_sessions.SWEEP_INTERVAL
+    client_sessions.SESSION_IDLE_TIMEOUT, client_sessions.SWEEP_INTERVAL = 0.2, 0.01
+    released = threading.Event()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            server = Server(None)
+            server.sessions.release_input = lambda kind, name: released.set()
+            server.sessions.start()
+            conn = socket.create_connection(server.tcp.getsockname())
+            conn.sendall(b"session\nmclick,first\n")
+            server.wait_for('mclick,first')
+            # Nothing presses and holds yet, so hold a key by hand.
+            next(iter(server.sessions.sessions.values())).press('key', 'shift')
+            start = time.perf_counter()
+            conn.close()
+            released.wait(5)
+        return client_sessions.SESSION_IDLE_TIMEOUT, time.perf_counter() - start
+    finally:
+        client_sessions.SESSION_IDLE_TIMEOUT, client_sessions.SWEEP_INTERVAL = idle_timeout, sweep_interval
+
+
+def main():
+    print(f"reconnect -> first command applied, {RECONNECTS} reconnects each, loopback\n")
+    print(f"{'client':<9} {'reconnect':<11} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for pairing, label, samples in measure_reconnects():
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        print(f"{pairing:<9} {label:<11} {statistics.median(samples) * 1e3:>8.2f} "
+              f"{p99 * 1e3:>8.2f} {samples[-1] * 1e3:>8.2f}")
+
+    print(f"\nreliable-UDP click from a new address after {ROAM_CLICKS} clicks from the old one\n")
+    print(f"{'client':<9} {'sessions':<9} {'applied after':>14}")
+    for paired in (False, True):
+        for use_sessions in (False, True):
+            seconds = measure_roam(paired, use_sessions)
+            result = f"{seconds * 1e3:.2f} ms" if seconds is not None else f"> {ROAM_WAIT * 1e3:.0f} ms (held)"
+            print(f"{'paired' if paired else 'unpaired':<9} {'on' if use_sessions else 'off':<9} {result:>14}")
+
+    timeout, seconds = measure_idle_release()
+    print(f"\nheld key released {seconds * 1e3:.0f} ms after disconnect (idle timeout {timeout * 1e3:.0f} ms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark: cost of protocol sniffing on the shared TCP/WebSocket port.
+
+Compares connect -> first command latency for a raw TCP client against a
+plain asyncio line server, and WebSocket connect -> first message latency
+against a plain websockets.serve() server, all on localhost. Also times
+command -> handler on an already open TCP connection, which is what every
+click and key after the first one pays.
+
+The shared port is not free: a new TCP connection's first command takes
+roughly 100 us longer than on the plain server (a websockets
+ServerConnection is built before the first bytes arrive, and the command
+is handed to the command thread instead of run on the loop). Commands on
+an open connection only pay the hand-off, some tens of microseconds here
+(there and back), against the 100 ms a pyautogui injection would
+otherwise hold the loop for.
+
+Run from the repository root:  python benchmarks/bench_single_port.py
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from websockets.asyncio.client import connect
+from websockets.asyncio.server import serve
+from single_port import serve_single_port, sniff
+
+HOST = '127.0.0.1'
+ROUNDS = 300
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    print(f"{name:<36} median {statistics.median(samples) * 1e6:8.1f} us   p99 {p99 * 1e6:8.1f} us",
+          file=sys.__stdout__)
+
+
+async def time_tcp(port, received):
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection(HOST, port)
+        writer.write(b'mclick,left\n')
+        await received.get()
+        samples.append(time.perf_counter() - start)
+        writer.close()
+        await writer.wait_closed()
+    return samples
+
+
+async def time_tcp_open(port, received):
+    samples = []
+    reader, writer = await asyncio.open_connection(HOST, port)
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        writer.write(b'mclick,left\n')
+        await received.get()
+        samples.append(time.perf_counter() - start)
+    writer.close()
+    await writer.wait_closed()
+    return samples
+
+
+async def time_websocket(port, received):
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        async with connect(f'ws://{HOST}:{port}') as ws:
+            await ws.send('mclick,left')
+            await received.get()
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def main():
+    received = asyncio.Queue()
+
+    async def ws_handler(websocket):
+        async for message in websocket:
+            received.put_nowait(message)
+
+    # --- Baselines: one dedicated server per protocol ---
+    class LineProtocol(asyncio.Protocol):
+        def data_received(self, data):
+            if b'\n' in data:
+                received.put_nowait(data)
+
+    loop = asyncio.get_running_loop()
+    plain_tcp = await loop.create_server(LineProtocol, HOST, 0)
+    async with serve(ws_handler, HOST, 0) as plain_ws:
+        report("plain TCP connect+command", await time_tcp(plain_tcp.sockets[0].getsockname()[1], received))
+        report("plain TCP command, open connection", await time_tcp_open(plain_tcp.sockets[0].getsockname()[1], received))
+        report("plain WebSocket connect+message", await time_websocket(plain_ws.sockets[0].getsockname()[1], received))
+    plain_tcp.close()
+
+    # --- Shared port with sniffing ---
+    # TCP commands arrive on the server's command thread.
+    on_tcp_command = lambda line, *session: loop.call_soon_threadsafe(received.put_nowait, line)
+    async with serve_single_port(ws_handler, on_tcp_command, HOST, 0) as shared:
+        port = shared.sockets[0].getsockname()[1]
+        report("sniffed TCP connect+command", await time_tcp(port, received))
+        report("sniffed TCP command, open connection", await time_tcp_open(port, received))
+        report("sniffed WebSocket connect+message", await time_websocket(port, received))
+
+    per_call = min(timeit.repeat(lambda: sniff(b'GET / HTTP/1.1'), number=100000, repeat=5)) / 100000
+    print(f"{'sniff() classification':<36} {per_call * 1e9:8.1f} ns per connection", file=sys.__stdout__)
+
+
+if __name__ == '__main__':
+    # Silence the per-connection log lines; results go to the real stdout.
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+Benchmark: serving the bundled web app from the control port.
+
+Loads remo-web-app.tar.gz into the in-memory AssetCache, serves it through
+serve_single_port() on localhost and measures cold page loads (new
+connection + index.html) and keep-alive requests/sec.
+
+Run from the repository root:  python benchmarks/bench_web_assets.py
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from single_port import serve_single_port
+from web_assets import AssetCache
+
+HOST = '127.0.0.1'
+COLD_LOADS = 300
+CONNECTIONS = 8
+REQUESTS_PER_CONNECTION = 2000
+REQUEST = b'GET / HTTP/1.1\r\nHost: bench\r\nAccept-Encoding: gzip, br\r\n\r\n'
+REVALIDATE = b'GET / HTTP/1.1\r\nHost: bench\r\nAccept-Encoding: gzip, br\r\nIf-None-Match: %s\r\n\r\n'
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = 0
+    for line in head.split(b'\r\n'):
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    if length and not head.startswith(b'HTTP/1.1 304'):
+        await reader.readexactly(length)
+    return head
+
+
+async def cold_load(port):
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(REQUEST)
+    await read_response(reader)
+    elapsed = time.perf_counter() - start
+    writer.close()
+    await writer.wait_closed()
+    return elapsed
+
+
+async def keep_alive_client(port, request):
+    reader, writer = await asyncio.open_connection(HOST, port)
+    for _ in range(REQUESTS_PER_CONNECTION):
+        writer.write(request)
+        await read_response(reader)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def requests_per_second(port, request):
+    start = time.perf_counter()
+    await asyncio.gather(*(keep_alive_client(port, request) for _ in range(CONNECTIONS)))
+    return CONNECTIONS * REQUESTS_PER_CONNECTION / (time.perf_counter() - start)
+
+
+async def main():
+    start = time.perf_counter()
+    assets = AssetCache.from_tarball(os.path.join(ROOT, 'remo-web-app.tar.gz'))
+    print(f"startup: loaded {len(assets.assets)} assets in {(time.perf_counter() - start) * 1e3:.1f} ms", file=sys.__stdout__)
+    index = assets.assets['/']
+    sizes = ', '.join(f"{encoding} {len(body)} B" for encoding, body in index.bodies.items())
+    print(f"inlined index.html: {sizes}", file=sys.__stdout__)
+
+    async with serve_single_port(lambda websocket: None, lambda line: None, HOST, 0, assets=assets) as server:
+        port = server.sockets[0].getsockname()[1]
+        samples = [await cold_load(port) for _ in range(COLD_LOADS)]
+        print(f"cold page load (connect + GET /): median {statistics.median(samples) * 1e6:.0f} us", file=sys.__stdout__)
+        rps = await requests_per_second(port, REQUEST)
+        print(f"keep-alive GET / ({CONNECTIONS} connections): {rps:,.0f} req/s", file=sys.__stdout__)
+        rps = await requests_per_second(port, REVALIDATE % index.etag.encode())
+        print(f"keep-alive 304 revalidation:          {rps:,.0f} req/s", file=sys.__stdout__)
+
+
+if __name__ == '__main__':
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(main())
@@ -0,0 +1,275 @@
+"""
+Resumable client sessions.
+
+A phone that roams between access points or wakes from sleep loses its
+TCP connection. Instead of starting over, it presents its session on the
+new connection and carries on where it left off: same session (and keys,
+when paired), same reliable-UDP sequence numbers, same held keys and
+buttons.
+
+Without pairing the server issues a random token:
+
+    client -> server   session                   (first connection)
+    client -> server   session,<token>           (reconnecting)
+    server -> client   session,<token>,<1 if resumed else 0>,<idle timeout seconds>
+
+An unknown or expired token simply gets a new session. The line may be
+followed straight away by commands; no need to wait for the reply.
+Anyone who can connect can ask for sessions, so there are at most
+MAX_SESSIONS of them: a new one takes the place of the least recently
+active session without a connection. While every session has one,
+'session' is answered with 'sessionfull'.
+With pairing, the paired session itself is the token and the client
+reconnects with 'resume,...' (see secure_channel.py).
+
+UDP datagrams from a paired client carry their session id already. Without
+pairing, a client whose address changed sends one 'session,<token>'
+datagram so its reliable-UDP state follows it to the new address.
+
+A session with no open connection is idle. After SESSION_IDLE_TIMEOUT
+every key and button it still holds down is released, and after
+SESSION_EXPIRY it is forgotten (a paired client then has to pair again).
+A client that pairs but never sends a command has no session here; its
+pairing is forgotten after SESSION_EXPIRY as well.
+A connection that has gone silent for SESSION_STALE_TIMEOUT counts as
+idle too, since after roaming the old TCP connection may never report
+that it is gone.
+"""
+
+import secrets
+import threading
+import time
+
+from secure_channel import HEADER
+
+# --- Configuration ---
+SESSION_IDLE_TIMEOUT = 5.0    # Seconds without a connection before held keys and buttons are released
+SESSION_STALE_TIMEOUT = 60.0  # ... or with a connection but no input at all
+SESSION_EXPIRY = 1800.0       # Seconds without a connection before the session is forgotten
+MAX_SESSIONS = 64             # Unpaired sessions kept at once; see handle_line()
+SWEEP_INTERVAL = 1.0
+
+
+class ClientSession:
+    """Everything about one client that should survive a reconnect."""
+    def __init__(self, token, secure=None):
+        self.token = token
+        self.secure = secure        # secure_channel.Session when paired
+        self.reliable = None        # reliable_udp peer state, kept across address changes
+        self.pressed = set()        # (kind, name) held down on the host, kind 'key' or 'button'
+        self.send_interval = None   # Recommended seconds between moves; see rate_feedback.py
+        self.rate_advice = None     # (interval, coalesce) last sent to the client
+        self.rate_sent_at = 0.0
+        self.sender = None          # send(line) of the newest connection that can take server pushes
+        self.connections = 0
+        self.last_active = time.monotonic()
+
+    def press(self, kind, name):
+        self.pressed.add((kind, name))
+
+    def release(self, kind, name):
+        self.pressed.discard((kind, name))
+
+    def notify(self, line):
+        """Pushes a server-initiated line to the client. Returns False if it can't be delivered."""
+        sender = self.sender
+        if sender is None:
+            return False
+        try:
+            sender(line)
+        except (OSError, RuntimeError):
+            return False
+        return True
+
+
+class SessionRegistry:
+    """
+    All client sessions of one server. release_input(kind, name) is called
+    for every key or button an idle session still holds.
+    """
+    def __init__(self, pairing=None, release_input=None):
+        self.pairing = pairing
+        self.release_input = release_input
+        self.sessions = {}      # token -> ClientSession
+        self.by_secure_id = {}  # paired session id -> ClientSession
+        self.addresses = {}     # UDP address -> ClientSession (unpaired clients)
+        self.lock = threading.Lock()
+
+    def handle_line(self, line, protocol):
+        """
+        Handles 'session[,<token>]' from a 'TCP' or 'WebSocket' connection.
+        Returns (reply line, session); session is None if the reply is 'sessionfull'.
+        """
+        command = line.strip().split(',')
+        token = command[1] if len(command) > 1 else ''
+        evicted = None
+        with self.lock:
+            session = self.sessions.get(token)
+            resumed = session is not None
+            if not resumed:
+                unpaired = [s for s in self.sessions.values() if s.secure is None]
+                if len(unpaired) >= MAX_SESSIONS:
+                    idle = [s for s in unpaired if s.connections == 0]
+                    if not idle:
+                        print(f"⚠️ Refused a new {protocol} client session: {MAX_SESSIONS} in use")
+                        return 'sessionfull', None
+                    evicted = min(idle, key=lambda s: s.last_active)
+                    self._forget(evicted)
+                session = ClientSession(secrets.token_hex(16))
+                self.sessions[session.token] = session
+            session.last_active = time.monotonic()
+        if evicted is not None:
+            print(f"⌛ Client session {evicted.token[:8]} dropped to make room")
+            self._release(evicted)
+        print(f"{'🔁 Resumed' if resumed else '🆕 New'} {protocol} client session {session.token[:8]}")
+        return f"session,{session.token},{int(resumed)},{SESSION_IDLE_TIMEOUT:g}", session
+
+    def adopt(self, secure):
+        """Returns the ClientSession for a paired (or resumed) secure_channel.Session."""
+        with self.lock:
+            session = self.by_secure_id.get(secure.session_id)
+            if session is None:
+                session = ClientSession(f"{secure.session_id:08x}", secure)
+                self.sessions[session.token] = session
+                self.by_secure_id[secure.session_id] = session
+            session.last_active = time.monotonic()
+        return session
+
+    def connected(self, session):
+        with self.lock:
+            session.connections += 1
+            session.last_active = time.monotonic()
+
+    def disconnected(self, session):
+        with self.lock:
+            session.connections -= 1
+            session.last_active = time.monotonic()
+
+    def for_datagram(self, receiver):
+        """The session a received datagram (udp_fastpath.DatagramReceiver) belongs to, or None."""
+        if self.pairing is not None:
+            # receive() has authenticated it, so the session id is genuine.
+            session_id = HEADER.unpack_from(receiver.packet)[0]
+            session = self.by_secure_id.get(session_id)
+            if session is None and session_id in self.pairing.sessions:
+                session = self.adopt(self.pairing.sessions[session_id])
+        else:
+            session = self.addresses.get(receiver.address)
+        if session is not None:
+            session.last_active = time.monotonic()
+        return session
+
+    def bind_address(self, token, address):
+        """Handles a 'session,<token>' datagram: future datagrams from address belong to that session."""
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return False
+            for old in [a for a, s in self.addresses.items() if s is session]:
+                del self.addresses[old]
+            self.addresses[address] = session
+            session.last_active = time.monotonic()
+        return True
+
+    def sweep(self):
+        """Releases the inputs of idle sessions and forgets expired ones."""
+        now = time.monotonic()
+        to_release = []
+        with self.lock:
+            for token, session in list(self.sessions.items()):
+                idle = now - session.last_active
+                limit = SESSION_IDLE_TIMEOUT if session.connections == 0 else SESSION_STALE_TIMEOUT
+                if idle > limit and session.pressed:
+                    to_release.append(session)
+                if session.connections == 0 and idle > SESSION_EXPIRY:
+                    self._forget(session)
+                    print(f"⌛ Client session {token[:8]} expired")
+            if self.pairing is not None:
+                for session_id, secure in list(self.pairing.sessions.items()):
+                    if session_id not in self.by_secure_id and now - secure.created > SESSION_EXPIRY:
+                        self.pairing.forget(session_id)
+                        print(f"⌛ Unused pairing {session_id:08x} expired")
+
+        for session in to_release:
+            print(f"⌛ Client session {session.token[:8]} idle, releasing {len(session.pressed)} held input(s)")
+            self._release(session)
+
+    def _forget(self, session):
+        # Call with self.lock held.
+        del self.sessions[session.token]
+        for address in [a for a, s in self.addresses.items() if s is session]:
+            del self.addresses[address]
+        if session.secure is not None:
+            self.by_secure_id.pop(session.secure.session_id, None)
+            self.pairing.forget(session.secure.session_id)
+
+    def _release(self, session):
+        for kind, name in list(session.pressed):
+            session.release(kind, name)
+            if self.release_input is not None:
+                try:
+                    self.release_input(kind, name)
+                except Exception as e:
+                    print(f"⚠️ Could not release {kind} '{name}': {e}")
+
+    def start(self):
+        """Runs sweep() every SWEEP_INTERVAL seconds in a daemon thread."""
+        def run():
+            while True:
+                time.sleep(SWEEP_INTERVAL)
+                self.sweep()
+        threading.Thread(target=run, daemon=True, name='session-sweeper').start()
+
+
+class SessionLink:
+    """
+    Ties one TCP or WebSocket connection to its ClientSession.
+    Pass every incoming command through handle(), which returns
+    (reply line or None, what is left of the command or None).
+    send(line), if given, delivers server pushes such as rate advice on
+    this connection (sealed when paired); it may be called from any thread.
+    """
+    def __init__(self, registry, protocol, stream=None, send=None):
+        self.registry = registry
+        self.protocol = protocol
+        self.stream = stream
+        self.send = send
+        self.session = None
+
+    def handle(self, command_str):
+        reply = None
+        if self.stream is not None:
+            # Paired: the secure session established on this stream is the token.
+            if self.session is None and self.stream.session is not None:
+                self._attach(self.registry.adopt(self.stream.session))
+        elif command_str.startswith('session,') or command_str.strip() == 'session':
+            # Commands may be pipelined right behind the session line.
+            line, _, command_str = command_str.partition('\n')
+            reply, session = self.registry.handle_line(line, self.protocol)
+            if session is not None and session is not self.session:
+                self._attach(session)
+            if not command_str.strip():
+                command_str = None
+        if self.session is not None:
+            self.session.last_active = time.monotonic()
+        return reply, command_str
+
+    def _attach(self, session):
+        if self.session is not None:
+            self._detach()
+        self.session = session
+        if self.send is not None:
+            session.sender = self.send
+        self.registry.connected(session)
+
+    def _detach(self):
+        if self.session.sender is self.send:
+            self.session.sender = None
+        self.registry.disconnected(self.session)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+        if self.session is not None:
+            self._detach()
+            self.session = None
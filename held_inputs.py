@@ -0,0 +1,154 @@
+"""
+Press, hold and release for keys and mouse buttons.
+
+'mclick' and 'kpress' do a whole press and release, so dragging or holding
+an arrow key used to mean spamming the network at the repeat rate. These
+commands split them up:
+
+    mdown,<button>   mup,<button>      left, right or middle
+    kdown,<key>      kup,<key>         any key name or character kpress takes
+
+While a key is held the server repeats it itself, after REPEAT_DELAY at
+REPEAT_RATE per second, so holding a key costs two messages. On Linux the
+display server (X11, or the Wayland client) already repeats held keys, so
+AUTOREPEAT is off there to avoid double repeats.
+
+A hold made within a client session (client_sessions.py) lasts until its
+'up', or until the session goes idle: its connection closes, or it sends
+nothing at all for SESSION_STALE_TIMEOUT (moves during a drag count). A
+hold made without a session has nothing to tell that the client is gone,
+so it is released after HOLD_TIMEOUT; such a client must resend the same
+'down' every few seconds while it holds, which only refreshes the timeout.
+In reliable UDP mode (reliable_udp.py) these commands are sent as 'rel'
+datagrams, like clicks.
+"""
+
+import sys
+import threading
+import time
+
+# --- Configuration ---
+REPEAT_DELAY = 0.5     # Seconds a key is held before it starts repeating
+REPEAT_RATE = 30.0     # Repeats per second after that
+HOLD_TIMEOUT = 30.0    # Seconds without a refresh before a hold made without a session is released
+AUTOREPEAT = not sys.platform.startswith('linux')  # X11 and Wayland repeat held keys themselves
+
+KEY, BUTTON = 'key', 'button'
+MOUSE_BUTTONS = ('left', 'right', 'middle')
+
+# Command -> (kind, pressed)
+HOLD_COMMANDS = {
+    'mdown': (BUTTON, True), 'mup': (BUTTON, False),
+    'kdown': (KEY, True), 'kup': (KEY, False),
+}
+
+
+class _Hold:
+    def __init__(self, session, next_repeat, expires):
+        self.session = session
+        self.next_repeat = next_repeat  # None if this hold doesn't repeat
+        self.expires = expires          # None if the session releases it
+
+
+class HeldInputs:
+    """
+    Keys and buttons held down on this host, with autorepeat and the safety
+    timeout running in a background thread. The backend callables take a
+    key name or a button name ('left', 'right', 'middle').
+    """
+    def __init__(self, key_down, key_up, mouse_down, mouse_up, autorepeat=AUTOREPEAT,
+                 repeat_delay=REPEAT_DELAY, repeat_rate=REPEAT_RATE, hold_timeout=HOLD_TIMEOUT):
+        self.backend = {KEY: (key_down, key_up), BUTTON: (mouse_down, mouse_up)}
+        self.autorepeat = autorepeat
+        self.repeat_delay = repeat_delay
+        self.repeat_interval = 1.0 / repeat_rate
+        self.hold_timeout = hold_timeout
+        self.holds = {}     # (kind, name) -> _Hold
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def command(self, action, name, session=None):
+        """Handles 'mdown', 'mup', 'kdown' or 'kup'. Returns False for an unknown button or no key."""
+        kind, pressed = HOLD_COMMANDS[action]
+        if not name or (kind == BUTTON and name not in MOUSE_BUTTONS):
+            return False
+        if pressed:
+            self.down(kind, name, session)
+        else:
+            self.up(kind, name)
+        return True
+
+    def down(self, kind, name, session=None):
+        """Presses and holds; a repeat while held just refreshes the safety timeout."""
+        now = time.monotonic()
+        with self.cond:
+            hold = self.holds.get((kind, name))
+            if hold is not None:
+                if hold.expires is not None:
+                    hold.expires = now + self.hold_timeout
+                return
+            repeats = kind == KEY and self.autorepeat
+            self.holds[(kind, name)] = _Hold(session, now + self.repeat_delay if repeats else None,
+                                             now + self.hold_timeout if session is None else None)
+            self.cond.notify()
+        if session is not None:
+            session.press(kind, name)
+        self.backend[kind][0](name)
+
+    def up(self, kind, name):
+        """Releases, whether or not it is still held here (the client thinks it is)."""
+        with self.cond:
+            hold = self.holds.pop((kind, name), None)
+        if hold is not None and hold.session is not None:
+            hold.session.release(kind, name)
+        self.backend[kind][1](name)
+
+    def buttons(self):
+        """Names of the mouse buttons held right now."""
+        return [name for kind, name in list(self.holds) if kind == BUTTON]
+
+    def release_all(self):
+        for kind, name in list(self.holds):
+            self.up(kind, name)
+
+    def _next_due(self):
+        due = [hold.expires for hold in self.holds.values() if hold.expires is not None]
+        due += [hold.next_repeat for hold in self.holds.values() if hold.next_repeat is not None]
+        return min(due, default=None)
+
+    def _run(self):
+        while True:
+            repeat, expired = [], []
+            with self.cond:
+                due = self._next_due()
+                now = time.monotonic()
+                if due is None or due > now:
+                    self.cond.wait(None if due is None else due - now)
+                    continue
+                for key, hold in self.holds.items():
+                    if hold.expires is not None and hold.expires <= now:
+                        expired.append(key)
+                    elif hold.next_repeat is not None and hold.next_repeat <= now:
+                        repeat.append(key[1])
+                        hold.next_repeat += self.repeat_interval
+                        if hold.next_repeat <= now:
+                            # Skip repeats we were too busy for instead of bursting them out.
+                            hold.next_repeat = now + self.repeat_interval
+
+            for name in repeat:
+                try:
+                    self.backend[KEY][0](name)
+                except Exception as e:
+                    print(f"⚠️ Key repeat failed for '{name}': {e}")
+            for kind, name in expired:
+                print(f"⌛ Releasing {kind} '{name}': held for {self.hold_timeout:g}s without a refresh")
+                try:
+                    self.up(kind, name)
+                except Exception as e:
+                    print(f"⚠️ Could not release {kind} '{name}': {e}")
+
+    def start(self):
+        """Starts the autorepeat / safety timeout thread."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True, name='held-inputs')
+            self.thread.start()
@@ -1,22 +1,115 @@
+import contextlib
 import socket
 import threading
 import json
+import sys
 from pynput.mouse import Button, Controller as MouseController
-from pynput.keyboard import Key, Controller as KeyboardController
+from pynput.keyboard import Key, KeyCode, Controller as KeyboardController
+from keymap import load_keymap, PYAUTOGUI_KEYS, SHIFT, CTRL, ALT, ALTGR, META
+from secure_channel import PairingServer, SecureStream
+from udp_fastpath import DatagramReceiver, MMOVE, SCROLL
+from reliable_udp import ReliableChannel
+from client_sessions import SessionLink, SessionRegistry
+from rate_feedback import RateController
+from held_inputs import HeldInputs
+from runtime_profiler import RuntimeProfiler, injection_targets
 
 # --- Configuration ---
 HOST = '0.0.0.0'
 TCP_PORT = 5000       # For reliable commands (Clicks, Keystrokes)
 UDP_PORT = 5001       # For fast commands (Mouse Movement, Scroll)
 BUFFER_SIZE = 1024 
+REQUIRE_PAIRING = False # Only accept commands from clients paired with the on-screen code;
+                        # off until the iOS and bundled web apps can pair (secure_channel.py)
+RELIABLE_UDP = True     # Accept sequenced, acked clicks and keys on the UDP port; see reliable_udp.py
+RATE_FEEDBACK = True    # Tell clients how often to send moves so the host keeps up; see rate_feedback.py
+PROFILING = True        # Let SIGUSR1/SIGUSR2 or an admin 'profile' switch on the profiler; see runtime_profiler.py
+
+# Set at startup when REQUIRE_PAIRING is on; see secure_channel.py.
+pairing = None
+# Resumable client sessions, set at startup; see client_sessions.py.
+sessions = None
+# Runtime profiler, switched off until asked; see runtime_profiler.py.
+profiler = None
+# Send-rate advice for moves over UDP and TCP, set at startup; see rate_feedback.py.
+rate = None
 
 # --- Controllers for Input Injection ---
 mouse = MouseController()
 keyboard = KeyboardController()
 
+# --- Keymap (key names -> pynput keys, compiled once at startup) ---
+
+PYNPUT_KEYS = {
+    'enter': 'enter', 'space': 'space', 'backspace': 'backspace', 'tab': 'tab',
+    'esc': 'esc', 'delete': 'delete', 'insert': 'insert', 'capslock': 'caps_lock',
+    'leftshift': 'shift_l', 'rightshift': 'shift_r', 'leftctrl': 'ctrl_l', 'rightctrl': 'ctrl_r',
+    'leftalt': 'alt_l', 'rightalt': 'alt_r', 'leftmeta': 'cmd_l', 'rightmeta': 'cmd_r',
+    'up': 'up', 'down': 'down', 'left': 'left', 'right': 'right', 'home': 'home', 'end': 'end',
+    'pageup': 'page_up', 'pagedown': 'page_down', 'volumeup': 'media_volume_up',
+    'volumedown': 'media_volume_down', 'mute': 'media_volume_mute',
+}
+PYNPUT_KEYS.update({f'f{i}': f'f{i}' for i in range(1, 13)})
+PYNPUT_MODIFIERS = {SHIFT: Key.shift, CTRL: Key.ctrl, ALT: Key.alt, ALTGR: Key.alt_gr, META: Key.cmd}
+
+def resolve_pynput_key(name):
+    if name in PYNPUT_KEYS:
+        # Some keys (e.g. insert on macOS) don't exist on every platform.
+        return getattr(Key, PYNPUT_KEYS[name], None)
+    return KeyCode.from_char(PYAUTOGUI_KEYS.get(name, name))
+
+# A layout without a bundled table gets key names only; pynput types the rest.
+KEYMAP = load_keymap(fallback=None).resolve(resolve_pynput_key, PYNPUT_MODIFIERS.get)
+
+# Only Linux reports its keyboard layout to keymap.py, so elsewhere KEYMAP is
+# the 'us' one. pynput finds a character's key in the OS's active layout
+# itself, so characters are left to it there and KEYMAP only handles key names.
+OS_TYPES_CHARACTERS = not sys.platform.startswith('linux')
+
+def keystrokes(key_name):
+    """The (modifiers, key) strokes for key_name; characters left to pynput are one bare stroke."""
+    character = len(key_name) == 1 and key_name.isprintable()
+    strokes = None if OS_TYPES_CHARACTERS and character else KEYMAP.get(key_name)
+    if strokes is None and character:
+        strokes = (((), KeyCode.from_char(key_name)),)
+    return strokes
+
+# --- Held Keys and Buttons (mouse/keyboard 'down' and 'up'; see held_inputs.py) ---
+
+BUTTONS = {'left': Button.left, 'right': Button.right, 'middle': Button.middle}
+
+def held_strokes(key_name):
+    """The one (modifiers, key) stroke for key_name, or None if it can't be held."""
+    strokes = keystrokes(key_name)
+    if strokes and len(strokes) == 1 and strokes[0][1] is not None:
+        return strokes[0]
+    return None
+
+def key_down(key_name):
+    stroke = held_strokes(key_name)
+    if stroke is None:
+        return
+    mods, key = stroke
+    for mod in mods:
+        keyboard.press(mod)
+    keyboard.press(key)
+
+def key_up(key_name):
+    stroke = held_strokes(key_name)
+    if stroke is None:
+        return
+    mods, key = stroke
+    keyboard.release(key)
+    for mod in reversed(mods):
+        keyboard.release(mod)
+
+held = HeldInputs(key_down, key_up,
+                  lambda button: mouse.press(BUTTONS[button]),
+                  lambda button: mouse.release(BUTTONS[button]))
+
 # --- Command Handling Functions (Same as before, but called from different sockets) ---
 
-def handle_input(data):
+def handle_input(data, session=None):
     """Parses data and calls the appropriate handler."""
     if 'category' in data:
         if data['category'] == 'mouse':
@@ -35,6 +128,12 @@ def handle_input(data):
                 mouse.click(button, 1)
                 return f"[RELIABLE] Mouse click: {button_str}"
 
+            elif data['type'] in ('down', 'up'):
+                # Press and hold for dragging, until the matching 'up'
+                button_str = data.get('button', 'left').lower()
+                if held.command('mdown' if data['type'] == 'down' else 'mup', button_str, session):
+                    return f"[RELIABLE] Mouse {data['type']}: {button_str}"
+
         elif data['category'] == 'keyboard':
             # Handle keyboard reliably (TCP)
             if data['type'] == 'char':
@@ -42,12 +141,25 @@ def handle_input(data):
                 return f"[RELIABLE] Typed: '{data.get('char')}'"
             
             elif data['type'] == 'key':
-                key_map = {'enter': Key.enter, 'space': Key.space, 'backspace': Key.backspace}
-                pynput_key = key_map.get(data.get('key').lower())
-                if pynput_key:
-                    keyboard.press(pynput_key)
-                    keyboard.release(pynput_key)
+                strokes = keystrokes(data.get('key', ''))
+                if strokes and all(key is not None for _, key in strokes):
+                    for mods, key in strokes:
+                        with keyboard.pressed(*mods):
+                            keyboard.press(key)
+                            keyboard.release(key)
                     return f"[RELIABLE] Pressed key: {data.get('key')}"
+
+            elif data['type'] in ('down', 'up') and data.get('key'):
+                # Held keys repeat on the server until the matching 'up'
+                held.command('kdown' if data['type'] == 'down' else 'kup', data.get('key', ''), session)
+                return f"[RELIABLE] Key {data['type']}: {data.get('key')}"
+
+        elif data['category'] == 'admin':
+            # {"category": "admin", "type": "profile", "mode": "sample" | "inject", "seconds": 10}
+            if data['type'] == 'profile' and profiler:
+                args = [data.get('mode', '')] + ([str(data['seconds'])] if 'seconds' in data else [])
+                if profiler.command(args):
+                    return f"[ADMIN] Profiling: {data.get('mode')}"
     return "[ERROR] Unknown command"
 
 
@@ -61,10 +173,35 @@ def udp_listener():
     udp_socket.bind((HOST, UDP_PORT))
     print(f"UDP Listener started on port {UDP_PORT}")
     
+    receiver = DatagramReceiver(udp_socket, pairing, BUFFER_SIZE)
+    reliable = ReliableChannel(udp_socket, pairing, sessions) if RELIABLE_UDP else None
+    fields = receiver.fields
+    apply = lambda message: handle_input(
+        json.loads(message), sessions.for_datagram(receiver) if sessions else None)
     while True:
         try:
-            data_bytes, addr = udp_socket.recvfrom(BUFFER_SIZE)
-            message = data_bytes.decode('utf-8').strip()
+            if rate:
+                rate.waiting()
+            if not receiver.receive():
+                continue  # Unpaired, forged or replayed
+            if rate:
+                rate.received(receiver)  # Measures queue delay and per-client load
+            # Sequenced clicks/keys and the moves queued behind them go through apply()
+            start = reliable.feed(receiver, apply) if reliable else 0
+            if start < 0:
+                continue
+
+            # Integer moves/scrolls are read straight out of the receive
+            # buffer; anything else takes the json.loads path below
+            kind = receiver.parse_json(start)
+            if kind == MMOVE:
+                mouse.move(fields[0], fields[1])
+                continue
+            elif kind == SCROLL:
+                mouse.scroll(0, fields[0])
+                continue
+
+            message = receiver.text(start).strip()
             
             # Note: We expect UDP packets to be single, complete JSON objects
             data = json.loads(message)
@@ -86,25 +223,54 @@ def udp_listener():
 def tcp_client_handler(conn, addr):
     """Handles reliable commands from a single TCP client."""
     data_buffer = ""
+    stream = SecureStream(pairing, addr[0]) if pairing else None
+    send_lock = threading.Lock()
+
+    def write(data):
+        # Replies and server pushes come from different threads
+        with send_lock:
+            conn.sendall(data)
+
+    def send(line):
+        # Server pushes ('rate,...' advice) arrive from the rate feedback thread
+        write(stream.seal(line) if stream else (line + '\n').encode())
+
+    link = SessionLink(sessions, 'TCP', stream, send)
     print(f"\n[TCP] Client connected: {addr}")
     
     try:
         while True:
-            data_chunk = conn.recv(BUFFER_SIZE).decode('utf-8')
-            if not data_chunk:
+            data_bytes = conn.recv(BUFFER_SIZE)
+            if not data_bytes:
                 break
 
-            data_buffer += data_chunk
-            
-            # Process complete JSON messages separated by '\n'
-            while '\n' in data_buffer:
-                message, data_buffer = data_buffer.split('\n', 1)
-                
-                if not message.strip(): continue
+            if stream is None:
+                data_buffer += data_bytes.decode('utf-8')
+                messages = []
+                # Process complete JSON messages separated by '\n'
+                while '\n' in data_buffer:
+                    message, data_buffer = data_buffer.split('\n', 1)
+                    messages.append(message)
+            else:
+                # Paired clients send sealed, length-prefixed packets
+                reply, messages = stream.feed(data_bytes)
+                if reply:
+                    write(reply)
+                if stream.closed:
+                    break
+
+            for message in messages:
+                # 'session[,<token>]' lines resume a client session (client_sessions.py)
+                reply, message = link.handle(message)
+                if reply:
+                    write((reply + '\n').encode())
+                if not message or not message.strip(): continue
 
                 try:
                     data = json.loads(message)
-                    result = handle_input(data)
+                    # Moves over TCP are measured for rate advice like UDP ones
+                    with rate.command(link.session) if rate else contextlib.nullcontext():
+                        result = handle_input(data, link.session)
                     # Print all reliable commands
                     if '[RELIABLE]' in result:
                          print(result)
@@ -114,6 +280,7 @@ def tcp_client_handler(conn, addr):
                 
     finally:
         print(f"[TCP] Connection closed from {addr}")
+        link.close()
         conn.close()
 
 
@@ -145,6 +312,24 @@ if __name__ == '__main__':
     print(f" Host IP: {socket.gethostbyname(socket.gethostname())}")
     print(" Press Ctrl+C to stop.")
     print("--------------------------------------------------")
+
+    if REQUIRE_PAIRING:
+        try:
+            pairing = PairingServer()
+        except RuntimeError as e:
+            print(f"[ERROR] {e}")
+            sys.exit(1)
+    held.start()
+    sessions = SessionRegistry(pairing, held.up)
+    sessions.start()
+    rate = RateController(sessions) if RATE_FEEDBACK else None
+    if rate:
+        rate.start()
+    if PROFILING:
+        profiler = RuntimeProfiler(
+            injection_targets(mouse, 'move', 'scroll', 'click', 'press', 'release', prefix='mouse')
+            + injection_targets(keyboard, 'type', 'press', 'release', prefix='keyboard'))
+        profiler.install_signals()
     
     # Start both listeners in separate threads
     tcp_thread = threading.Thread(target=tcp_listener, daemon=True)
@@ -0,0 +1,366 @@
+"""
+Keymap compiler shared by every server backend.
+
+At startup the active keyboard layout is compiled into a flat table that
+maps every printable character (and every named key such as 'enter' or
+'f5') to the sequence of keystrokes needed to produce it. Each keystroke is
+a (modifier mask, key name) pair, where the key name is the lowercase Linux
+evdev name without its KEY_ prefix ('a', '1', 'semicolon', 'leftbrace').
+
+Backends turn those names into whatever they inject (uinput events, X
+keycodes, pyautogui names) once with Keymap.resolve(), so a key press at
+runtime is a single dict lookup. Characters the layout cannot produce fall
+back to the desktop's Unicode entry sequence where one exists.
+
+Only the bundled layouts can be compiled. For any other layout a backend
+that has its own way to type a character (xdotool keysyms, pyautogui,
+pynput) asks for a table of key names only and types characters itself,
+since a US table would send the wrong physical keys ('z' is 'y' on a
+German keyboard). Raw uinput has no such path and gets the US table.
+
+The compiled table is cached on disk so later starts only have to load it.
+The cache records a digest of the layout data it was compiled from, so
+editing a layout (or the key tables) recompiles it without a version bump.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'hybrid-input-server')
+DEFAULT_LAYOUT = 'us'
+
+# --- Modifier Mask Bits ---
+SHIFT = 1
+CTRL = 2
+ALT = 4
+ALTGR = 8
+META = 16
+
+MODIFIER_KEYS = (
+    (SHIFT, 'leftshift'),
+    (CTRL, 'leftctrl'),
+    (ALT, 'leftalt'),
+    (ALTGR, 'rightalt'),
+    (META, 'leftmeta'),
+)
+
+# --- Linux evdev Key Codes (linux/input-event-codes.h) ---
+EVDEV_CODES = {
+    'esc': 1, 'minus': 12, 'equal': 13, 'backspace': 14, 'tab': 15,
+    'leftbrace': 26, 'rightbrace': 27, 'enter': 28, 'leftctrl': 29,
+    'semicolon': 39, 'apostrophe': 40, 'grave': 41, 'leftshift': 42,
+    'backslash': 43, 'comma': 51, 'dot': 52, 'slash': 53, 'rightshift': 54,
+    'leftalt': 56, 'space': 57, 'capslock': 58, '102nd': 86,
+    'rightctrl': 97, 'rightalt': 100, 'home': 102, 'up': 103, 'pageup': 104,
+    'left': 105, 'right': 106, 'end': 107, 'down': 108, 'pagedown': 109,
+    'insert': 110, 'delete': 111, 'mute': 113, 'volumedown': 114,
+    'volumeup': 115, 'leftmeta': 125, 'rightmeta': 126,
+}
+
+for _i, _row in enumerate(('qwertyuiop', 'asdfghjkl', 'zxcvbnm')):
+    for _j, _char in enumerate(_row):
+        EVDEV_CODES[_char] = (16, 30, 44)[_i] + _j
+
+for _i in range(1, 10):
+    EVDEV_CODES[str(_i)] = _i + 1
+EVDEV_CODES['0'] = 11
+
+for _i in range(1, 11):
+    EVDEV_CODES[f'f{_i}'] = 58 + _i
+EVDEV_CODES['f11'] = 87
+EVDEV_CODES['f12'] = 88
+
+# Keys that only ever appear by name, never as a typed character.
+NAMED_KEYS = (
+    'enter', 'space', 'backspace', 'tab', 'esc', 'delete', 'insert', 'capslock',
+    'leftshift', 'rightshift', 'leftctrl', 'rightctrl',
+    'leftalt', 'rightalt', 'leftmeta', 'rightmeta',
+    'up', 'down', 'left', 'right', 'home', 'end', 'pageup', 'pagedown',
+    'volumeup', 'volumedown', 'mute',
+    'semicolon', 'apostrophe', 'grave', 'comma', 'dot', 'slash', 'backslash',
+    'minus', 'equal', 'leftbrace', 'rightbrace',
+) + tuple(f'f{i}' for i in range(1, 13))
+
+# Alternative spellings clients send (mostly pyautogui key names).
+KEY_ALIASES = {
+    'return': 'enter', 'escape': 'esc', 'del': 'delete', 'ins': 'insert',
+    'volumemute': 'mute', 'pgup': 'pageup', 'pgdn': 'pagedown',
+    'shift': 'leftshift', 'shiftleft': 'leftshift', 'shiftright': 'rightshift',
+    'ctrl': 'leftctrl', 'ctrlleft': 'leftctrl', 'ctrlright': 'rightctrl',
+    'alt': 'leftalt', 'altleft': 'leftalt', 'altright': 'rightalt',
+    'win': 'leftmeta', 'winleft': 'leftmeta', 'winright': 'rightmeta',
+    'command': 'leftmeta', 'cmd': 'leftmeta', 'super': 'leftmeta',
+    'period': 'dot', 'caps': 'capslock',
+}
+
+# --- Layouts ---
+# Each layout maps a character to (modifier mask, key name). Letters, digits
+# and whitespace are shared by every layout and added by _compile_table().
+
+LAYOUTS = {
+    'us': {
+        '`': (0, 'grave'), '~': (SHIFT, 'grave'),
+        '!': (SHIFT, '1'), '@': (SHIFT, '2'), '#': (SHIFT, '3'),
+        '$': (SHIFT, '4'), '%': (SHIFT, '5'), '^': (SHIFT, '6'),
+        '&': (SHIFT, '7'), '*': (SHIFT, '8'), '(': (SHIFT, '9'),
+        ')': (SHIFT, '0'),
+        '-': (0, 'minus'), '_': (SHIFT, 'minus'),
+        '=': (0, 'equal'), '+': (SHIFT, 'equal'),
+        '[': (0, 'leftbrace'), '{': (SHIFT, 'leftbrace'),
+        ']': (0, 'rightbrace'), '}': (SHIFT, 'rightbrace'),
+        '\\': (0, 'backslash'), '|': (SHIFT, 'backslash'),
+        ';': (0, 'semicolon'), ':': (SHIFT, 'semicolon'),
+        "'": (0, 'apostrophe'), '"': (SHIFT, 'apostrophe'),
+        ',': (0, 'comma'), '<': (SHIFT, 'comma'),
+        '.': (0, 'dot'), '>': (SHIFT, 'dot'),
+        '/': (0, 'slash'), '?': (SHIFT, 'slash'),
+    },
+}
+
+LAYOUTS['gb'] = dict(LAYOUTS['us'], **{
+    '"': (SHIFT, '2'), '£': (SHIFT, '3'), '@': (SHIFT, 'apostrophe'),
+    '#': (0, 'backslash'), '~': (SHIFT, 'backslash'),
+    '\\': (0, '102nd'), '|': (SHIFT, '102nd'),
+    '¬': (SHIFT, 'grave'), '€': (ALTGR, '4'),
+})
+
+# --- Backend Name Tables ---
+
+# Named keys as xdotool keysyms. Typed characters are sent to xdotool as raw
+# X keycodes instead (evdev code + 8) so the active layout is honoured.
+XDOTOOL_KEYSYMS = {
+    'enter': 'Return', 'space': 'space', 'backspace': 'BackSpace', 'tab': 'Tab',
+    'esc': 'Escape', 'delete': 'Delete', 'insert': 'Insert', 'capslock': 'Caps_Lock',
+    'leftshift': 'Shift_L', 'rightshift': 'Shift_R',
+    'leftctrl': 'Control_L', 'rightctrl': 'Control_R',
+    'leftalt': 'Alt_L', 'rightalt': 'ISO_Level3_Shift',
+    'leftmeta': 'Super_L', 'rightmeta': 'Super_R',
+    'up': 'Up', 'down': 'Down', 'left': 'Left', 'right': 'Right',
+    'home': 'Home', 'end': 'End', 'pageup': 'Prior', 'pagedown': 'Next',
+    'volumeup': 'XF86AudioRaiseVolume', 'volumedown': 'XF86AudioLowerVolume',
+    'mute': 'XF86AudioMute',
+}
+XDOTOOL_KEYSYMS.update({f'f{i}': f'F{i}' for i in range(1, 13)})
+
+XDOTOOL_MODIFIERS = {SHIFT: 'shift', CTRL: 'ctrl', ALT: 'alt',
+                     ALTGR: 'ISO_Level3_Shift', META: 'super'}
+
+PYAUTOGUI_KEYS = {
+    'leftshift': 'shiftleft', 'rightshift': 'shiftright',
+    'leftctrl': 'ctrlleft', 'rightctrl': 'ctrlright',
+    'leftalt': 'altleft', 'rightalt': 'altright',
+    'leftmeta': 'winleft', 'rightmeta': 'winright', 'mute': 'volumemute',
+    'semicolon': ';', 'apostrophe': "'", 'grave': '`', 'comma': ',', 'dot': '.',
+    'slash': '/', 'backslash': '\\', '102nd': '\\', 'minus': '-', 'equal': '=',
+    'leftbrace': '[', 'rightbrace': ']',
+}
+
+PYAUTOGUI_MODIFIERS = {SHIFT: 'shift', CTRL: 'ctrl', ALT: 'alt',
+                       ALTGR: 'altright', META: 'command' if sys.platform == 'darwin' else 'win'}
+
+
+# --- Layout Detection ---
+
+def detect_layout():
+    """Returns the active keyboard layout name, e.g. 'us' or 'gb'."""
+    layout = os.environ.get('XKB_DEFAULT_LAYOUT')
+    if not layout and sys.platform.startswith('linux'):
+        layout = _query_layout(['setxkbmap', '-query'], 'layout:')
+        if not layout:
+            layout = _query_layout(['localectl', 'status'], 'X11 Layout:')
+    if not layout:
+        return DEFAULT_LAYOUT
+    # Multi-layout setups list every layout; the first one is active at startup.
+    return layout.split(',')[0].strip().lower()
+
+def _query_layout(cmd, prefix):
+    if not shutil.which(cmd[0]):
+        return None
+    try:
+        output = subprocess.run(cmd, capture_output=True, text=True, timeout=2).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith(prefix):
+            return line[len(prefix):].strip()
+    return None
+
+
+# --- Compilation ---
+
+def default_unicode_entry():
+    """Returns the Unicode entry method for this platform, or None."""
+    # GTK and IBus both accept Ctrl+Shift+U <hex> <space>. Windows and macOS
+    # need input-method changes first, so unsupported characters are dropped.
+    return 'ctrl_shift_u' if sys.platform.startswith('linux') else None
+
+def _compile_names():
+    table = {}
+    for name in NAMED_KEYS:
+        table[name] = ((0, name),)
+    for alias, name in KEY_ALIASES.items():
+        table[alias] = ((0, name),)
+    # Whitespace sits on the same keys on every layout.
+    table[' '] = ((0, 'space'),)
+    table['\n'] = ((0, 'enter'),)
+    table['\r'] = ((0, 'enter'),)
+    table['\t'] = ((0, 'tab'),)
+    return table
+
+def _compile_table(layout):
+    table = _compile_names()
+
+    for i in range(26):
+        char = chr(ord('a') + i)
+        table[char] = ((0, char),)
+        table[char.upper()] = ((SHIFT, char),)
+    for i in range(10):
+        table[str(i)] = ((0, str(i)),)
+
+    for char, stroke in LAYOUTS[layout].items():
+        table[char] = (stroke,)
+    return table
+
+def _unicode_strokes(char, method):
+    if method == 'ctrl_shift_u':
+        digits = tuple((0, digit) for digit in f'{ord(char):x}')
+        return ((CTRL | SHIFT, 'u'),) + digits + ((0, 'space'),)
+    return None
+
+
+class Keymap:
+    """A compiled character -> keystroke table for one layout."""
+    def __init__(self, layout, table, unicode_entry=None):
+        self.layout = layout
+        self.table = table
+        self.unicode_entry = unicode_entry
+
+    def lookup(self, key):
+        """Returns the keystrokes for a character or key name, or None."""
+        strokes = self.table.get(key)
+        if strokes is None and len(key) > 1:
+            strokes = self.table.get(key.lower())
+        if strokes is None and len(key) == 1 and key.isprintable():
+            strokes = _unicode_strokes(key, self.unicode_entry)
+        return strokes
+
+    def key_names(self):
+        """Every key name the table (and Unicode entry) can press."""
+        names = {name for _, name in MODIFIER_KEYS}
+        for strokes in self.table.values():
+            names.update(name for _, name in strokes)
+        return names
+
+    def resolve(self, resolve_key, resolve_modifier=None):
+        """
+        Binds the table to one backend. resolve_key maps a key name to the
+        backend's key and resolve_modifier maps one modifier bit to the
+        backend's modifier key (by default the resolved modifier key name).
+        """
+        if resolve_modifier is None:
+            modifier_names = dict(MODIFIER_KEYS)
+            resolve_modifier = lambda bit: resolve_key(modifier_names[bit])
+        return ResolvedKeymap(self, resolve_key, resolve_modifier)
+
+
+class ResolvedKeymap:
+    """
+    A Keymap bound to one backend. Each entry is a tuple of
+    (modifier keys, key) pairs in the backend's own representation.
+    """
+    def __init__(self, keymap, resolve_key, resolve_modifier):
+        self.keymap = keymap
+        self._resolve_key = resolve_key
+        self._resolve_modifier = resolve_modifier
+        self._table = {}
+        for key, strokes in keymap.table.items():
+            self._table[key] = self._resolve(strokes)
+
+    def _resolve(self, strokes):
+        resolved = []
+        for mask, name in strokes:
+            mods = tuple(self._resolve_modifier(bit) for bit, _ in MODIFIER_KEYS if mask & bit)
+            resolved.append((mods, self._resolve_key(name)))
+        return tuple(resolved)
+
+    def get(self, key):
+        """Returns the resolved keystrokes for key, or None if it cannot be typed."""
+        resolved = self._table.get(key)
+        if resolved is None:
+            strokes = self.keymap.lookup(key)
+            if strokes is None:
+                return None
+            # Remember case-folded names and Unicode fallbacks for next time.
+            resolved = self._table[key] = self._resolve(strokes)
+        return resolved
+
+
+# --- Loading & Caching ---
+
+def _cache_path(layout, cache_dir):
+    return os.path.join(cache_dir, f'keymap-{layout}-v{CACHE_VERSION}.json')
+
+def _layout_digest(layout):
+    """Digest of everything _compile_table() reads for layout."""
+    source = json.dumps([LAYOUTS[layout], NAMED_KEYS, KEY_ALIASES], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+
+def _load_cache(path, digest):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('version') != CACHE_VERSION or cached.get('digest') != digest:
+        return None
+    return {key: tuple((mask, name) for mask, name in strokes)
+            for key, strokes in cached['table'].items()}
+
+def _save_cache(path, layout, digest, table):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'layout': layout, 'digest': digest, 'table': table}, f,
+                      ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # A read-only home directory only costs a recompile on the next start.
+        print(f"⚠️ Could not write keymap cache {path}: {e}")
+
+def load_keymap(layout=None, unicode_entry='auto', cache_dir=CACHE_DIR, fallback=DEFAULT_LAYOUT):
+    """
+    Loads the compiled keymap for layout (detected when None), compiling it
+    and writing the on-disk cache on first use. Pass cache_dir=None to skip
+    the cache entirely. A layout without a bundled table gets fallback's
+    table, or with fallback=None a table of key names only: characters then
+    look up as None, for the backend to type by its own means.
+    """
+    if layout is None:
+        layout = detect_layout()
+    if layout not in LAYOUTS:
+        if fallback is None:
+            print(f"⚠️ No keymap for layout '{layout}'. Typing characters through the backend instead.")
+            return Keymap(layout, _compile_names())
+        print(f"⚠️ No keymap for layout '{layout}'. Falling back to '{fallback}'.")
+        layout = fallback
+    if unicode_entry == 'auto':
+        unicode_entry = default_unicode_entry()
+
+    table = None
+    path = None
+    digest = _layout_digest(layout)
+    if cache_dir:
+        path = _cache_path(layout, cache_dir)
+        table = _load_cache(path, digest)
+    if table is None:
+        table = _compile_table(layout)
+        if path:
+            _save_cache(path, layout, digest, table)
+    return Keymap(layout, table, unicode_entry)
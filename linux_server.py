@@ -5,6 +5,14 @@ import os
 import sys
 import shutil
 from zeroconf import ServiceInfo, Zeroconf
+from keymap import load_keymap, EVDEV_CODES, XDOTOOL_KEYSYMS, XDOTOOL_MODIFIERS
+from secure_channel import PairingServer, SecureStream
+from udp_fastpath import DatagramReceiver, MMOVE, SCROLL
+from reliable_udp import ReliableChannel
+from client_sessions import SessionLink, SessionRegistry
+from rate_feedback import RateController
+from held_inputs import HeldInputs, HOLD_COMMANDS
+from runtime_profiler import RuntimeProfiler, injection_targets
 
 # Try to import uinput, but don't fail immediately if it's not needed.
 try:
@@ -16,6 +24,20 @@ except ImportError:
 TCP_HOST = '0.0.0.0'
 TCP_PORT = 65432
 UDP_PORT = 65433
+REQUIRE_PAIRING = False # Only accept commands from clients paired with the on-screen code;
+                        # off until the iOS and bundled web apps can pair (secure_channel.py)
+RELIABLE_UDP = True     # Accept sequenced, acked clicks and keys on the UDP port; see reliable_udp.py
+RATE_FEEDBACK = True    # Tell clients how often to send moves so the host keeps up; see rate_feedback.py
+PROFILING = True        # Let SIGUSR1/SIGUSR2 or 'profile' switch on the profiler; see runtime_profiler.py
+
+# Set at startup when REQUIRE_PAIRING is on; see secure_channel.py.
+pairing = None
+# Resumable client sessions, set at startup; see client_sessions.py.
+sessions = None
+# Keys and buttons held down by mdown/kdown, set at startup; see held_inputs.py.
+held = None
+# Runtime profiler, switched off until asked; see runtime_profiler.py.
+profiler = None
 
 # --- Abstraction Layer for Input Control ---
 
@@ -31,6 +53,14 @@ class InputController:
         raise NotImplementedError
     def scroll(self, amount):
         raise NotImplementedError
+    def mouse_down(self, button):
+        raise NotImplementedError
+    def mouse_up(self, button):
+        raise NotImplementedError
+    def key_down(self, key):
+        raise NotImplementedError
+    def key_up(self, key):
+        raise NotImplementedError
 
 class X11Controller(InputController):
     """Controls input using the xdotool command for X11."""
@@ -40,17 +70,59 @@ class X11Controller(InputController):
             print("❌ 'xdotool' is not installed. Please install it to use the X11 controller.")
             print("   (e.g., 'sudo apt-get install xdotool' or 'sudo dnf install xdotool')")
             sys.exit(1)
+        # Named keys go out as keysyms, typed characters as raw X keycodes
+        # (evdev + 8) so xdotool presses the physical key of the active layout.
+        # Without a bundled table for the layout, xdotool types characters itself.
+        self.keymap = load_keymap(fallback=None).resolve(
+            lambda name: XDOTOOL_KEYSYMS.get(name) or str(EVDEV_CODES[name] + 8),
+            XDOTOOL_MODIFIERS.get,
+        )
         print("✅ Initialized X11 Input Controller.")
 
     def move_mouse(self, dx, dy):
         subprocess.run(["xdotool", "mousemove_relative", "--", str(dx), str(dy)])
 
+    BUTTONS = {'left': '1', 'right': '3', 'middle': '2'}
+
     def click(self, button):
-        button_map = {'left': '1', 'right': '3', 'middle': '2'}
-        subprocess.run(["xdotool", "click", button_map.get(button, '1')])
+        subprocess.run(["xdotool", "click", self.BUTTONS.get(button, '1')])
+
+    def mouse_down(self, button):
+        subprocess.run(["xdotool", "mousedown", self.BUTTONS[button]])
+
+    def mouse_up(self, button):
+        subprocess.run(["xdotool", "mouseup", self.BUTTONS[button]])
 
     def press_key(self, key):
-        subprocess.run(["xdotool", "key", key])
+        strokes = self.keymap.get(key)
+        if strokes is None:
+            # Not in the keymap; xdotool types a character through the active
+            # layout, or tries anything else as a keysym name.
+            subprocess.run(["xdotool", "type", "--", key] if len(key) == 1 else ["xdotool", "key", key])
+            return
+        subprocess.run(["xdotool", "key"] + ['+'.join(mods + (code,)) for mods, code in strokes])
+
+    def _held_chord(self, key):
+        """The 'mods+key' xdotool holds for key, or None if it takes more than one keystroke."""
+        strokes = self.keymap.get(key)
+        if strokes is None:
+            return key
+        if len(strokes) != 1:
+            return None
+        mods, code = strokes[0]
+        return '+'.join(mods + (code,))
+
+    def key_down(self, key):
+        chord = self._held_chord(key)
+        if chord is None:
+            self.press_key(key)  # Unicode entry sequences can't be held; just type it
+            return
+        subprocess.run(["xdotool", "keydown", chord])
+
+    def key_up(self, key):
+        chord = self._held_chord(key)
+        if chord is not None:
+            subprocess.run(["xdotool", "keyup", chord])
     
     def press_media_key(self, key_name):
         key_map = {
@@ -73,14 +145,11 @@ class WaylandController(InputController):
             print("❌ 'python-uinput' library is not installed. Please run 'pip install python-uinput'")
             sys.exit(1)
         
-        # First, build the map of all keys we will support
-        self.key_map = self._create_key_map()
-        
-        # --- CORRECTED CODE STARTS HERE ---
-        
-        # Now, create the list of events based on that map
-        # This ensures the device is registered to handle every key you've defined.
-        key_events = self.key_map.values() 
+        # Compile the full character -> keystroke table for the active layout
+        # and register every key it can press with the virtual device.
+        keymap = load_keymap()
+        self.keymap = keymap.resolve(self._key_event)
+        key_events = [self._key_event(name) for name in sorted(keymap.key_names())]
         mouse_events = (
             uinput.REL_X, 
             uinput.REL_Y, 
@@ -101,90 +170,63 @@ class WaylandController(InputController):
             
         print("✅ Initialized Wayland Input Controller (virtual device created).")
 
-    def _create_key_map(self):
-        key_map = {
-            # --- Special & Editing Keys ---
-            'enter': uinput.KEY_ENTER,
-            'space': uinput.KEY_SPACE,
-            'backspace': uinput.KEY_BACKSPACE,
-            'tab': uinput.KEY_TAB,
-            'esc': uinput.KEY_ESC,
-            'delete': uinput.KEY_DELETE,
-            'insert': uinput.KEY_INSERT,
-            
-            # --- Modifier Keys ---
-            'leftshift': uinput.KEY_LEFTSHIFT,
-            'rightshift': uinput.KEY_RIGHTSHIFT,
-            'leftctrl': uinput.KEY_LEFTCTRL,
-            'rightctrl': uinput.KEY_RIGHTCTRL,
-            'leftalt': uinput.KEY_LEFTALT,
-            'rightalt': uinput.KEY_RIGHTALT,
-            'leftmeta': uinput.KEY_LEFTMETA,   # Windows/Super/Command key
-            'rightmeta': uinput.KEY_RIGHTMETA, # Windows/Super/Command key
-            
-            # --- Arrow & Navigation Keys ---
-            'up': uinput.KEY_UP,
-            'down': uinput.KEY_DOWN,
-            'left': uinput.KEY_LEFT,
-            'right': uinput.KEY_RIGHT,
-            'home': uinput.KEY_HOME,
-            'end': uinput.KEY_END,
-            'pageup': uinput.KEY_PAGEUP,
-            'pagedown': uinput.KEY_PAGEDOWN,
-            
-            # --- Media Keys ---
-            'volumeup': uinput.KEY_VOLUMEUP,
-            'volumedown': uinput.KEY_VOLUMEDOWN,
-            'volumemute': uinput.KEY_MUTE,
-            
-            # --- Punctuation & Symbols ---
-            'semicolon': uinput.KEY_SEMICOLON,          # ;
-            'apostrophe': uinput.KEY_APOSTROPHE,       # '
-            'grave': uinput.KEY_GRAVE,                 # `
-            'comma': uinput.KEY_COMMA,                 # ,
-            'dot': uinput.KEY_DOT,                     # .
-            'slash': uinput.KEY_SLASH,                 # /
-            'backslash': uinput.KEY_BACKSLASH,         # \
-            'minus': uinput.KEY_MINUS,                 # -
-            'equal': uinput.KEY_EQUAL,                 # =
-            'leftbrace': uinput.KEY_LEFTBRACE,         # [
-            'rightbrace': uinput.KEY_RIGHTBRACE,       # ]
-        }
-        
-        # Programmatically add letters (a-z)
-        for i in range(26):
-            char = chr(ord('a') + i)
-            key_map[char] = getattr(uinput, f"KEY_{char.upper()}")
-    
-        # Programmatically add numbers (0-9)
-        for i in range(10):
-            key_map[str(i)] = getattr(uinput, f"KEY_{i}")
-
-        # f-keys
-        for i in range(1, 13):
-            key_map[f'f{i}'] = getattr(uinput, f"KEY_F{i}")
-    
-        return key_map
+    @staticmethod
+    def _key_event(name):
+        return getattr(uinput, f"KEY_{name.upper()}")
 
     def move_mouse(self, dx, dy):
         self.device.emit(uinput.REL_X, dx, syn=False)
         self.device.emit(uinput.REL_Y, dy)
 
-    def click(self, button):
+    def _button(self, button):
         button_map = {
             'left': uinput.BTN_LEFT,
             'right': uinput.BTN_RIGHT,
             'middle': uinput.BTN_MIDDLE
         }
-        self.device.emit_click(button_map.get(button, uinput.BTN_LEFT))
+        return button_map.get(button, uinput.BTN_LEFT)
+
+    def click(self, button):
+        self.device.emit_click(self._button(button))
+
+    def mouse_down(self, button):
+        self.device.emit(self._button(button), 1)
+
+    def mouse_up(self, button):
+        self.device.emit(self._button(button), 0)
     
     def press_key(self, key):
-        key_to_press = key.lower()
-        if key_to_press == ' ':         # If we receive a literal space...
-            key_to_press = 'space'      # ...map it to the 'space' key name.
-        
-        if key_to_press in self.key_map:
-            self.device.emit_click(self.key_map[key_to_press])
+        strokes = self.keymap.get(key)
+        if strokes is None:
+            return
+        for mods, code in strokes:
+            for mod in mods:
+                self.device.emit(mod, 1, syn=False)
+            self.device.emit_click(code)
+            for mod in reversed(mods):
+                self.device.emit(mod, 0)
+
+    def key_down(self, key):
+        strokes = self.keymap.get(key)
+        if strokes is None:
+            return
+        if len(strokes) != 1:
+            self.press_key(key)  # Unicode entry sequences can't be held; just type it
+            return
+        mods, code = strokes[0]
+        for mod in mods:
+            self.device.emit(mod, 1, syn=False)
+        self.device.emit(code, 1)
+
+    def key_up(self, key):
+        strokes = self.keymap.get(key)
+        if strokes is None or len(strokes) != 1:
+            return
+        mods, code = strokes[0]
+        self.device.emit(code, 0, syn=False)
+        for mod in reversed(mods):
+            self.device.emit(mod, 0, syn=False)
+        self.device.syn()
 
     def press_media_key(self, key_name):
         self.press_key(key_name)
@@ -199,24 +241,50 @@ class WaylandController(InputController):
 
 def handle_tcp_client(conn, addr, controller):
     print(f"TCP connection from {addr}")
+    stream = SecureStream(pairing, addr[0]) if pairing else None
+    # Replies and server pushes (rate advice) come from different threads.
+    send_lock = threading.Lock()
+    def write(data):
+        with send_lock: conn.sendall(data)
+    def send(line): write(stream.seal(line) if stream else (line + '\n').encode())
+    link = SessionLink(sessions, 'TCP', stream, send)
+    buffer = b''
     try:
         while True:
             data = conn.recv(1024)
             if not data: break
-            command = data.decode('utf-8').strip().split(',')
-            action = command[0]
-
-            if action == 'mclick': controller.click(command[1])
-            elif action == 'kpress': controller.press_key(command[1])
-            elif action == 'vol': controller.press_media_key('volume' + command[1])
-            # Power commands are OS-level, not display-server-level
-            elif action == 'power': handle_power_command(command[1])
+            if stream is None:
+                # One recv() may hold several commands, or part of one.
+                buffer += data
+                *lines, buffer = buffer.split(b'\n')
+                commands = [line.decode('utf-8', 'replace') for line in lines if line.strip()]
+            else:
+                reply, commands = stream.feed(data)
+                if reply: write(reply)
+                if stream.closed: break
+            for command_str in commands:
+                reply, command_str = link.handle(command_str)
+                if reply: write((reply + '\n').encode())
+                if command_str: handle_tcp_command(command_str, controller, link.session)
 
     except ConnectionResetError:
         print(f"Client {addr} disconnected.")
     finally:
+        link.close()
         conn.close()
 
+def handle_tcp_command(command_str, controller, session=None):
+    command = command_str.strip().split(',')
+    action = command[0]
+
+    if action == 'mclick': controller.click(command[1])
+    elif action == 'kpress': controller.press_key(command[1])
+    elif action in HOLD_COMMANDS and len(command) > 1: held.command(action, command[1], session)
+    elif action == 'vol': controller.press_media_key('volume' + command[1])
+    # Power commands are OS-level, not display-server-level
+    elif action == 'power': handle_power_command(command[1])
+    elif action == 'profile' and profiler: profiler.command(command[1:])
+
 def handle_power_command(sub_command):
     cmd = []
     if sub_command == 'shutdown': cmd = ["systemctl", "poweroff"]
@@ -229,16 +297,38 @@ def start_udp_server(controller):
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
         s.bind((TCP_HOST, UDP_PORT))
         print(f"🚀 UDP Server listening on port {UDP_PORT}...")
+        receiver = DatagramReceiver(s, pairing)
+        reliable = ReliableChannel(s, pairing, sessions) if RELIABLE_UDP else None
+        rate = RateController(sessions) if RATE_FEEDBACK else None
+        if rate: rate.start()
+        fields = receiver.fields
+        def apply(command_str):
+            session = sessions.for_datagram(receiver) if sessions else None
+            handle_udp_command(command_str, controller, reliable=True, session=session)
         while True:
-            data, _ = s.recvfrom(1024)
+            if rate: rate.waiting()
             try:
-                command = data.decode('utf-8').strip().split(',')
-                action = command[0]
-                if action == 'mmove': controller.move_mouse(int(command[1]), int(command[2]))
-                elif action == 'scroll': controller.scroll(int(command[1]))
+                if not receiver.receive(): continue  # Unpaired, forged or replayed
+                if rate: rate.received(receiver)
+                start = reliable.feed(receiver, apply) if reliable else 0
+                if start < 0: continue  # Held, buffered, duplicate or already applied
+                # Integer moves/scrolls are parsed in place without allocating
+                kind = receiver.parse_csv(start)
+                if kind == MMOVE: controller.move_mouse(fields[0], fields[1])
+                elif kind == SCROLL: controller.scroll(fields[0])
+                else: handle_udp_command(receiver.text(start), controller)
             except Exception as e:
                 print(f"UDP Error: {e}")
 
+def handle_udp_command(command_str, controller, reliable=False, session=None):
+    command = command_str.strip().split(',')
+    action = command[0]
+    if action == 'mmove': controller.move_mouse(int(command[1]), int(command[2]))
+    elif action == 'scroll': controller.scroll(int(command[1]))
+    # Clicks and keys only come over UDP in reliable mode
+    elif reliable and (action in ('mclick', 'kpress') or action in HOLD_COMMANDS):
+        handle_tcp_command(command_str, controller, session)
+
 def start_tcp_server(controller):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.bind((TCP_HOST, TCP_PORT))
@@ -275,7 +365,8 @@ def register_service():
         service_name,
         addresses=[socket.inet_aton(local_ip)],
         port=TCP_PORT,
-        properties={'udp_port': str(UDP_PORT)}, # Send UDP port as metadata
+        properties={'udp_port': str(UDP_PORT), 'pairing': '1' if pairing else '0', # Send UDP port as metadata
+                    'reliable': '1' if RELIABLE_UDP else '0'},
         server=f"{hostname}.local.",
     )
 
@@ -289,6 +380,13 @@ def register_service():
 # --- Main Execution ---
 if __name__ == "__main__":
     print("--- Starting Linux Remote Control Server ---")
+
+    if REQUIRE_PAIRING:
+        try:
+            pairing = PairingServer()
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
     
     # Detect the session type to choose the correct controller
     session_type = os.environ.get('XDG_SESSION_TYPE')
@@ -302,6 +400,19 @@ if __name__ == "__main__":
     else:
         print(f"⚠️ Unknown or unsupported session type: '{session_type}'. Defaulting to X11.")
         controller = X11Controller()
+
+    # Looked up per call, so the profiler's injection timing sees repeats too.
+    held = HeldInputs(lambda key: controller.key_down(key), lambda key: controller.key_up(key),
+                      lambda button: controller.mouse_down(button), lambda button: controller.mouse_up(button))
+    held.start()
+    sessions = SessionRegistry(pairing, held.up)
+    sessions.start()
+
+    if PROFILING:
+        profiler = RuntimeProfiler(injection_targets(
+            controller, 'move_mouse', 'scroll', 'click', 'mouse_down', 'mouse_up',
+            'press_key', 'key_down', 'key_up', 'press_media_key'))
+        profiler.install_signals()
     
     # Start the Bonjour/Zeroconf service broadcasting in a separate thread
     zeroconf_thread = threading.Thread(target=register_service)
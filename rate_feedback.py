@@ -0,0 +1,246 @@
+"""
+Adaptive send-rate feedback for the UDP mouse channel.
+
+Clients send 'mmove' at whatever rate the touch hardware produces. When
+the host injects more slowly than that (a loaded machine, or xdotool
+forking a process per move), datagrams pile up in the socket buffer and
+the pointer lags further and further behind the finger.
+
+The server measures how long it spends on each client's moves and how
+long they wait before it gets to them, on the UDP loop and on the TCP and
+WebSocket command paths (the browser client sends its moves over its
+WebSocket), and every FEEDBACK_INTERVAL recommends a send interval to
+each client over its TCP or WebSocket connection:
+
+    server -> client   rate,<interval ms>,<coalesce 0/1>
+
+The client should not send moves more often than every <interval ms>.
+With coalesce 1 the host is the bottleneck: sum the deltas that build up
+in between into one 'mmove' rather than queueing them (never drop them).
+With coalesce 0 the host has headroom and the client may send as touches
+arrive. A line is only sent when the advice changes noticeably, and
+repeated every FEEDBACK_REFRESH.
+
+The control law is AIMD-like, as in congestion control. A standing queue
+(a client's moves waiting longer than TARGET_DELAY over a whole interval)
+backs that client off multiplicatively from the rate it is actually
+sending at. Otherwise the interval shrinks step by step towards the
+client's fair share of TARGET_UTILIZATION of the host.
+
+Feedback needs a client session (client_sessions.py) to know which
+connection a datagram belongs to: paired datagrams carry it, unpaired
+clients announce it with a 'session,<token>' datagram.
+"""
+
+import contextlib
+import math
+import threading
+import time
+import weakref
+
+# --- Configuration ---
+FEEDBACK_INTERVAL = 0.5       # Seconds between control loop ticks
+FEEDBACK_REFRESH = 5.0        # Resend unchanged advice this often
+TARGET_DELAY = 0.005          # Standing queue delay that triggers a back-off
+TARGET_UTILIZATION = 0.8      # Share of the UDP loop's time clients may use together
+MIN_SEND_INTERVAL = 0.004     # 250 Hz: no limit in practice
+MAX_SEND_INTERVAL = 0.1
+BACKOFF = 1.5
+SPEEDUP = 0.85
+CHANGE_THRESHOLD = 0.1        # Relative change worth telling the client about
+IDLE_GAP = 0.0005             # A receive that blocked this long means the queue was empty
+
+
+class _Load:
+    """One client's share of the host during the current interval."""
+    def __init__(self, session):
+        self.session = session
+        self.packets = 0
+        self.busy = 0.0
+        self.min_delay = math.inf   # Smallest queue delay seen this interval
+
+
+class _Queue:
+    """
+    Where a client's moves wait: the UDP socket buffer (shared by every
+    client) or one client's TCP / WebSocket command stream.
+    """
+    def __init__(self):
+        self.wait_started = time.perf_counter()
+        self.busy_since = self.wait_started
+
+    def delay(self, now):
+        if now - self.wait_started > IDLE_GAP:
+            self.busy_since = now  # Nothing was queued until now
+        # Everything handled since the queue was last empty may have waited
+        # this long; the smallest such bound over an interval is the queue
+        # that never drains.
+        return now - self.busy_since
+
+
+class RateController:
+    """
+    Measures how the host keeps up and sends rate advice to its clients.
+    In the UDP loop call waiting() right before each receive() and
+    received(receiver) right after a datagram has been received. Wrap the
+    handling of each TCP or WebSocket command in `with command(session):`.
+    """
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.lock = threading.Lock()
+        self.loads = {}             # session (or address without one) -> _Load
+        self.udp = _Queue()
+        self.streams = weakref.WeakKeyDictionary()  # session -> _Queue of its commands
+        self.current = None         # _Load of the datagram being handled
+        self.handling_started = self.udp.wait_started
+        self.window_start = time.monotonic()
+
+    def _load(self, key, session, delay):
+        with self.lock:
+            load = self.loads.get(key)
+            if load is None:
+                load = self.loads[key] = _Load(session)
+            if delay < load.min_delay:
+                load.min_delay = delay
+        return load
+
+    def _handled(self, load, started, now):
+        with self.lock:
+            load.packets += 1
+            load.busy += now - started
+
+    def waiting(self):
+        now = time.perf_counter()
+        self.udp.wait_started = now
+        current = self.current
+        if current is not None:
+            self._handled(current, self.handling_started, now)
+            self.current = None
+
+    def received(self, receiver):
+        now = time.perf_counter()
+        delay = self.udp.delay(now)
+        session = self.sessions.for_datagram(receiver) if self.sessions is not None else None
+        key = session if session is not None else receiver.address
+        self.current = self._load(key, session, delay)
+        self.handling_started = now
+
+    @contextlib.contextmanager
+    def command(self, session):
+        """Measures one command from session that arrived over TCP or WebSocket."""
+        if session is None:
+            yield  # No connection to send the advice on
+            return
+        now = time.perf_counter()
+        with self.lock:
+            queue = self.streams.get(session)
+            if queue is None:
+                queue = self.streams[session] = _Queue()
+        load = self._load(session, session, queue.delay(now))
+        try:
+            yield
+        finally:
+            finished = time.perf_counter()
+            queue.wait_started = finished
+            self._handled(load, now, finished)
+
+    def tick(self, now=None):
+        """Runs the control loop once. Returns {session: (interval, coalesce)} for the advice sent."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            loads, self.loads = self.loads, {}
+        elapsed = max(now - self.window_start, 1e-6)
+        self.window_start = now
+
+        active = [load for load in loads.values() if load.packets]
+        utilization = sum(load.busy for load in active) / elapsed
+        sent = {}
+        for load in active:
+            session = load.session
+            if session is None:
+                continue  # No connection to send the advice on
+            congested = load.min_delay > TARGET_DELAY
+            interval = self.advise(session, load, len(active), elapsed, utilization, congested)
+            advice = (interval, int(interval > MIN_SEND_INTERVAL))
+            if self._notify(session, advice, now):
+                sent[session] = advice
+        return sent
+
+    def advise(self, session, load, clients, elapsed, utilization, congested):
+        """New send interval for one client; stored on the session."""
+        service = load.busy / load.packets
+        # This client's fair share of the loop, at its own cost per datagram
+        floor = service * clients / TARGET_UTILIZATION
+        interval = session.send_interval or MIN_SEND_INTERVAL
+        if congested:
+            sending = elapsed / load.packets
+            interval = max(interval, sending) * BACKOFF
+        elif utilization < TARGET_UTILIZATION:
+            interval *= SPEEDUP
+        interval = min(max(interval, floor, MIN_SEND_INTERVAL), MAX_SEND_INTERVAL)
+        session.send_interval = interval
+        return interval
+
+    def _notify(self, session, advice, now):
+        interval, coalesce = advice
+        last = session.rate_advice
+        if last is not None and now - session.rate_sent_at < FEEDBACK_REFRESH:
+            if last[1] == coalesce and abs(interval - last[0]) <= CHANGE_THRESHOLD * last[0]:
+                return False
+        if not session.notify(f"rate,{interval * 1e3:.1f},{coalesce}"):
+            return False
+        session.rate_advice = advice
+        session.rate_sent_at = now
+        return True
+
+    def start(self):
+        """Runs tick() every FEEDBACK_INTERVAL seconds in a daemon thread."""
+        def run():
+            while True:
+                time.sleep(FEEDBACK_INTERVAL)
+                try:
+                    self.tick()
+                except Exception as e:
+                    print(f"⚠️ Rate feedback error: {e}")
+        threading.Thread(target=run, daemon=True, name='rate-feedback').start()
+
+
+# --- Client Side (reference implementation, used by the benchmarks) ---
+
+class MoveCoalescer:
+    """
+    Client half: follows 'rate,...' advice. Pass every touch delta to
+    add() and every rate line to on_advice(); add() and flush() return
+    an 'mmove' command when one is due, otherwise None.
+    """
+    def __init__(self):
+        self.interval = 0.0
+        self.coalesce = False
+        self.dx = self.dy = 0
+        self.last_sent = -math.inf
+
+    def on_advice(self, line):
+        try:
+            _, interval_ms, coalesce = line.strip().split(',')
+            self.interval, self.coalesce = float(interval_ms) / 1e3, coalesce == '1'
+        except ValueError:
+            pass
+
+    def add(self, dx, dy, now):
+        self.dx += dx
+        self.dy += dy
+        return self.flush(now)
+
+    def flush(self, now):
+        if (self.dx or self.dy) and now - self.last_sent >= self.interval:
+            command = f"mmove,{self.dx},{self.dy}"
+            self.dx = self.dy = 0
+            self.last_sent = now
+            return command
+        return None
+
+    def next_due(self, now):
+        """Seconds until flush() can send what is pending, or None if nothing is."""
+        if not (self.dx or self.dy):
+            return None
+        return max(0.0, self.last_sent + self.interval - now)
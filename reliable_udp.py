@@ -0,0 +1,287 @@
+"""
+Optional reliable mode for clicks and key presses on the UDP port.
+
+Over TCP one lost segment holds back every later click until it has been
+retransmitted (head-of-line blocking), while the moves on UDP keep flowing,
+so the click lands late and at the wrong cursor position. In reliable mode
+a client sends its clicks and keys on the UDP port as well, and tags each
+move with the last click it was sent after:
+
+    client -> server   rel,<seq>,<command>       e.g. rel,7,mclick,left
+    client -> server   after,<seq>,<command>     e.g. after,7,mmove,3,-2
+    server -> client   ack,<cumulative>,<sack bits hex>,<trigger seq>
+
+Sequence numbers start at 1 for each client address. The server applies
+every 'rel' command exactly once and in sequence order, and holds back any
+move sent after a click that hasn't arrived yet, so the click is applied
+where the pointer was when the user clicked. In the ack, bit i of the
+selective-ack bitmap means seq cumulative + 2 + i arrived out of order,
+and the trigger is the seq of the 'rel' (or the tag of the held move) that
+caused the ack.
+
+The server acks every 'rel' datagram, duplicates included, and also acks
+every move it has to hold. A lost click is therefore reported by the moves
+right behind it, and the client retransmits after FAST_RETRANSMIT_ACKS such
+acks instead of waiting out its retransmission timeout.
+
+Datagrams without a prefix are handled exactly as before. Sequence state
+belongs to the client's session (client_sessions.py) when there is one, so
+it survives a change of address; otherwise it is kept per address, and a
+client that restarts gets a new ephemeral port and a fresh sequence space.
+"""
+
+import collections
+import time
+
+# --- Configuration ---
+RELIABLE_WINDOW = 64       # Out-of-order 'rel' datagrams buffered per client
+HOLD_LIMIT = 0.5           # Seconds moves may wait for a lost click before the pointer is released anyway
+GAP_LIMIT = 15.0           # Seconds before a missing seq is skipped (the client has given up on it by then)
+MAX_HELD = 256             # Moves held per client before giving up on ordering
+PEER_TIMEOUT = 120.0       # Forget a client's sequence state after this long without datagrams
+
+# Client-side retransmission (RFC 6298 timer, RACK-like fast retransmit)
+RTO_INITIAL = 0.2
+RTO_MIN = 0.02
+RTO_MAX = 2.0
+FAST_RETRANSMIT_ACKS = 2
+MAX_RETRIES = 8
+
+
+# --- Server Side ---
+
+def _sequence(buf, start, end):
+    """(seq, offset of the command) for the '<seq>,<command>' at buf[start:end], or (0, -1)."""
+    comma = buf.find(b',', start, end)
+    if comma < 0:
+        return 0, -1
+    try:
+        return int(buf[start:comma]), comma + 1
+    except ValueError:
+        return 0, -1
+
+
+class _Peer:
+    def __init__(self, now):
+        self.cumulative = 0                 # Every seq up to here has been applied
+        self.pending = {}                   # seq -> command, arrived out of order
+        self.held = collections.deque()     # (after seq, command) for moves waiting on a click
+        self.gap_since = None               # When seq cumulative + 1 was first found missing
+        self.last_seen = now
+
+
+class ReliableChannel:
+    """Server side of reliable mode for every client of one UDP socket."""
+    def __init__(self, sock, pairing=None, sessions=None):
+        self.sock = sock
+        self.pairing = pairing
+        self.sessions = sessions
+        self.peers = {}
+        self.next_sweep = 0.0
+
+    def feed(self, receiver, apply):
+        """
+        Handles the datagram in receiver (a DatagramReceiver). Commands that
+        become due are passed to apply(command_str), in order. Returns the
+        offset of a command the caller should handle itself right away
+        (0 for a plain datagram), or -1 if there is none.
+        """
+        buf, length = receiver.buffer, receiver.length
+        if buf.startswith(b'after,', 0, length):
+            after, i = _sequence(buf, 6, length)
+            if i < 0:
+                return -1
+            peer = self._peer(receiver)
+            if after > peer.cumulative and self._gap_expired(peer, GAP_LIMIT):
+                self._skip_gap(peer, after, apply)
+            if after <= peer.cumulative:
+                return i  # The usual case: every click it follows has been applied
+            if peer.gap_since is None:
+                peer.gap_since = peer.last_seen
+            if self._gap_expired(peer, HOLD_LIMIT) or len(peer.held) >= MAX_HELD:
+                # The click is taking too long; don't freeze the pointer waiting for it.
+                while peer.held:
+                    apply(peer.held.popleft()[1])
+                self._ack(receiver, peer, after)
+                return i
+            peer.held.append((after, receiver.text(i)))
+            # Tell the client straight away that a click before this move is missing.
+            self._ack(receiver, peer, after)
+            return -1
+
+        if buf.startswith(b'rel,', 0, length):
+            seq, i = _sequence(buf, 4, length)
+            if i < 0:
+                return -1
+            peer = self._peer(receiver)
+            if seq > peer.cumulative + 1 and self._gap_expired(peer, GAP_LIMIT):
+                self._skip_gap(peer, seq - 1, apply)
+            if peer.cumulative < seq <= peer.cumulative + RELIABLE_WINDOW and seq not in peer.pending:
+                peer.pending[seq] = receiver.text(i)
+                self._deliver(peer, apply)
+            # Duplicates are acked again: the previous ack may have been lost.
+            self._ack(receiver, peer, seq)
+            return -1
+
+        if self.sessions is not None and self.pairing is None and buf.startswith(b'session,', 0, length):
+            # An unpaired client announcing its new address after roaming
+            self.sessions.bind_address(receiver.text(8).strip(), receiver.address)
+            return -1
+
+        return 0
+
+    def _peer(self, receiver):
+        now = time.monotonic()
+        session = self.sessions.for_datagram(receiver) if self.sessions is not None else None
+        if session is not None:
+            if session.reliable is None:
+                session.reliable = _Peer(now)
+            session.reliable.last_seen = now
+            return session.reliable
+        address = receiver.address
+        peer = self.peers.get(address)
+        if peer is None:
+            if now > self.next_sweep:
+                self._sweep(now)
+            peer = self.peers[address] = _Peer(now)
+        peer.last_seen = now
+        return peer
+
+    def _sweep(self, now):
+        for address in [a for a, p in self.peers.items() if now - p.last_seen > PEER_TIMEOUT]:
+            del self.peers[address]
+        self.next_sweep = now + PEER_TIMEOUT
+
+    def _gap_expired(self, peer, limit):
+        return peer.gap_since is not None and peer.last_seen - peer.gap_since > limit
+
+    def _deliver(self, peer, apply):
+        """Applies every command that is now in order, interleaving held moves where they belong."""
+        start = peer.cumulative
+        while True:
+            while peer.held and peer.held[0][0] <= peer.cumulative:
+                apply(peer.held.popleft()[1])
+            command = peer.pending.pop(peer.cumulative + 1, None)
+            if command is None:
+                break
+            peer.cumulative += 1
+            apply(command)
+        if not peer.pending and not peer.held:
+            peer.gap_since = None
+        elif peer.gap_since is None or peer.cumulative != start:
+            peer.gap_since = peer.last_seen  # A new gap starts now
+
+    def _skip_gap(self, peer, upto, apply):
+        """Gives up on missing seqs (up to upto) that the client has stopped retransmitting."""
+        peer.cumulative = max(peer.cumulative, min(min(peer.pending, default=upto + 1) - 1, upto))
+        self._deliver(peer, apply)
+
+    def _ack(self, receiver, peer, trigger):
+        bits = 0
+        for seq in peer.pending:
+            bits |= 1 << (seq - peer.cumulative - 2)
+        payload = f"ack,{peer.cumulative},{bits:x},{trigger}".encode('ascii')
+        if self.pairing is not None:
+            payload = self.pairing.seal_reply(receiver.packet, payload)
+            if payload is None:
+                return
+        try:
+            self.sock.sendto(payload, receiver.address)
+        except OSError:
+            pass  # The client will retransmit and we'll ack again
+
+
+# --- Client Side (reference implementation, used by the benchmarks) ---
+
+class _Outstanding:
+    def __init__(self, seq, datagram, now):
+        self.seq = seq
+        self.datagram = datagram
+        self.sent_at = now
+        self.retries = 0
+        self.missed = 0     # Acks for later datagrams that didn't cover this one
+
+
+class ReliableSender:
+    """
+    Client half of reliable mode, without any I/O: wrap outgoing commands
+    with reliable()/ordered(), send what they return, pass every ack to
+    on_ack() and call poll() whenever next_timeout() expires.
+    Both of those return the datagrams to retransmit.
+    """
+    def __init__(self):
+        self.last_seq = 0
+        self.outstanding = {}   # seq -> _Outstanding, in send order
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = RTO_INITIAL
+        self.given_up = 0
+
+    def reliable(self, command, now):
+        """Wraps a click or key command. Returns the datagram to send."""
+        self.last_seq += 1
+        datagram = f"rel,{self.last_seq},{command}"
+        self.outstanding[self.last_seq] = _Outstanding(self.last_seq, datagram, now)
+        return datagram
+
+    def ordered(self, command):
+        """Wraps a move or scroll so the server keeps it behind the clicks sent before it."""
+        return f"after,{self.last_seq},{command}"
+
+    def on_ack(self, text, now):
+        try:
+            _, cumulative, bits, trigger = text.strip().split(',')
+            cumulative, bits, trigger = int(cumulative), int(bits, 16), int(trigger)
+        except ValueError:
+            return []
+
+        resend = []
+        for seq in list(self.outstanding):
+            packet = self.outstanding[seq]
+            offset = seq - cumulative - 2
+            if seq <= cumulative or (offset >= 0 and bits >> offset & 1):
+                if packet.retries == 0:
+                    self._sample_rtt(now - packet.sent_at)  # Karn: never time a retransmission
+                del self.outstanding[seq]
+            elif trigger >= seq:
+                # The server heard from us after this was sent, but not this.
+                packet.missed += 1
+                settled = self.srtt is None or now - packet.sent_at > self.srtt
+                if packet.missed >= FAST_RETRANSMIT_ACKS and settled:
+                    resend.append(self._retransmit(packet, now))
+        return resend
+
+    def poll(self, now):
+        """Retransmits whatever has timed out."""
+        resend = []
+        for packet in list(self.outstanding.values()):
+            if now - packet.sent_at >= self._timeout(packet):
+                if packet.retries >= MAX_RETRIES:
+                    del self.outstanding[packet.seq]
+                    self.given_up += 1
+                else:
+                    resend.append(self._retransmit(packet, now))
+        return resend
+
+    def next_timeout(self, now):
+        """Seconds until poll() has work to do, or None if nothing is outstanding."""
+        if not self.outstanding:
+            return None
+        return max(0.0, min(p.sent_at + self._timeout(p) for p in self.outstanding.values()) - now)
+
+    def _timeout(self, packet):
+        return min(self.rto * (2 ** packet.retries), RTO_MAX)
+
+    def _retransmit(self, packet, now):
+        packet.retries += 1
+        packet.missed = 0
+        packet.sent_at = now
+        return packet.datagram
+
+    def _sample_rtt(self, rtt):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, RTO_MIN), RTO_MAX)
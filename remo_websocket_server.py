@@ -1,22 +1,53 @@
 #!/usr/bin/env python3
 """
 WebSocket-enabled Remote Control Server
-Supports both the iOS app (raw TCP/UDP) and web browser (WebSocket)
+Supports both the iOS app (raw TCP/UDP) and web browser (WebSocket).
+Raw TCP and WebSocket clients share TCP_PORT; see single_port.py.
 """
 
+import os
 import socket
 import threading
 import pyautogui
 import subprocess
 import sys
+import tarfile
 import asyncio
+import contextlib
 import websockets
 from zeroconf import ServiceInfo, Zeroconf
+from keymap import load_keymap, PYAUTOGUI_KEYS, PYAUTOGUI_MODIFIERS
+from single_port import serve_single_port
+from secure_channel import PairingServer, SecureStream
+from udp_fastpath import DatagramReceiver, MMOVE, SCROLL
+from reliable_udp import ReliableChannel
+from client_sessions import SessionLink, SessionRegistry
+from rate_feedback import RateController
+from held_inputs import HeldInputs, HOLD_COMMANDS
+from runtime_profiler import RuntimeProfiler, injection_targets
+from web_assets import AssetCache
+from screen_preview import PreviewHub
 
 # --- Configuration ---
 TCP_HOST = '0.0.0.0'
 TCP_PORT = 65432      # Port for iOS app TCP and WebSocket
 UDP_PORT = 65433      # Port for iOS app UDP
+REQUIRE_PAIRING = False # Only accept commands from clients paired with the on-screen code;
+                        # off until the iOS and bundled web apps can pair (secure_channel.py)
+RELIABLE_UDP = True     # Accept sequenced, acked clicks and keys on the UDP port; see reliable_udp.py
+RATE_FEEDBACK = True    # Tell clients how often to send moves so the host keeps up; see rate_feedback.py
+PROFILING = True        # Let SIGUSR1/SIGUSR2 or 'profile' switch on the profiler; see runtime_profiler.py
+WEB_APP_ARCHIVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'remo-web-app.tar.gz')
+PREVIEW_SOURCE = 'screen'  # Screen preview capture source ('screen' or 'synthetic'); see screen_preview.py
+
+# Set at startup when REQUIRE_PAIRING is on; see secure_channel.py.
+pairing = None
+# Resumable client sessions, set at startup; see client_sessions.py.
+sessions = None
+# Runtime profiler, switched off until asked; see runtime_profiler.py.
+profiler = None
+# Send-rate advice for moves over UDP, TCP and WebSocket, set at startup; see rate_feedback.py.
+rate = None
 
 # Disable PyAutoGUI fail-safe
 pyautogui.FAILSAFE = False
@@ -24,8 +55,87 @@ pyautogui.FAILSAFE = False
 # Store connected WebSocket clients
 websocket_clients = set()
 
+# Screen preview subscribers; the capture worker only runs while someone watches
+preview_hub = None
+PREVIEW_COMMANDS = ('preview,', 'pvack,')
+
+# Character -> keystroke table for the active layout, compiled once at startup.
+# A layout without a bundled table gets key names only; pyautogui types the rest.
+KEYMAP = load_keymap(fallback=None).resolve(lambda name: PYAUTOGUI_KEYS.get(name, name), PYAUTOGUI_MODIFIERS.get)
+
+# Only Linux reports its keyboard layout to keymap.py, so elsewhere KEYMAP is
+# the 'us' one. pyautogui asks the OS for the active layout, so characters are
+# left to it there and KEYMAP only handles key names.
+OS_TYPES_CHARACTERS = not sys.platform.startswith('linux')
+
+def keystrokes(key):
+    """KEYMAP's keystrokes for key, or None to hand key to pyautogui as it is."""
+    if OS_TYPES_CHARACTERS and len(key) == 1 and key.isprintable():
+        return None
+    return KEYMAP.get(key)
+
+def press_key(key):
+    """
+    Presses a key name or types a single character, holding whatever
+    modifiers the active layout needs (e.g. shift for '!' or 'A').
+    """
+    strokes = keystrokes(key)
+    if strokes is None:
+        # A character pyautogui types itself, or one of its own key names.
+        pyautogui.press(key)
+        return
+    for mods, name in strokes:
+        if mods:
+            pyautogui.hotkey(*mods, name)
+        else:
+            pyautogui.press(name)
+
+def key_down(key):
+    """
+    Holds a key down, with the modifiers the active layout needs. Characters
+    that take more than one keystroke can't be held, so they are just typed.
+    No pyautogui.PAUSE here: autorepeat calls this REPEAT_RATE times a second.
+    """
+    strokes = keystrokes(key)
+    if strokes is None:
+        pyautogui.keyDown(key, _pause=False)
+    elif len(strokes) == 1:
+        mods, name = strokes[0]
+        for mod in mods:
+            pyautogui.keyDown(mod, _pause=False)
+        pyautogui.keyDown(name, _pause=False)
+    else:
+        press_key(key)
+
+def key_up(key):
+    """Releases a key held by key_down(), modifiers last."""
+    strokes = keystrokes(key)
+    if strokes is None:
+        pyautogui.keyUp(key, _pause=False)
+    elif len(strokes) == 1:
+        mods, name = strokes[0]
+        pyautogui.keyUp(name, _pause=False)
+        for mod in reversed(mods):
+            pyautogui.keyUp(mod, _pause=False)
+
+def move_mouse(dx, dy):
+    """
+    Moves the pointer. On macOS, apps only see a drag if the moves are sent
+    as drag events, so moves while a button is held go through dragRel.
+    """
+    buttons = held.buttons() if sys.platform == "darwin" else None
+    if buttons:
+        pyautogui.dragRel(dx, dy, button=buttons[0], mouseDownUp=False)
+    else:
+        pyautogui.moveRel(dx, dy)
+
+# Keys and buttons held by mdown/kdown, with autorepeat; see held_inputs.py.
+held = HeldInputs(key_down, key_up,
+                  lambda button: pyautogui.mouseDown(button=button, _pause=False),
+                  lambda button: pyautogui.mouseUp(button=button, _pause=False))
+
 # --- Command Processing (shared by TCP and WebSocket) ---
-def process_command(command_str, protocol="TCP"):
+def process_command(command_str, protocol="TCP", session=None):
     """
     Process a command string from either TCP or WebSocket
     """
@@ -41,7 +151,7 @@ def process_command(command_str, protocol="TCP"):
         # --- Mouse Movement (from WebSocket, replaces UDP) ---
         elif action == 'mmove' and len(command) == 3:
             dx, dy = int(command[1]), int(command[2])
-            pyautogui.moveRel(dx, dy)
+            move_mouse(dx, dy)
 
         # --- Scroll Action ---
         elif action == 'scroll' and len(command) == 2:
@@ -54,7 +164,11 @@ def process_command(command_str, protocol="TCP"):
         elif action == 'kpress' and len(command) > 1:
             key_to_press = command[1].strip('\n\r')
             print(f"Executing key press: '{key_to_press}'")
-            pyautogui.press(key_to_press)
+            press_key(key_to_press)
+
+        # --- Press / Hold / Release Actions ---
+        elif action in HOLD_COMMANDS and len(command) > 1:
+            held.command(action, command[1].strip('\n\r'), session)
 
         # --- Volume Control Actions ---
         elif action == 'vol' and len(command) > 1:
@@ -95,6 +209,10 @@ def process_command(command_str, protocol="TCP"):
                 print(f"Executing: {' '.join(cmd)}")
                 subprocess.run(cmd)
 
+        # --- Runtime Profiler ---
+        elif action == 'profile' and profiler:
+            profiler.command(command[1:])
+
     except Exception as e:
         print(f"Error processing command '{command_str}': {e}")
 
@@ -107,51 +225,113 @@ async def handle_websocket(websocket):
     print(f"✅ WebSocket connection established from {client_addr}")
     
     websocket_clients.add(websocket)
+    stream = SecureStream(pairing, websocket.remote_address[0]) if pairing else None
+    loop = asyncio.get_running_loop()
+
+    def send(line):
+        # Server pushes (rate advice) come from other threads
+        message = stream.seal_packet(line) if stream else line
+        asyncio.run_coroutine_threadsafe(websocket.send(message), loop)
+
+    link = SessionLink(sessions, 'WebSocket', stream, send)
     
     try:
         async for message in websocket:
-            process_command(message, protocol="WebSocket")
+            if stream is None:
+                command_str = message
+            else:
+                # Text messages pair; binary messages are sealed commands
+                reply, command_str = stream.feed_message(message)
+                if reply:
+                    await websocket.send(reply)
+                if stream.closed:
+                    break
+                if command_str is None:
+                    continue
+
+            reply, command_str = link.handle(command_str)
+            if reply:
+                await websocket.send(reply)
+            if not command_str:
+                continue
+
+            if command_str.startswith(PREVIEW_COMMANDS):
+                handle_preview_command(websocket, stream, command_str)
+            else:
+                # The browser sends its moves here, so they are measured for rate advice
+                with rate.command(link.session) if rate else contextlib.nullcontext():
+                    process_command(command_str, protocol="WebSocket", session=link.session)
     except websockets.exceptions.ConnectionClosed:
         print(f"🔌 WebSocket connection closed from {client_addr}")
     finally:
         websocket_clients.discard(websocket)
+        link.close()
+        if preview_hub is not None:
+            preview_hub.unsubscribe(websocket)
+
+def handle_preview_command(websocket, stream, command_str):
+    """
+    Handles 'preview,on', 'preview,off' and 'pvack,<frame id>' from a WebSocket client
+    """
+    global preview_hub
+    command = command_str.strip().split(',')
+    action = command[0]
+
+    try:
+        if action == 'preview' and len(command) > 1 and command[1] == 'on':
+            if preview_hub is None:
+                preview_hub = PreviewHub(PREVIEW_SOURCE)
+
+            async def send(frame):
+                await websocket.send(stream.seal_packet(frame) if stream else frame)
+
+            preview_hub.subscribe(websocket, send)
+            print(f"🖥️ Screen preview started for {websocket.remote_address[0]}")
+
+        elif action == 'preview' and preview_hub is not None:
+            preview_hub.unsubscribe(websocket)
+
+        elif action == 'pvack' and len(command) > 1 and preview_hub is not None:
+            preview_hub.ack(websocket, int(command[1]))
+
+    except (RuntimeError, ValueError) as e:
+        print(f"Error processing preview command '{command_str}': {e}")
 
 async def start_websocket_server():
     """
-    Start the WebSocket server on the same port as TCP
+    Start the combined WebSocket + raw TCP server on TCP_PORT.
+    Browsers are detected by their HTTP upgrade request; everything else
+    is treated as the iOS app's newline-delimited TCP commands. Plain HTTP
+    requests get the bundled web app, served from memory.
     """
-    print(f"🚀 WebSocket Server listening on port {TCP_PORT}...")
-    async with websockets.serve(handle_websocket, TCP_HOST, TCP_PORT):
+    assets = load_web_app()
+    print(f"🚀 WebSocket + TCP Server listening on port {TCP_PORT}...")
+    if assets:
+        print(f"🌐 Web app available at http://{get_ip_address()}:{TCP_PORT}/")
+    async with serve_single_port(handle_websocket, handle_tcp_command, TCP_HOST, TCP_PORT,
+                                 pairing=pairing, sessions=sessions, assets=assets):
         await asyncio.Future()  # Run forever
 
-# --- TCP Handler (For iOS app) ---
-def handle_tcp_client(conn, addr):
+def load_web_app():
     """
-    Handles incoming TCP connections from the iOS app
+    Loads the bundled web app into memory, precompressed. Returns None if
+    the archive is missing or unreadable; the control channels still work.
     """
-    print(f"✅ TCP connection established from {addr}")
-    
     try:
-        while True:
-            data = conn.recv(1024)
-            if not data:
-                break
-
-            command_str = data.decode('utf-8')
-            process_command(command_str, protocol="TCP")
+        assets = AssetCache.from_tarball(WEB_APP_ARCHIVE)
+    except (OSError, tarfile.TarError) as e:
+        print(f"⚠️ Web app not served: {e}")
+        return None
+    print(f"📦 Loaded {len(assets.assets)} web app assets ({assets.total_size() // 1024} KiB incl. compressed copies)")
+    return assets
 
-    except ConnectionResetError:
-        print(f"⚠️ Client {addr} disconnected unexpectedly.")
-    finally:
-        print(f"🔌 Closing TCP connection from {addr}")
-        conn.close()
-
-def start_tcp_server():
+# --- TCP Handler (For iOS app) ---
+def handle_tcp_command(command_str, session=None):
     """
-    Note: TCP server disabled when WebSocket is running on the same port
-    This is kept for reference if you want to run them on different ports
+    Handles one newline-delimited command from an iOS app TCP connection
     """
-    pass
+    with rate.command(session) if rate else contextlib.nullcontext():
+        process_command(command_str, protocol="TCP", session=session)
 
 # --- UDP Server (For iOS app high-frequency commands) ---
 def start_udp_server():
@@ -161,13 +341,34 @@ def start_udp_server():
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
         s.bind((TCP_HOST, UDP_PORT))
         print(f"🚀 UDP Server listening on port {UDP_PORT}...")
+        receiver = DatagramReceiver(s, pairing)
+        reliable = ReliableChannel(s, pairing, sessions) if RELIABLE_UDP else None
+        fields = receiver.fields
+        apply = lambda command_str: process_command(
+            command_str, protocol="UDP", session=sessions.for_datagram(receiver) if sessions else None)
         while True:
-            data, addr = s.recvfrom(1024)
+            if rate:
+                rate.waiting()
             try:
-                command_str = data.decode('utf-8').strip()
-                process_command(command_str, protocol="UDP")
+                if not receiver.receive():
+                    continue  # Unpaired, forged or replayed
+                if rate:
+                    rate.received(receiver)  # Measures queue delay and per-client load
+                start = reliable.feed(receiver, apply) if reliable else 0
+                if start < 0:
+                    continue  # Held, buffered, duplicate or already applied
+
+                # Integer moves/scrolls are parsed in place and skip the
+                # per-packet log line; everything else goes through process_command
+                kind = receiver.parse_csv(start)
+                if kind == MMOVE:
+                    move_mouse(fields[0], fields[1])
+                elif kind == SCROLL:
+                    pyautogui.scroll(fields[0] * 20 if sys.platform == "win32" else fields[0])
+                else:
+                    process_command(receiver.text(start).strip(), protocol="UDP")
             except Exception as e:
-                print(f"UDP Error: {e} | Raw data: {data}")
+                print(f"UDP Error: {e} | Raw data: {bytes(receiver.view[:receiver.length])}")
 
 def get_ip_address():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -192,7 +393,8 @@ def register_service():
         service_name,
         addresses=[socket.inet_aton(local_ip)],
         port=TCP_PORT,
-        properties={'udp_port': str(UDP_PORT)},
+        properties={'udp_port': str(UDP_PORT), 'pairing': '1' if pairing else '0',
+                    'reliable': '1' if RELIABLE_UDP else '0'},
         server=f"{hostname}.local.",
     )
 
@@ -205,6 +407,24 @@ if __name__ == "__main__":
     print("--- Starting Remote Control Server (WebSocket + UDP) ---")
     print(f"OS Detected: {sys.platform}")
     print(f"IP Address: {get_ip_address()}")
+
+    if REQUIRE_PAIRING:
+        try:
+            pairing = PairingServer()
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    held.start()
+    sessions = SessionRegistry(pairing, held.up)
+    sessions.start()
+    rate = RateController(sessions) if RATE_FEEDBACK else None
+    if rate:
+        rate.start()
+    if PROFILING:
+        profiler = RuntimeProfiler(injection_targets(
+            pyautogui, 'moveRel', 'dragRel', 'scroll', 'click', 'mouseDown', 'mouseUp',
+            'press', 'hotkey', 'keyDown', 'keyUp'))
+        profiler.install_signals()
     
     # Start Zeroconf broadcasting
     zeroconf_thread = threading.Thread(target=register_service)
@@ -216,7 +436,7 @@ if __name__ == "__main__":
     udp_thread.daemon = True
     udp_thread.start()
 
-    # Run WebSocket server (for web app) - this is the main event loop
+    # Run WebSocket + TCP server (web app and iOS app) - this is the main event loop
     try:
         asyncio.run(start_websocket_server())
     except KeyboardInterrupt:
@@ -0,0 +1,227 @@
+"""
+Profiling a running server without restarting it.
+
+Restarting under a profiler changes the timing and loses whatever state
+caused the lag, so every server carries this profiler, switched off. It
+is switched on for a while by a signal (POSIX only) or by a command from
+a client the server already accepts commands from:
+
+    kill -USR1 <pid>           sampling, PROFILE_SECONDS
+    kill -USR2 <pid>           injection timing, PROFILE_SECONDS
+    profile,sample[,<seconds>]
+    profile,inject[,<seconds>]
+    profile,stop               end the running profile early
+
+Sampling reads the stack of every thread (per-client TCP threads, the UDP
+loop, the event loop...) SAMPLE_RATE times a second from a background
+thread, with sys._current_frames(), and writes them in collapsed-stack
+format, one 'thread;outer;...;inner count' line per distinct stack, ready
+for flamegraph.pl or speedscope.
+
+Injection timing swaps timing wrappers onto just the injection functions
+the server names (pyautogui, pynput or its InputController) and writes a
+per-function summary: calls, total, mean, p50, p99 and max.
+
+Switched off there is nothing to pay: no thread runs and the injection
+functions are the originals. Results go to PROFILE_DIR.
+"""
+
+import os
+import signal
+import sys
+import threading
+import time
+
+# --- Configuration ---
+PROFILE_SECONDS = 10.0
+MAX_PROFILE_SECONDS = 300.0
+SAMPLE_RATE = 100      # Stack samples per second while sampling
+PROFILE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'hybrid-input-server', 'profiles')
+
+MODES = ('sample', 'inject')
+
+
+def injection_targets(owner, *names, prefix=None):
+    """Targets for RuntimeProfiler: the named functions of a module or methods of an object."""
+    prefix = prefix or getattr(owner, '__name__', type(owner).__name__)
+    return [(f"{prefix}.{name}", owner, name) for name in names]
+
+
+class _Timings:
+    def __init__(self):
+        self.durations = []
+
+
+class RuntimeProfiler:
+    """
+    One profiler per server. targets lists the injection functions to time
+    as (label, owner, attribute name), e.g. from injection_targets(pyautogui,
+    'moveRel', 'click'). They are looked up on the owner at call time, so a
+    wrapper only sees calls that go through the owner, not saved references.
+    """
+    def __init__(self, targets=(), out_dir=PROFILE_DIR):
+        self.targets = list(targets)
+        self.out_dir = out_dir
+        self.lock = threading.RLock()  # Re-entered if a signal arrives while start() holds it
+        self.running = None     # Mode currently running, or None
+        self.stopping = threading.Event()
+        self.labels = {}        # code object -> 'function (file:line)'
+
+    # --- Triggers ---
+
+    def install_signals(self):
+        """SIGUSR1 starts sampling, SIGUSR2 injection timing. Call from the main thread."""
+        if not hasattr(signal, 'SIGUSR1'):
+            return False  # Windows: use the profile command instead
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.start('sample'))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.start('inject'))
+        return True
+
+    def command(self, args):
+        """Handles the arguments of a 'profile,<mode>[,<seconds>]' or 'profile,stop' command."""
+        try:
+            mode = args[0].strip()
+            if mode == 'stop':
+                return self.stop()
+            seconds = float(args[1]) if len(args) > 1 else PROFILE_SECONDS
+        except (IndexError, ValueError):
+            print("⚠️ Usage: profile,sample|inject[,<seconds>] or profile,stop")
+            return False
+        return self.start(mode, seconds)
+
+    def start(self, mode, seconds=PROFILE_SECONDS):
+        """Runs one profile in the background. Returns False if one is already running."""
+        if mode not in MODES or not 0 < seconds <= MAX_PROFILE_SECONDS:
+            print(f"⚠️ Unknown profile '{mode}' or bad duration {seconds}")
+            return False
+        with self.lock:
+            if self.running is not None:
+                print(f"⚠️ A '{self.running}' profile is already running")
+                return False
+            self.running = mode
+            self.stopping.clear()
+        target = self._sample if mode == 'sample' else self._time_injection
+        threading.Thread(target=self._run, args=(target, mode, seconds), daemon=True,
+                         name=f'profiler-{mode}').start()
+        return True
+
+    def stop(self):
+        """Ends the running profile early; its results are still written."""
+        if self.running is None:
+            return False
+        self.stopping.set()
+        return True
+
+    def _run(self, target, mode, seconds):
+        print(f"📈 Profiling ({mode}) for {seconds:g}s...")
+        try:
+            path = target(seconds)
+            print(f"📈 Profile written to {path}")
+        except Exception as e:
+            print(f"⚠️ Profiling failed: {e}")
+        finally:
+            with self.lock:
+                self.running = None
+
+    def _output_path(self, mode, extension):
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        return os.path.join(self.out_dir, f"profile-{mode}-{stamp}-{os.getpid()}.{extension}")
+
+    # --- Sampling ---
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def sample_once(self, counts, skip=None):
+        """Adds one sample of every thread's stack (except thread id skip) to counts."""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == skip:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, f'thread-{ident}').replace(';', ':').replace(' ', '_'))
+            key = ';'.join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+
+    def _sample(self, seconds):
+        counts = {}
+        me = threading.get_ident()
+        interval = 1.0 / SAMPLE_RATE
+        deadline = time.monotonic() + seconds
+        next_sample = time.monotonic()
+        while next_sample < deadline:
+            self.sample_once(counts, me)
+            next_sample += interval
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                if self.stopping.wait(delay):
+                    break
+            else:
+                next_sample = time.monotonic()  # Fell behind; don't burst
+        path = self._output_path('sample', 'collapsed')
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(counts.items()):
+                f.write(f"{stack} {count}\n")
+        return path
+
+    # --- Injection Timing ---
+
+    def _wrap(self, function, timings, depth):
+        def timed(*args, **kwargs):
+            if getattr(depth, 'value', 0):
+                return function(*args, **kwargs)  # Nested in another timed call
+            depth.value = 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.durations.append(time.perf_counter() - start)
+                depth.value = 0
+        return timed
+
+    def _time_injection(self, seconds):
+        depth = threading.local()
+        patched = []
+        results = []
+        try:
+            for label, owner, name in self.targets:
+                original = getattr(owner, name, None)
+                if original is None:
+                    continue
+                own = name in getattr(owner, '__dict__', {})
+                timings = _Timings()
+                setattr(owner, name, self._wrap(original, timings, depth))
+                patched.append((owner, name, original, own))
+                results.append((label, timings))
+            started = time.monotonic()
+            self.stopping.wait(seconds)
+            seconds = time.monotonic() - started
+        finally:
+            for owner, name, original, own in reversed(patched):
+                if own:
+                    setattr(owner, name, original)
+                else:
+                    delattr(owner, name)  # Back to the class attribute
+
+        path = self._output_path('inject', 'txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"# injection timing over {seconds:.1f}s\n")
+            f.write(f"{'function':<32} {'calls':>7} {'total ms':>10} {'mean us':>9} {'p50 us':>9} "
+                    f"{'p99 us':>9} {'max us':>9}\n")
+            for label, timings in results:
+                durations = sorted(timings.durations)
+                if not durations:
+                    continue
+                total = sum(durations)
+                p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+                f.write(f"{label:<32} {len(durations):>7} {total * 1e3:>10.1f} "
+                        f"{total / len(durations) * 1e6:>9.1f} {durations[len(durations) // 2] * 1e6:>9.1f} "
+                        f"{p99 * 1e6:>9.1f} {durations[-1] * 1e6:>9.1f}\n")
+        return path
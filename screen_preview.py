@@ -0,0 +1,367 @@
+"""
+Low-bandwidth screen preview stream over the existing WebSocket connection.
+
+A worker process captures the screen, downsamples it, splits it into tiles
+and encodes only the tiles that changed since the previous frame (found with
+a vectorised NumPy comparison). The server process never touches pixels: it
+just forwards the encoded frames, so preview load cannot delay input
+injection.
+
+Frames are ack-clocked. A client that wants a preview sends 'preview,on',
+then 'pvack,<frame id>' after drawing each frame. The next frame is only
+captured once every subscriber has acked, so the frame rate follows the
+slowest link, and it is further paced to a bandwidth estimate taken from
+the ack round trips so the link is never saturated. A round trip is
+mostly latency for anything but a large frame, so the estimate only takes
+frames of at least PREVIEW_MIN_SAMPLE_BYTES, and times them by their round
+trip minus the shortest one seen (the latency), smoothed over samples.
+
+Frame message (binary, big-endian):
+
+    'PV' | format (1: 0=JPEG 1=WebP) | flags (1: 1=keyframe) | frame id (4)
+         | width (2) | height (2) | tile size (2) | tile count (2)
+    then per tile: column (2) | row (2) | length (4) | encoded image
+
+Capture sources are pluggable; 'synthetic' renders a moving test pattern
+so the whole pipeline can run without a display.
+"""
+
+import asyncio
+import io
+import multiprocessing
+import queue
+import struct
+import time
+
+# Optional dependencies: only needed once a client asks for a preview.
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+try:
+    import mss
+except ImportError:
+    mss = None
+
+# --- Configuration ---
+PREVIEW_SCALE = 4          # Downsample factor (4 -> 1920x1080 becomes 480x270)
+PREVIEW_TILE = 32          # Tile edge in downsampled pixels
+PREVIEW_FORMAT = 'WEBP'    # 'WEBP' or 'JPEG'
+PREVIEW_QUALITY = 60
+PREVIEW_MAX_FPS = 15
+PREVIEW_MIN_FPS = 1
+PREVIEW_LINK_SHARE = 0.5   # Fraction of the measured bandwidth preview may use
+PREVIEW_MIN_SAMPLE_BYTES = 2048       # Smaller frames are too latency-bound to measure bandwidth
+PREVIEW_BANDWIDTH_SMOOTHING = 0.2     # Weight of each new sample in the bandwidth estimate
+ACK_TIMEOUT = 2.0          # Seconds before a silent subscriber stops holding frames back
+
+FRAME_HEADER = struct.Struct('!2sBBIHHHH')
+FLAG_KEYFRAME = 1
+TILE_HEADER = struct.Struct('!HHI')
+MAGIC = b'PV'
+FORMATS = {'JPEG': 0, 'WEBP': 1}
+
+
+def require_preview_dependencies():
+    if np is None:
+        raise RuntimeError("Screen preview requires 'numpy' and 'Pillow'. Please run 'pip install numpy pillow'")
+
+
+# --- Capture Sources ---
+
+class ScreenSource:
+    """Captures the primary monitor with mss, falling back to Pillow's ImageGrab."""
+    def __init__(self):
+        if mss is not None:
+            self.grabber = mss.mss()
+            self.monitor = self.grabber.monitors[1]
+        else:
+            from PIL import ImageGrab
+            self.grabber = None
+            self.image_grab = ImageGrab
+
+    def capture(self):
+        """Returns the screen as an HxWx3 uint8 RGB array."""
+        if self.grabber is not None:
+            shot = np.asarray(self.grabber.grab(self.monitor))  # BGRA
+            return shot[:, :, 2::-1]
+        return np.asarray(self.image_grab.grab().convert('RGB'))
+
+
+class SyntheticSource:
+    """A moving square on a gradient, for tests and benchmarks."""
+    def __init__(self, width=1280, height=720, square=96, step=8):
+        self.width = width
+        self.height = height
+        self.square = square
+        self.step = step
+        self.frame_number = 0
+        gradient = np.linspace(0, 255, width, dtype=np.uint8)
+        self.background = np.repeat(np.tile(gradient, (height, 1))[:, :, None], 3, axis=2)
+
+    def capture(self):
+        frame = self.background.copy()
+        x = (self.frame_number * self.step) % (self.width - self.square)
+        y = (self.frame_number * self.step // 2) % (self.height - self.square)
+        frame[y:y + self.square, x:x + self.square] = (255, 64, 0)
+        self.frame_number += 1
+        return frame
+
+
+SOURCES = {'screen': ScreenSource, 'synthetic': SyntheticSource}
+
+
+# --- Tile Encoding ---
+
+def downsample(frame, factor, tile):
+    """Box-filters frame by factor and pads it to a whole number of tiles."""
+    h, w = frame.shape[0] // factor, frame.shape[1] // factor
+    blocks = frame[:h * factor, :w * factor].reshape(h, factor, w, factor, 3)
+    small = (blocks.sum(axis=(1, 3), dtype=np.uint32) // (factor * factor)).astype(np.uint8)
+    pad_h, pad_w = -h % tile, -w % tile
+    if pad_h or pad_w:
+        small = np.pad(small, ((0, pad_h), (0, pad_w), (0, 0)), mode='edge')
+    return small
+
+
+def changed_tiles(previous, current, tile):
+    """Returns an (N, 2) array of (row, column) for every tile that differs."""
+    rows, cols = current.shape[0] // tile, current.shape[1] // tile
+    diff = (previous != current).reshape(rows, tile, cols, tile, 3).any(axis=(1, 3, 4))
+    return np.argwhere(diff)
+
+
+class TileEncoder:
+    """Turns full frames into delta messages against the previously sent frame."""
+    def __init__(self, scale=PREVIEW_SCALE, tile=PREVIEW_TILE, image_format=PREVIEW_FORMAT,
+                 quality=PREVIEW_QUALITY):
+        self.scale = scale
+        self.tile = tile
+        self.image_format = image_format
+        self.quality = quality
+        self.previous = None
+        self.frame_id = 0
+
+    def encode(self, frame, keyframe=False):
+        """Returns the next frame message, or None if nothing changed."""
+        small = downsample(frame, self.scale, self.tile)
+        keyframe = keyframe or self.previous is None or self.previous.shape != small.shape
+        if keyframe:
+            rows, cols = small.shape[0] // self.tile, small.shape[1] // self.tile
+            tiles = np.argwhere(np.ones((rows, cols), dtype=bool))
+        else:
+            tiles = changed_tiles(self.previous, small, self.tile)
+            if len(tiles) == 0:
+                return None
+        self.previous = small
+        self.frame_id += 1
+
+        out = io.BytesIO()
+        flags = FLAG_KEYFRAME if keyframe else 0
+        out.write(FRAME_HEADER.pack(MAGIC, FORMATS[self.image_format], flags, self.frame_id,
+                                    small.shape[1], small.shape[0], self.tile, len(tiles)))
+        image = io.BytesIO()
+        t = self.tile
+        for row, col in tiles:
+            image.seek(0)
+            image.truncate()
+            Image.fromarray(small[row * t:(row + 1) * t, col * t:(col + 1) * t]).save(
+                image, self.image_format, quality=self.quality)
+            out.write(TILE_HEADER.pack(col, row, image.tell()))
+            out.write(image.getbuffer())
+        return out.getvalue()
+
+
+# --- Worker Process ---
+
+def _worker_main(source_name, requests, results, max_fps):
+    """Capture/encode loop. Runs in its own process."""
+    source = SOURCES[source_name]()
+    encoder = TileEncoder()
+    interval = 1.0 / max_fps
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        keyframe = request == 'keyframe'
+        # Wait for something to change rather than sending empty frames,
+        # but give up on the wait as soon as another request arrives.
+        while True:
+            message = encoder.encode(source.capture(), keyframe)
+            if message is not None:
+                results.put(message)
+                break
+            try:
+                request = requests.get(timeout=interval)
+            except queue.Empty:
+                continue
+            if request is None:
+                return
+            keyframe = keyframe or request == 'keyframe'
+
+
+class PreviewProcess:
+    """Parent-side handle on the capture/encode worker."""
+    def __init__(self, source_name='screen', max_fps=PREVIEW_MAX_FPS):
+        require_preview_dependencies()
+        # 'spawn' keeps the worker free of the server's threads and sockets.
+        context = multiprocessing.get_context('spawn')
+        self.requests = context.Queue()
+        self.results = context.Queue(maxsize=2)
+        self.process = context.Process(target=_worker_main, daemon=True, name='screen-preview',
+                                       args=(source_name, self.requests, self.results, max_fps))
+        self.process.start()
+
+    def request_frame(self, keyframe=False):
+        self.requests.put('keyframe' if keyframe else 'delta')
+
+    def next_frame(self, timeout=None):
+        """Blocks until the worker produces a frame. Returns None on timeout."""
+        try:
+            return self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self):
+        self.requests.put(None)
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+# --- Subscribers & Rate Control ---
+
+class _Subscriber:
+    def __init__(self, send):
+        self.send = send
+        self.awaiting = None      # frame id in flight
+        self.sent_at = 0.0
+        self.sent_bytes = 0
+        self.bandwidth = None     # bytes/second, EWMA over ack round trips
+        self.min_rtt = None       # Shortest ack round trip, taken as the link latency
+        self.has_base = False     # Deltas are useless until a keyframe has been sent
+
+
+class PreviewHub:
+    """
+    Runs in the server's event loop: forwards frames from the worker to
+    every subscribed WebSocket and paces the worker to the slowest client.
+    Starting and stopping the worker process block, so they run in the
+    loop's executor rather than on the loop itself.
+    """
+    def __init__(self, source_name='screen', max_fps=PREVIEW_MAX_FPS):
+        self.source_name = source_name
+        self.max_fps = max_fps
+        self.subscribers = {}
+        self.task = None
+        self.need_keyframe = False
+        self.wakeup = asyncio.Event()
+
+    def subscribe(self, key, send):
+        """send is an async callable taking one bytes message."""
+        require_preview_dependencies()
+        self.subscribers[key] = _Subscriber(send)
+        self.need_keyframe = True  # The new client has no base image yet.
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+        self.wakeup.set()
+
+    def unsubscribe(self, key):
+        self.subscribers.pop(key, None)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()  # _run stops the worker in the background
+            self.task = None
+        self.wakeup.set()
+
+    def ack(self, key, frame_id):
+        subscriber = self.subscribers.get(key)
+        if subscriber is None or subscriber.awaiting != frame_id:
+            return
+        rtt = time.monotonic() - subscriber.sent_at
+        if subscriber.min_rtt is not None and subscriber.sent_bytes >= PREVIEW_MIN_SAMPLE_BYTES:
+            sample = subscriber.sent_bytes / max(rtt - subscriber.min_rtt, 1e-3)
+            if subscriber.bandwidth is None:
+                subscriber.bandwidth = sample
+            else:
+                subscriber.bandwidth += PREVIEW_BANDWIDTH_SMOOTHING * (sample - subscriber.bandwidth)
+        if subscriber.min_rtt is None or rtt < subscriber.min_rtt:
+            subscriber.min_rtt = rtt
+        subscriber.awaiting = None
+        self.wakeup.set()
+
+    def frame_interval(self, frame_bytes):
+        """Seconds to wait between frames so preview stays within its share of the slowest link."""
+        rates = [s.bandwidth for s in self.subscribers.values() if s.bandwidth]
+        interval = 1.0 / self.max_fps
+        if rates:
+            interval = max(interval, frame_bytes / (min(rates) * PREVIEW_LINK_SHARE))
+        return min(interval, 1.0 / PREVIEW_MIN_FPS)
+
+    def _all_acked(self):
+        now = time.monotonic()
+        return all(s.awaiting is None or now - s.sent_at > ACK_TIMEOUT for s in self.subscribers.values())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        starting = loop.run_in_executor(None, PreviewProcess, self.source_name, self.max_fps)
+        try:
+            worker = await asyncio.shield(starting)
+        except asyncio.CancelledError:
+            # Everyone left while the worker was starting; stop it once it's up.
+            def stop_when_started(future):
+                if not future.cancelled() and future.exception() is None:
+                    loop.run_in_executor(None, future.result().stop)
+            starting.add_done_callback(stop_when_started)
+            raise
+        except Exception as e:
+            print(f"Preview worker failed to start: {e}")
+            if self.task is asyncio.current_task():
+                self.task = None  # The next subscriber tries again
+            return
+        try:
+            await self._forward(loop, worker)
+        except Exception as e:
+            print(f"Preview stream failed: {e}")
+        finally:
+            if self.task is asyncio.current_task():
+                self.task = None  # The next subscriber starts a new worker
+            loop.run_in_executor(None, worker.stop)
+
+    async def _forward(self, loop, worker):
+        while True:
+            while not self._all_acked():
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), ACK_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+
+            keyframe, self.need_keyframe = self.need_keyframe, False
+            worker.request_frame(keyframe)
+            started = time.monotonic()
+            message = None
+            while message is None:
+                # Blocking queue read in a thread; the event loop stays free for input.
+                message = await loop.run_in_executor(None, worker.next_frame, 0.5)
+
+            _, _, flags, frame_id = FRAME_HEADER.unpack_from(message)[:4]
+            for subscriber in list(self.subscribers.values()):
+                if flags & FLAG_KEYFRAME:
+                    subscriber.has_base = True
+                elif not subscriber.has_base:
+                    continue
+                subscriber.awaiting = frame_id
+                subscriber.sent_at = time.monotonic()
+                subscriber.sent_bytes = len(message)
+                try:
+                    await subscriber.send(message)
+                except Exception as e:
+                    print(f"Preview send failed: {e}")
+                    subscriber.awaiting = None
+
+            delay = self.frame_interval(len(message)) - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
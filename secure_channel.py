@@ -0,0 +1,511 @@
+"""
+Paired, encrypted transport for the TCP, UDP and WebSocket command channels.
+
+Pairing (plain text lines over TCP or WebSocket text messages):
+
+    client -> server   pair,<client X25519 public key hex>
+    server -> client   pair,<session id hex>,<server public key hex>,<salt hex>,<iterations>
+    client -> server   pairok,<sealed b'pair' packet hex>      (TCP channel, counter 0)
+    server -> client   paired | pairfail
+
+Each peer address may have one pairing in progress (for up to
+PAIRING_TIMEOUT); a new 'pair' from it replaces the old one. After a wrong
+code that address gets 'pairbusy' for a while, FAILURE_BACKOFF doubling
+with every failure in a row, so one host guessing codes doesn't lock the
+others out.
+
+A paired client that reconnects (roaming, sleep) skips all of that:
+
+    client -> server   resume,<session id hex>,<sealed b'resume' packet hex>
+    server -> client   resumed | resumefail
+
+The resume packet continues the client's TCP counter, so it can't be replayed.
+The new connection takes the session over: the old one (typically left
+behind on the previous network) is closed the next time it reads
+anything, so only one connection at a time uses the session's TCP state.
+
+Both sides derive the keys from the X25519 shared secret with HKDF, salted
+with PBKDF2(pairing code). A wrong code makes the confirmation packet fail
+authentication. The code is shown on the server console, is single-use and
+is replaced after every pairing attempt, successful or not. A 'pairok' is
+only checked against the code that was current when its 'pair' was
+answered, so each code gets exactly one guess.
+
+After pairing every command is one sealed packet:
+
+    session id (4) | counter (8) | AES-256-GCM ciphertext | tag (16)
+
+The header is the associated data and the nonce is the channel number plus
+the counter, so TCP and UDP keep independent counters under the same key.
+A 64-packet sliding window per channel rejects replays while tolerating UDP
+reordering. Over TCP each packet is prefixed with its 2-byte length; UDP
+datagrams and WebSocket binary messages carry exactly one packet.
+
+AES-GCM, X25519, HKDF and PBKDF2 are all available in WebCrypto, so a
+browser client can pair too.
+"""
+
+import hashlib
+import secrets
+import struct
+import threading
+import time
+
+# Optional dependency: only needed when pairing is enabled.
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+except ImportError:
+    AESGCM = None
+
+# --- Protocol Constants ---
+PAIRING_ALPHABET = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'  # No 0/O, 1/I/L look-alikes
+PAIRING_CODE_LENGTH = 8                                 # ~39 bits
+PBKDF2_ITERATIONS = 200_000
+HKDF_INFO = b'hybrid-input-server pairing v1'
+
+HEADER = struct.Struct('!IQ')   # session id, counter
+NONCE = struct.Struct('!IQ')    # channel, counter (12 bytes)
+FRAME_LENGTH = struct.Struct('!H')
+TAG_SIZE = 16
+OVERHEAD = HEADER.size + TAG_SIZE
+MAX_PAYLOAD = 1024
+REPLAY_WINDOW = 64
+PAIRING_TIMEOUT = 120.0       # Seconds a started pairing may take to send 'pairok'
+FAILURE_BACKOFF = 2.0         # Seconds 'pair' is refused after a wrong code, doubling per failure
+MAX_FAILURE_BACKOFF = 300.0
+MAX_PAIRING_PEERS = 256       # Addresses with a pairing in progress or a backoff, before 'pairbusy' for new ones
+
+CHANNEL_TCP = 1
+CHANNEL_UDP = 2
+CHANNEL_SERVER = 3  # Server -> client, over whichever stream the client paired on
+
+
+def require_cryptography():
+    if AESGCM is None:
+        raise RuntimeError("Pairing requires the 'cryptography' package. Please run 'pip install cryptography'")
+
+
+def new_pairing_code():
+    return ''.join(secrets.choice(PAIRING_ALPHABET) for _ in range(PAIRING_CODE_LENGTH))
+
+
+def _public_bytes(public_key):
+    return public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+
+
+def derive_keys(shared_secret, code_key, session_id, client_public, server_public):
+    """Returns (client -> server key, server -> client key)."""
+    info = HKDF_INFO + struct.pack('!I', session_id) + client_public + server_public
+    okm = HKDF(algorithm=hashes.SHA256(), length=64, salt=code_key, info=info).derive(shared_secret)
+    return okm[:32], okm[32:]
+
+
+def stretch_code(code, salt, iterations=PBKDF2_ITERATIONS):
+    return hashlib.pbkdf2_hmac('sha256', code.upper().encode('ascii'), salt, iterations)
+
+
+# --- Sealing ---
+
+class ReplayWindow:
+    """Sliding bitmap of recently accepted counters (RFC 4303 style)."""
+    def __init__(self):
+        self.highest = -1
+        self.bitmap = 0
+
+    def check(self, counter):
+        if counter > self.highest:
+            return True
+        offset = self.highest - counter
+        return offset < REPLAY_WINDOW and not (self.bitmap >> offset) & 1
+
+    def update(self, counter):
+        if counter > self.highest:
+            shift = counter - self.highest
+            self.bitmap = ((self.bitmap << shift) | 1) & ((1 << REPLAY_WINDOW) - 1)
+            self.highest = counter
+        else:
+            self.bitmap |= 1 << (self.highest - counter)
+
+
+class _Receiver:
+    """Per-channel receive state with preallocated nonce and plaintext buffers."""
+    def __init__(self, channel):
+        self.channel = channel
+        self.window = ReplayWindow()
+        self.nonce = bytearray(NONCE.size)
+        self.plaintext = bytearray(MAX_PAYLOAD)
+        self.plaintext_view = memoryview(self.plaintext)
+
+
+class Session:
+    """Keys and counters for one paired client."""
+    def __init__(self, session_id, recv_key, send_key):
+        self.session_id = session_id
+        self.recv_aead = AESGCM(recv_key)
+        self.send_aead = AESGCM(send_key)
+        self.receivers = {channel: _Receiver(channel) for channel in (CHANNEL_TCP, CHANNEL_UDP, CHANNEL_SERVER)}
+        self.send_counter = 0
+        self.send_lock = threading.Lock()
+        self.stream = None          # SecureStream that owns the TCP channel
+        self.stream_lock = threading.Lock()
+        self.created = time.monotonic()
+        # decrypt_into/encrypt_into appeared in cryptography 45; older
+        # versions fall back to allocating decrypt()/encrypt().
+        self.in_place = hasattr(AESGCM, 'decrypt_into')
+
+    def open(self, channel, packet, length):
+        """
+        Authenticates and decrypts one packet received on channel.
+        Returns a memoryview of the plaintext (valid until the next packet on
+        that channel) or None if it is forged, replayed or malformed.
+        """
+        if length < OVERHEAD or length - OVERHEAD > MAX_PAYLOAD:
+            return None
+        receiver = self.receivers[channel]
+        session_id, counter = HEADER.unpack_from(packet)
+        if session_id != self.session_id or not receiver.window.check(counter):
+            return None
+        NONCE.pack_into(receiver.nonce, 0, channel, counter)
+        packet = memoryview(packet)
+        header, body = packet[:HEADER.size], packet[HEADER.size:length]
+        try:
+            if self.in_place:
+                plaintext = receiver.plaintext_view[:length - OVERHEAD]
+                self.recv_aead.decrypt_into(receiver.nonce, body, header, plaintext)
+            else:
+                plaintext = memoryview(self.recv_aead.decrypt(bytes(receiver.nonce), bytes(body), bytes(header)))
+        except InvalidTag:
+            return None
+        # Only authenticated packets may move the window.
+        receiver.window.update(counter)
+        return plaintext
+
+    def seal(self, channel, payload):
+        """Encrypts payload (bytes) for sending on channel. Returns the packet bytes."""
+        with self.send_lock:
+            counter = self.send_counter
+            self.send_counter += 1
+        header = HEADER.pack(self.session_id, counter)
+        return header + self.send_aead.encrypt(NONCE.pack(channel, counter), payload, header)
+
+
+# --- Server Side ---
+
+class PairingServer:
+    """Issues pairing codes and owns every paired session."""
+    def __init__(self):
+        require_cryptography()
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.pending = {}           # peer -> (Session, code generation, expires) of its pairing in progress
+        self.failures = {}          # peer -> (wrong codes in a row, refuse 'pair' until)
+        self._rotate_code()
+
+    def _rotate_code(self):
+        self.generation += 1
+        self.code = new_pairing_code()
+        self.code_salt = secrets.token_bytes(16)
+        # Stretch once per code so a pairing attempt costs the server nothing.
+        self.code_key = stretch_code(self.code, self.code_salt)
+        print(f"🔑 Pairing code: {self.code}")
+
+    def _prune(self, now):
+        """Drops expired pairings and backoffs that have run out. Call with the lock held."""
+        for peer in [peer for peer, entry in self.pending.items() if now >= entry[2]]:
+            del self.pending[peer]
+        # Keep the failure count until the longest backoff has passed again, so
+        # waiting out one backoff doesn't reset the doubling.
+        for peer in [peer for peer, entry in self.failures.items() if now >= entry[1] + MAX_FAILURE_BACKOFF]:
+            del self.failures[peer]
+
+    def begin(self, client_public_hex, peer=None):
+        """
+        Handles 'pair,<pubkey>' from peer (the client's address). Returns
+        (pending pairing, reply line); the pending pairing is None if the
+        reply is 'pairfail' or 'pairbusy'.
+        """
+        try:
+            client_public = bytes.fromhex(client_public_hex)
+            private_key = X25519PrivateKey.generate()
+            secret = private_key.exchange(X25519PublicKey.from_public_bytes(client_public))
+        except ValueError:
+            return None, 'pairfail'
+        server_public = _public_bytes(private_key.public_key())
+        now = time.monotonic()
+        with self.lock:
+            if now < self.failures.get(peer, (0, 0.0))[1]:
+                return None, 'pairbusy'
+            if peer not in self.pending and len(self.pending) + len(self.failures) >= MAX_PAIRING_PEERS:
+                self._prune(now)
+                if len(self.pending) + len(self.failures) >= MAX_PAIRING_PEERS:
+                    return None, 'pairbusy'
+            session_id = secrets.randbits(32)
+            while session_id == 0 or session_id in self.sessions:
+                session_id = secrets.randbits(32)
+            recv_key, send_key = derive_keys(secret, self.code_key, session_id, client_public, server_public)
+            pending = Session(session_id, recv_key, send_key)
+            self.pending[peer] = (pending, self.generation, now + PAIRING_TIMEOUT)
+            salt = self.code_salt
+        reply = f"pair,{session_id:08x},{server_public.hex()},{salt.hex()},{PBKDF2_ITERATIONS}"
+        return pending, reply
+
+    def confirm(self, pending, sealed_hex, peer=None):
+        """Handles 'pairok,<packet>' from peer. Registers and returns the session, or None."""
+        try:
+            packet = bytes.fromhex(sealed_hex)
+        except ValueError:
+            packet = b''
+        now = time.monotonic()
+        with self.lock:
+            current = self.pending.get(peer)
+            if current is None or current[0] is not pending:
+                return None  # Timed out or replaced; this says nothing about the code
+            del self.pending[peer]
+            if current[1] != self.generation or now > current[2]:
+                return None
+            plaintext = pending.open(CHANNEL_TCP, packet, len(packet))
+            ok = plaintext is not None and bytes(plaintext) == b'pair'
+            # Single-use code: any attempt, right or wrong, burns it.
+            self._rotate_code()
+            if ok:
+                self.failures.pop(peer, None)
+                self.sessions[pending.session_id] = pending
+            else:
+                failures = self.failures.get(peer, (0, 0.0))[0] + 1
+                backoff = min(FAILURE_BACKOFF * 2 ** (failures - 1), MAX_FAILURE_BACKOFF)
+                self.failures[peer] = (failures, now + backoff)
+        return pending if ok else None
+
+    def cancel(self, pending, peer=None):
+        """Gives up a pairing whose connection closed before 'pairok'."""
+        with self.lock:
+            current = self.pending.get(peer)
+            if current is not None and current[0] is pending:
+                del self.pending[peer]
+
+    def resume(self, session_hex, sealed_hex, stream):
+        """
+        Handles 'resume,<session id>,<packet>' received by stream, which takes
+        the session over from the connection that had it. Returns the
+        existing session, or None.
+        """
+        try:
+            session = self.sessions.get(int(session_hex, 16))
+            packet = bytes.fromhex(sealed_hex)
+        except ValueError:
+            return None
+        if session is None:
+            return None
+        with session.stream_lock:
+            plaintext = session.open(CHANNEL_TCP, packet, len(packet))
+            if plaintext is None or bytes(plaintext) != b'resume':
+                return None
+            previous, session.stream = session.stream, stream
+        if previous is not None and previous is not stream:
+            previous.closed = True
+        return session
+
+    def forget(self, session_id):
+        """Drops a session; its client has to pair again."""
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def open_datagram(self, packet, length):
+        """Returns the plaintext of one sealed UDP datagram, or None."""
+        if length < OVERHEAD:
+            return None
+        session = self.sessions.get(HEADER.unpack_from(packet)[0])
+        if session is None:
+            return None
+        return session.open(CHANNEL_UDP, packet, length)
+
+    def seal_reply(self, packet, payload):
+        """Seals payload (bytes) for the session that sent the UDP datagram packet."""
+        session = self.sessions.get(HEADER.unpack_from(packet)[0])
+        if session is None:
+            return None
+        return session.seal(CHANNEL_SERVER, payload)
+
+
+class SecureStream:
+    """
+    Pairing and framing for one TCP or WebSocket connection, without any I/O.
+    Feed it received bytes (or messages) and send back whatever it returns.
+    peer is the client's host address: pairing attempts and backoff are per peer.
+    """
+    def __init__(self, pairing, peer=None):
+        self.pairing = pairing
+        self.peer = peer
+        self.pending = None
+        self.session = None
+        self.closed = False
+        self.buffer = bytearray()
+
+    def handle_line(self, line):
+        """Handles one handshake line. Returns the reply line, or None."""
+        command = line.strip().split(',')
+        if command[0] == 'pair' and len(command) == 2:
+            self.close()
+            self.pending, reply = self.pairing.begin(command[1], self.peer)
+            if self.pending is None:
+                self.closed = True
+                if reply == 'pairbusy':
+                    print(f"⚠️ Pairing refused for {self.peer}: too soon after a wrong code, or too many pairings in progress.")
+            return reply
+        if command[0] == 'pairok' and len(command) == 2 and self.pending is not None:
+            self.session = self.pairing.confirm(self.pending, command[1], self.peer)
+            self.pending = None
+            if self.session is None:
+                self.closed = True
+                print("⚠️ Pairing failed: wrong code.")
+                return 'pairfail'
+            self.session.stream = self
+            print(f"🔐 Paired session {self.session.session_id:08x}")
+            return 'paired'
+        if command[0] == 'resume' and len(command) == 3 and self.session is None:
+            self.session = self.pairing.resume(command[1], command[2], self)
+            if self.session is None:
+                # Not fatal: the client can still pair on this connection.
+                return 'resumefail'
+            print(f"🔐 Resumed session {self.session.session_id:08x}")
+            return 'resumed'
+        # Plain commands from an unpaired client are refused outright.
+        self.closed = True
+        return 'unpaired'
+
+    def close(self):
+        """Call when the connection closes, so a half-done pairing doesn't block the next one."""
+        if self.pending is not None:
+            self.pairing.cancel(self.pending, self.peer)
+            self.pending = None
+
+    def open_packet(self, packet):
+        """Decrypts one sealed packet from this connection. Returns the command string or None."""
+        session = self.session
+        with session.stream_lock:
+            if session.stream is not self:
+                # The client has resumed the session on another connection.
+                self.closed = True
+                return None
+            plaintext = session.open(CHANNEL_TCP, packet, len(packet))
+            if plaintext is None:
+                return None
+            return str(plaintext, 'utf-8', 'replace')
+
+    def feed(self, data):
+        """
+        Consumes bytes from a TCP stream. Returns (reply bytes, commands),
+        where commands are the decrypted command strings in order.
+        """
+        self.buffer += data
+        replies = []
+        commands = []
+        while not self.closed:
+            if self.session is None:
+                end = self.buffer.find(b'\n')
+                if end < 0:
+                    break
+                line = self.buffer[:end].decode('utf-8', 'replace')
+                del self.buffer[:end + 1]
+                if line.strip():
+                    replies.append(self.handle_line(line) + '\n')
+            else:
+                if len(self.buffer) < FRAME_LENGTH.size:
+                    break
+                size = FRAME_LENGTH.unpack_from(self.buffer)[0]
+                if len(self.buffer) < FRAME_LENGTH.size + size:
+                    break
+                packet = bytes(self.buffer[FRAME_LENGTH.size:FRAME_LENGTH.size + size])
+                del self.buffer[:FRAME_LENGTH.size + size]
+                command = self.open_packet(packet)
+                if command is not None:
+                    commands.append(command)
+        return ''.join(replies).encode('utf-8'), commands
+
+    def feed_message(self, message):
+        """
+        Consumes one WebSocket message: text while pairing, binary after.
+        Returns (reply text or None, command string or None).
+        """
+        if isinstance(message, str):
+            if self.session is not None:
+                return None, None
+            return self.handle_line(message), None
+        if self.session is None:
+            return None, None
+        return None, self.open_packet(message)
+
+    def seal(self, text):
+        """Seals a server -> client message as a length-prefixed TCP frame."""
+        packet = self.seal_packet(text)
+        return FRAME_LENGTH.pack(len(packet)) + packet
+
+    def seal_packet(self, message):
+        """Seals a server -> client message (text or bytes) as one unframed packet."""
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        return self.session.seal(CHANNEL_SERVER, message)
+
+
+# --- Client Side (reference implementation, used by the benchmarks) ---
+
+class PairingClient:
+    """Client half of the pairing handshake plus sealing of outgoing commands."""
+    def __init__(self, code):
+        require_cryptography()
+        self.code = code
+        self.private_key = X25519PrivateKey.generate()
+        self.session = None
+
+    def start(self):
+        return f"pair,{_public_bytes(self.private_key.public_key()).hex()}"
+
+    def finish(self, reply):
+        """Takes the server's 'pair,...' reply and returns the 'pairok,...' line."""
+        _, session_hex, server_public_hex, salt_hex, iterations = reply.strip().split(',')
+        session_id = int(session_hex, 16)
+        server_public = bytes.fromhex(server_public_hex)
+        secret = self.private_key.exchange(X25519PublicKey.from_public_bytes(server_public))
+        code_key = stretch_code(self.code, bytes.fromhex(salt_hex), int(iterations))
+        client_public = _public_bytes(self.private_key.public_key())
+        send_key, recv_key = derive_keys(secret, code_key, session_id, client_public, server_public)
+        # The client's session seals with the client -> server key.
+        self.session = Session(session_id, recv_key, send_key)
+        self.tcp_counter = 0
+        self.udp_counter = 0
+        return f"pairok,{self._seal(CHANNEL_TCP, b'pair').hex()}"
+
+    def _seal(self, channel, payload):
+        if channel == CHANNEL_TCP:
+            counter, self.tcp_counter = self.tcp_counter, self.tcp_counter + 1
+        else:
+            counter, self.udp_counter = self.udp_counter, self.udp_counter + 1
+        header = HEADER.pack(self.session.session_id, counter)
+        return header + self.session.send_aead.encrypt(NONCE.pack(channel, counter), payload, header)
+
+    def resume(self):
+        """Returns the 'resume,...' line for reconnecting without pairing again."""
+        return f"resume,{self.session.session_id:08x},{self._seal(CHANNEL_TCP, b'resume').hex()}"
+
+    def seal_datagram(self, text):
+        return self._seal(CHANNEL_UDP, text.encode('utf-8'))
+
+    def seal_packet(self, text):
+        return self._seal(CHANNEL_TCP, text.encode('utf-8'))
+
+    def seal_frame(self, text):
+        packet = self.seal_packet(text)
+        return FRAME_LENGTH.pack(len(packet)) + packet
+
+    def open_frame(self, packet):
+        plaintext = self.session.open(CHANNEL_SERVER, packet, len(packet))
+        return None if plaintext is None else str(plaintext, 'utf-8')
+
+    def open_datagram(self, packet):
+        """Opens a sealed server -> client datagram (reliable-mode acks)."""
+        return self.open_frame(packet)
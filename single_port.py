@@ -0,0 +1,225 @@
+"""
+Single-port listener shared by the iOS app (raw TCP) and web browsers (WebSocket).
+
+Every connection is accepted by the WebSocket server's asyncio listener, but
+the WebSocket machinery is only started once the first bytes have arrived.
+An HTTP "GET " or "HEAD " request line goes on to the normal WebSocket handshake;
+anything else is handed to a newline-delimited TCP command protocol on the
+same transport. Both kinds of client share one accept loop and one event loop.
+A connection that has started an HTTP request line but not finished it
+within SNIFF_TIMEOUT is closed. One that has sent nothing at all is left
+alone: the iOS app opens its control connection and stays silent until
+the first click or key, since its moves go over UDP.
+
+Raw TCP commands are injected on one worker thread, in order, so a slow
+injection (pyautogui's pause, an xdotool subprocess) never stalls the
+event loop the WebSocket, HTTP and preview clients share.
+
+When an AssetCache is given, plain HTTP requests (no Upgrade header) are
+answered from it instead, so the web app is served from the same port.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+from websockets.asyncio.server import serve, ServerConnection
+from secure_channel import SecureStream
+from client_sessions import SessionLink
+from web_assets import MAX_REQUEST_HEAD, StaticHttpProtocol, is_websocket_upgrade
+
+HTTP_METHODS = (b'GET ', b'HEAD ')
+SNIFF_TIMEOUT = 10.0  # Seconds a partial HTTP request line may take to become classifiable
+
+
+def sniff(first_bytes):
+    """
+    Classifies the first bytes of a connection.
+    Returns 'http', 'tcp', or None if more bytes are needed to decide.
+    """
+    if first_bytes.startswith(HTTP_METHODS):
+        return 'http'
+    if any(method.startswith(first_bytes) for method in HTTP_METHODS) and b'\n' not in first_bytes:
+        return None
+    return 'tcp'
+
+
+class TcpCommandProtocol(asyncio.Protocol):
+    """
+    Splits a raw TCP stream into newline-delimited commands, or into sealed
+    packets when pairing is required (see secure_channel.py). With a
+    SessionRegistry, 'session' lines are answered here (see client_sessions.py).
+    Commands go to on_command on executor when one is given, else on the loop.
+    """
+    def __init__(self, transport, on_command, pairing=None, sessions=None, executor=None):
+        self.transport = transport
+        self.on_command = on_command
+        self.executor = executor
+        self.addr = transport.get_extra_info('peername')
+        self.stream = SecureStream(pairing, self.addr[0]) if pairing else None
+        self.loop = asyncio.get_running_loop()
+        self.link = SessionLink(sessions, 'TCP', self.stream, self._push) if sessions else None
+        self.buffer = b''
+        print(f"✅ TCP connection established from {self.addr}")
+
+    def data_received(self, data):
+        if self.stream is not None:
+            reply, commands = self.stream.feed(data)
+            if reply:
+                self.transport.write(reply)
+            if self.stream.closed:
+                self.transport.close()
+            for command in commands:
+                self._dispatch(command)
+            return
+
+        self.buffer += data
+        while b'\n' in self.buffer:
+            line, self.buffer = self.buffer.split(b'\n', 1)
+            if line.strip():
+                self._dispatch(line.decode('utf-8', errors='replace'))
+
+    def eof_received(self):
+        # A final command without a trailing newline is still a command.
+        if self.buffer.strip():
+            self._dispatch(self.buffer.decode('utf-8', errors='replace'))
+        self.buffer = b''
+
+    def _dispatch(self, command):
+        if self.link is None:
+            self._run(command)
+            return
+        reply, command = self.link.handle(command)
+        if reply:
+            self.transport.write((reply + '\n').encode())
+        if command:
+            self._run(command, self.link.session)
+
+    def _run(self, *args):
+        if self.executor is None:
+            self.on_command(*args)
+        else:
+            self.executor.submit(self._run_logged, args)
+
+    def _run_logged(self, args):
+        # Runs on the executor, where an exception would vanish into the future.
+        try:
+            self.on_command(*args)
+        except Exception as e:
+            print(f"⚠️ TCP command {args[0]!r} from {self.addr} failed: {e}")
+
+    def _push(self, line):
+        # Server pushes (rate advice) come from other threads.
+        data = self.stream.seal(line) if self.stream else (line + '\n').encode()
+        self.loop.call_soon_threadsafe(self.transport.write, data)
+
+    def connection_lost(self, exc):
+        if self.link is not None:
+            self.link.close()
+        elif self.stream is not None:
+            self.stream.close()
+        if exc is not None:
+            print(f"⚠️ Client {self.addr} disconnected unexpectedly.")
+        print(f"🔌 Closing TCP connection from {self.addr}")
+
+
+class SniffingConnection(ServerConnection):
+    """
+    A WebSocket connection that holds off the opening handshake until the
+    first bytes show whether the client is a browser or the iOS app.
+    """
+    def __init__(self, protocol, server, *, on_tcp_command, pairing=None, sessions=None, assets=None,
+                 command_executor=None, **kwargs):
+        super().__init__(protocol, server, **kwargs)
+        self.on_tcp_command = on_tcp_command
+        self.command_executor = command_executor
+        self.pairing = pairing
+        self.sessions = sessions
+        self.assets = assets
+        self.sniff_transport = None
+        self.sniff_buffer = b''
+        self.sniffed = False
+        self.sniff_timer = None
+
+    def connection_made(self, transport):
+        # Deliberately not calling super() yet: that would start the
+        # handshake timeout for what may turn out to be a raw TCP client.
+        self.sniff_transport = transport
+
+    def _wait_for_more(self):
+        # Only a half-sent HTTP request is timed; a silent connection is
+        # an idle iOS app and may stay that way.
+        if self.sniff_timer is None:
+            self.sniff_timer = asyncio.get_running_loop().call_later(SNIFF_TIMEOUT, self._sniff_timed_out)
+
+    def _sniff_timed_out(self):
+        if not self.sniffed:
+            print(f"⌛ Closing {self.sniff_transport.get_extra_info('peername')}: "
+                  f"HTTP request line unfinished after {SNIFF_TIMEOUT:g}s")
+            self.sniff_transport.close()
+
+    def data_received(self, data):
+        if self.sniffed:
+            super().data_received(data)
+            return
+
+        self.sniff_buffer += data
+        kind = sniff(self.sniff_buffer)
+        if kind is None:
+            self._wait_for_more()
+            return
+        if kind == 'http' and self.assets is not None:
+            # Need the whole request head to tell a page load from an upgrade.
+            head_end = self.sniff_buffer.find(b'\r\n\r\n')
+            if head_end < 0 and len(self.sniff_buffer) <= MAX_REQUEST_HEAD:
+                self._wait_for_more()
+                return
+            if not is_websocket_upgrade(self.sniff_buffer[:head_end]):
+                kind = 'static'
+        self.sniffed = True
+        if self.sniff_timer is not None:
+            self.sniff_timer.cancel()
+        data, self.sniff_buffer = self.sniff_buffer, b''
+
+        if kind == 'http':
+            super().connection_made(self.sniff_transport)
+            super().data_received(data)
+        elif kind == 'static':
+            http_protocol = StaticHttpProtocol(self.sniff_transport, self.assets)
+            self.sniff_transport.set_protocol(http_protocol)
+            http_protocol.data_received(data)
+        else:
+            tcp_protocol = TcpCommandProtocol(self.sniff_transport, self.on_tcp_command, self.pairing, self.sessions,
+                                              self.command_executor)
+            self.sniff_transport.set_protocol(tcp_protocol)
+            tcp_protocol.data_received(data)
+
+    def eof_received(self):
+        if self.sniffed:
+            return super().eof_received()
+        return None  # Closed before saying anything; let the transport close.
+
+    def connection_lost(self, exc):
+        if self.sniffed:
+            super().connection_lost(exc)
+        elif self.sniff_timer is not None:
+            self.sniff_timer.cancel()
+
+
+def serve_single_port(ws_handler, on_tcp_command, host, port, pairing=None, sessions=None, assets=None, **kwargs):
+    """
+    Starts a WebSocket server on host:port that also accepts raw TCP command
+    clients. ws_handler is the usual websockets connection handler and
+    on_tcp_command is called with each decoded TCP command line, in order,
+    on a single worker thread (never on the event loop). With a
+    PairingServer, TCP clients must pair before their commands are accepted.
+    With a SessionRegistry, TCP clients can resume their client session and
+    on_tcp_command is called with the ClientSession (or None) as well.
+    With an AssetCache, plain HTTP GETs are served from it.
+    Use it like websockets.serve(): `async with serve_single_port(...):`.
+    """
+    command_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='tcp-commands')
+    create_connection = functools.partial(
+        SniffingConnection, on_tcp_command=on_tcp_command, pairing=pairing, sessions=sessions, assets=assets,
+        command_executor=command_executor,
+    )
+    return serve(ws_handler, host, port, create_connection=create_connection, **kwargs)
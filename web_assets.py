@@ -0,0 +1,212 @@
+"""
+In-memory static file server for the bundled web app (remo-web-app.tar.gz).
+
+At startup every web asset is read straight out of the tarball, precompressed
+(gzip, plus brotli when the 'brotli' package is installed), given an ETag,
+and turned into ready-to-send response headers. Serving a request is then a
+dict lookup plus one transport.writelines() of two prebuilt buffers, with
+keep-alive and 304 Not Modified support.
+
+index.html additionally gets its local stylesheet and scripts inlined, so a
+cold page load from a phone is a single request on the control port.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import re
+import tarfile
+
+# Optional dependency: brotli is smaller, gzip is always available.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.json': 'application/json',
+    '.svg': 'image/svg+xml',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.ico': 'image/x-icon',
+    '.webmanifest': 'application/manifest+json',
+}
+COMPRESSIBLE = ('.html', '.css', '.js', '.json', '.svg', '.webmanifest')
+INDEX = 'index.html'
+MAX_REQUEST_HEAD = 8192
+
+STYLESHEET_LINK = re.compile(r'<link\s+rel="stylesheet"\s+href="([^":]+)"\s*/?>')
+SCRIPT_TAG = re.compile(r'<script\s+src="([^":]+)"\s*>\s*</script>')
+
+
+class Asset:
+    """One file with its prebuilt response headers and bodies per encoding."""
+    def __init__(self, path, data):
+        self.path = path
+        extension = path[path.rfind('.'):]
+        self.content_type = CONTENT_TYPES[extension]
+        self.etag = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+
+        self.bodies = {'identity': data}
+        if extension in COMPRESSIBLE:
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(data, quality=11)
+            self.bodies['gzip'] = gzip.compress(data, compresslevel=9, mtime=0)
+            # Keep a compressed variant only if it actually saves bytes.
+            for encoding in ('br', 'gzip'):
+                if encoding in self.bodies and len(self.bodies[encoding]) >= len(data):
+                    del self.bodies[encoding]
+
+        self.headers = {encoding: self._head(encoding, len(body)) for encoding, body in self.bodies.items()}
+        self.not_modified = (
+            f"HTTP/1.1 304 Not Modified\r\nETag: {self.etag}\r\n"
+            "Cache-Control: no-cache\r\nVary: Accept-Encoding\r\n\r\n"
+        ).encode('ascii')
+
+    def _head(self, encoding, length):
+        lines = [
+            "HTTP/1.1 200 OK",
+            f"Content-Type: {self.content_type}",
+            f"Content-Length: {length}",
+            f"ETag: {self.etag}",
+            "Cache-Control: no-cache",
+            "Vary: Accept-Encoding",
+        ]
+        if encoding != 'identity':
+            lines.append(f"Content-Encoding: {encoding}")
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('ascii')
+
+
+def _inline_assets(html, files):
+    """Inlines local stylesheets and scripts referenced by an HTML page."""
+    def stylesheet(match):
+        name = match.group(1)
+        if name not in files:
+            return match.group(0)
+        return f"<style>\n{files[name].decode('utf-8')}\n</style>"
+
+    def script(match):
+        name = match.group(1)
+        if name not in files:
+            return match.group(0)
+        # A literal </script> inside the code would end the tag early.
+        code = files[name].decode('utf-8').replace('</script', '<\\/script')
+        return f"<script>\n{code}\n</script>"
+
+    html = STYLESHEET_LINK.sub(stylesheet, html)
+    return SCRIPT_TAG.sub(script, html)
+
+
+class AssetCache:
+    """All web app assets, keyed by URL path."""
+    def __init__(self, files):
+        self.assets = {}
+        for name, data in files.items():
+            if name == INDEX:
+                data = _inline_assets(data.decode('utf-8'), files).encode('utf-8')
+            self.assets['/' + name] = Asset('/' + name, data)
+        if '/' + INDEX in self.assets:
+            self.assets['/'] = self.assets['/' + INDEX]
+
+    @classmethod
+    def from_tarball(cls, path):
+        """Reads every servable file straight out of a .tar.gz archive."""
+        files = {}
+        with tarfile.open(path, 'r:*') as archive:
+            for member in archive.getmembers():
+                name = member.name
+                while name.startswith('./'):
+                    name = name[2:]
+                basename = name.rsplit('/', 1)[-1]
+                # Skip macOS AppleDouble metadata and anything we don't serve.
+                if not member.isfile() or basename.startswith('._'):
+                    continue
+                if name[name.rfind('.'):] not in CONTENT_TYPES:
+                    continue
+                files[name] = archive.extractfile(member).read()
+        return cls(files)
+
+    def total_size(self):
+        return sum(len(body) for asset in self.assets.values() for body in asset.bodies.values())
+
+    def respond(self, method, target, headers):
+        """Returns the response for one request as a list of byte buffers."""
+        if method not in ('GET', 'HEAD'):
+            return [b"HTTP/1.1 405 Method Not Allowed\r\nAllow: GET, HEAD\r\nContent-Length: 0\r\n\r\n"]
+        asset = self.assets.get(target.split('?', 1)[0])
+        if asset is None:
+            return [b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n"]
+
+        if_none_match = headers.get('if-none-match')
+        if if_none_match and (if_none_match.strip() == '*' or asset.etag in if_none_match):
+            return [asset.not_modified]
+
+        encoding = _pick_encoding(headers.get('accept-encoding', ''), asset.bodies)
+        if method == 'HEAD':
+            return [asset.headers[encoding]]
+        return [asset.headers[encoding], asset.bodies[encoding]]
+
+
+def _pick_encoding(accept_encoding, available):
+    accepted = set()
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in ('br', 'gzip'):
+        if encoding in available and encoding in accepted:
+            return encoding
+    return 'identity'
+
+
+def is_websocket_upgrade(head):
+    """True if an HTTP request head asks for a WebSocket upgrade."""
+    for line in head.lower().split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip() == b'upgrade' and b'websocket' in value:
+            return True
+    return False
+
+
+class StaticHttpProtocol(asyncio.Protocol):
+    """Serves an AssetCache over HTTP/1.1 with keep-alive and pipelining."""
+    def __init__(self, transport, assets):
+        self.transport = transport
+        self.assets = assets
+        self.buffer = b''
+
+    def data_received(self, data):
+        self.buffer += data
+        while True:
+            end = self.buffer.find(b'\r\n\r\n')
+            if end < 0:
+                if len(self.buffer) > MAX_REQUEST_HEAD:
+                    self.transport.write(b"HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\n\r\n")
+                    self.transport.close()
+                return
+            head, self.buffer = self.buffer[:end], self.buffer[end + 4:]
+            if not self._handle(head):
+                self.transport.close()
+                return
+
+    def _handle(self, head):
+        """Answers one request. Returns False if the connection should close."""
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            self.transport.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            return False
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        # Header and body go out as separate prebuilt buffers, never joined.
+        self.transport.writelines(self.assets.respond(method, target, headers))
+        connection = headers.get('connection', '').lower()
+        return connection != 'close' and (version == 'HTTP/1.1' or connection == 'keep-alive')
@@ -4,16 +4,111 @@ import pyautogui
 import subprocess
 import sys
 from zeroconf import ServiceInfo, Zeroconf
+from keymap import load_keymap, PYAUTOGUI_KEYS, PYAUTOGUI_MODIFIERS
+from secure_channel import PairingServer, SecureStream
+from udp_fastpath import DatagramReceiver, MMOVE, SCROLL
+from reliable_udp import ReliableChannel
+from client_sessions import SessionLink, SessionRegistry
+from rate_feedback import RateController
+from held_inputs import HeldInputs, HOLD_COMMANDS
+from runtime_profiler import RuntimeProfiler, injection_targets
 
 # --- Configuration ---
 TCP_HOST = '0.0.0.0'  # Listen on all available network interfaces
 TCP_PORT = 65432      # Port for reliable commands (TCP)
 UDP_PORT = 65433      # Port for high-speed commands (UDP)
+REQUIRE_PAIRING = False # Only accept commands from clients paired with the on-screen code;
+                        # off until the iOS and bundled web apps can pair (secure_channel.py)
+RELIABLE_UDP = True     # Accept sequenced, acked clicks and keys on the UDP port; see reliable_udp.py
+RATE_FEEDBACK = True    # Tell clients how often to send moves so the host keeps up; see rate_feedback.py
+PROFILING = True        # Let SIGUSR1/SIGUSR2 or 'profile' switch on the profiler; see runtime_profiler.py
+
+# Set at startup when REQUIRE_PAIRING is on; see secure_channel.py.
+pairing = None
+# Resumable client sessions, set at startup; see client_sessions.py.
+sessions = None
+# Runtime profiler, switched off until asked; see runtime_profiler.py.
+profiler = None
 
 # Disable the PyAutoGUI fail-safe feature.
 # This prevents the script from stopping if the mouse moves to a corner.
 pyautogui.FAILSAFE = False
 
+# Character -> keystroke table for the active layout, compiled once at startup.
+# A layout without a bundled table gets key names only; pyautogui types the rest.
+KEYMAP = load_keymap(fallback=None).resolve(lambda name: PYAUTOGUI_KEYS.get(name, name), PYAUTOGUI_MODIFIERS.get)
+
+# Only Linux reports its keyboard layout to keymap.py, so elsewhere KEYMAP is
+# the 'us' one. pyautogui asks the OS for the active layout, so characters are
+# left to it there and KEYMAP only handles key names.
+OS_TYPES_CHARACTERS = not sys.platform.startswith('linux')
+
+def keystrokes(key):
+    """KEYMAP's keystrokes for key, or None to hand key to pyautogui as it is."""
+    if OS_TYPES_CHARACTERS and len(key) == 1 and key.isprintable():
+        return None
+    return KEYMAP.get(key)
+
+def press_key(key):
+    """
+    Presses a key name or types a single character, holding whatever
+    modifiers the active layout needs (e.g. shift for '!' or 'A').
+    """
+    strokes = keystrokes(key)
+    if strokes is None:
+        # A character pyautogui types itself, or one of its own key names.
+        pyautogui.press(key)
+        return
+    for mods, name in strokes:
+        if mods:
+            pyautogui.hotkey(*mods, name)
+        else:
+            pyautogui.press(name)
+
+def key_down(key):
+    """
+    Holds a key down, with the modifiers the active layout needs. Characters
+    that take more than one keystroke can't be held, so they are just typed.
+    No pyautogui.PAUSE here: autorepeat calls this REPEAT_RATE times a second.
+    """
+    strokes = keystrokes(key)
+    if strokes is None:
+        pyautogui.keyDown(key, _pause=False)
+    elif len(strokes) == 1:
+        mods, name = strokes[0]
+        for mod in mods:
+            pyautogui.keyDown(mod, _pause=False)
+        pyautogui.keyDown(name, _pause=False)
+    else:
+        press_key(key)
+
+def key_up(key):
+    """Releases a key held by key_down(), modifiers last."""
+    strokes = keystrokes(key)
+    if strokes is None:
+        pyautogui.keyUp(key, _pause=False)
+    elif len(strokes) == 1:
+        mods, name = strokes[0]
+        pyautogui.keyUp(name, _pause=False)
+        for mod in reversed(mods):
+            pyautogui.keyUp(mod, _pause=False)
+
+def move_mouse(dx, dy):
+    """
+    Moves the pointer. On macOS, apps only see a drag if the moves are sent
+    as drag events, so moves while a button is held go through dragRel.
+    """
+    buttons = held.buttons() if sys.platform == "darwin" else None
+    if buttons:
+        pyautogui.dragRel(dx, dy, button=buttons[0], mouseDownUp=False)
+    else:
+        pyautogui.moveRel(dx, dy)
+
+# Keys and buttons held by mdown/kdown, with autorepeat; see held_inputs.py.
+held = HeldInputs(key_down, key_up,
+                  lambda button: pyautogui.mouseDown(button=button, _pause=False),
+                  lambda button: pyautogui.mouseUp(button=button, _pause=False))
+
 # --- TCP Handler (For reliable commands) ---
 def handle_tcp_client(conn, addr):
     """
@@ -22,6 +117,19 @@ def handle_tcp_client(conn, addr):
     print(f"✅ TCP connection established from {addr}")
 
     buffer = ""
+    stream = SecureStream(pairing, addr[0]) if pairing else None
+    send_lock = threading.Lock()
+
+    def write(data):
+        # Replies and server pushes come from different threads
+        with send_lock:
+            conn.sendall(data)
+
+    def send(line):
+        # Server pushes (rate advice) from other threads
+        write(stream.seal(line) if stream else (line + '\n').encode())
+
+    link = SessionLink(sessions, 'TCP', stream, send)
     
     try:
         while True:
@@ -29,76 +137,106 @@ def handle_tcp_client(conn, addr):
             if not data:
                 break  # Connection closed by the client
 
-            buffer += data.decode('utf-8')
+            if stream is None:
+                buffer += data.decode('utf-8')
+                commands = []
+                while '\n' in buffer:
+                    # Split off the first complete command from the buffer
+                    command_str, buffer = buffer.split('\n', 1)
+                    commands.append(command_str)
+            else:
+                # Paired clients send sealed, length-prefixed packets
+                reply, commands = stream.feed(data)
+                if reply:
+                    write(reply)
+                if stream.closed:
+                    break
 
-            while '\n' in buffer:
-                # Split off the first complete command from the buffer
-                command_str, buffer = buffer.split('\n', 1)
-    
-                print(f"TCP RX: {command_str}")
-                command = command_str.split(',')
-                # Use strip() on the action to be safe
-                action = command[0].strip()
-    
-                # --- Mouse Click Actions ---
-                if action == 'mclick' and len(command) > 1:
-                    pyautogui.click(button=command[1].strip())
-    
-                # --- Keyboard Press Actions ---
-                elif action == 'kpress' and len(command) > 1:
-                    # Strip the key to remove network characters,
-                    # pyautogui handles keywords like 'space', 'enter', etc.
-                    key_to_press = command[1].strip('\n\r')
-                    print(f"Executing key press: '{key_to_press}'")
-                    pyautogui.press(key_to_press)
-    
-                # --- Volume Control Actions ---
-                elif action == 'vol' and len(command) > 1:
-                    direction = command[1].strip()
-                    if direction == 'up':
-                        pyautogui.press('volumeup')
-                    elif direction == 'down':
-                        pyautogui.press('volumedown')
-                    elif direction == 'mute':
-                        pyautogui.press('volumemute')
-    
-                # --- System Power Actions ---
-                elif action == 'power' and len(command) > 1:
-                    sub_command = command[1].strip()
-                    cmd = []
-    
-                    if sys.platform == "win32":  # For Windows
-                        if sub_command == 'shutdown':
-                            cmd = ["shutdown", "/s", "/t", "0"]
-                        elif sub_command == 'restart':
-                            cmd = ["shutdown", "/r", "/t", "0"]
-                        elif sub_command == 'sleep':
-                            cmd = ["rundll32.exe", "powrprof.dll,SetSuspendState", "0,1,0"]
-                        elif sub_command == 'lock':
-                            cmd = ["rundll32.exe", "user32.dll,LockWorkStation"]
-    
-                    elif sys.platform == "darwin":  # For macOS
-                        if sub_command == 'shutdown':
-                            cmd = ["osascript", "-e", 'tell app "System Events" to shut down']
-                        elif sub_command == 'restart':
-                            cmd = ["osascript", "-e", 'tell app "System Events" to restart']
-                        elif sub_command == 'sleep':
-                            cmd = ["osascript", "-e", 'tell app "System Events" to sleep']
-                        elif sub_command == 'lock':
-                            cmd = ["/System/Library/CoreServices/Menu Extras/User.menu/Contents/Resources/CGSession", "-suspend"]
-                    
-                    if cmd:
-                        print(f"Executing: {' '.join(cmd)}")
-                        subprocess.run(cmd)
-                    else:
-                        print(f"⚠️ Unknown power command for {sys.platform}: {sub_command}")
+            for command_str in commands:
+                reply, command_str = link.handle(command_str)
+                if reply:
+                    write((reply + '\n').encode())
+                if command_str:
+                    handle_tcp_command(command_str, link.session)
 
     except ConnectionResetError:
         print(f"⚠️ Client {addr} disconnected unexpectedly.")
     finally:
         print(f"🔌 Closing TCP connection from {addr}")
+        link.close()
         conn.close()
 
+def handle_tcp_command(command_str, session=None):
+    """
+    Executes one reliable command: clicks, keys, holds, volume, and power.
+    """
+    print(f"TCP RX: {command_str}")
+    command = command_str.split(',')
+    # Use strip() on the action to be safe
+    action = command[0].strip()
+
+    # --- Mouse Click Actions ---
+    if action == 'mclick' and len(command) > 1:
+        pyautogui.click(button=command[1].strip())
+
+    # --- Keyboard Press Actions ---
+    elif action == 'kpress' and len(command) > 1:
+        # Strip the key to remove network characters,
+        # pyautogui handles keywords like 'space', 'enter', etc.
+        key_to_press = command[1].strip('\n\r')
+        print(f"Executing key press: '{key_to_press}'")
+        press_key(key_to_press)
+
+    # --- Press / Hold / Release Actions ---
+    elif action in HOLD_COMMANDS and len(command) > 1:
+        name = command[1].strip() if action in ('mdown', 'mup') else command[1].strip('\n\r')
+        held.command(action, name, session)
+
+    # --- Volume Control Actions ---
+    elif action == 'vol' and len(command) > 1:
+        direction = command[1].strip()
+        if direction == 'up':
+            pyautogui.press('volumeup')
+        elif direction == 'down':
+            pyautogui.press('volumedown')
+        elif direction == 'mute':
+            pyautogui.press('volumemute')
+
+    # --- System Power Actions ---
+    elif action == 'power' and len(command) > 1:
+        sub_command = command[1].strip()
+        cmd = []
+
+        if sys.platform == "win32":  # For Windows
+            if sub_command == 'shutdown':
+                cmd = ["shutdown", "/s", "/t", "0"]
+            elif sub_command == 'restart':
+                cmd = ["shutdown", "/r", "/t", "0"]
+            elif sub_command == 'sleep':
+                cmd = ["rundll32.exe", "powrprof.dll,SetSuspendState", "0,1,0"]
+            elif sub_command == 'lock':
+                cmd = ["rundll32.exe", "user32.dll,LockWorkStation"]
+
+        elif sys.platform == "darwin":  # For macOS
+            if sub_command == 'shutdown':
+                cmd = ["osascript", "-e", 'tell app "System Events" to shut down']
+            elif sub_command == 'restart':
+                cmd = ["osascript", "-e", 'tell app "System Events" to restart']
+            elif sub_command == 'sleep':
+                cmd = ["osascript", "-e", 'tell app "System Events" to sleep']
+            elif sub_command == 'lock':
+                cmd = ["/System/Library/CoreServices/Menu Extras/User.menu/Contents/Resources/CGSession", "-suspend"]
+        
+        if cmd:
+            print(f"Executing: {' '.join(cmd)}")
+            subprocess.run(cmd)
+        else:
+            print(f"⚠️ Unknown power command for {sys.platform}: {sub_command}")
+
+    # --- Runtime Profiler ---
+    elif action == 'profile' and profiler:
+        profiler.command(command[1:])
+
 def start_tcp_server():
     """
     Starts the TCP server to listen for incoming connections.
@@ -121,27 +259,61 @@ def start_udp_server():
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
         s.bind((TCP_HOST, UDP_PORT))
         print(f"🚀 UDP Server listening on port {UDP_PORT}...")
+        receiver = DatagramReceiver(s, pairing)
+        reliable = ReliableChannel(s, pairing, sessions) if RELIABLE_UDP else None
+        rate = RateController(sessions) if RATE_FEEDBACK else None
+        if rate:
+            rate.start()
+        fields = receiver.fields
+        apply = lambda command_str: handle_udp_command(
+            command_str, reliable=True, session=sessions.for_datagram(receiver) if sessions else None)
         while True:
-            data, addr = s.recvfrom(1024)
+            if rate:
+                rate.waiting()
             try:
-                command_str = data.decode('utf-8').strip()
-                command = command_str.split(',')
-                action = command[0]
-
-                # --- Mouse Movement Action ---
-                if action == 'mmove' and len(command) == 3:
-                    dx, dy = int(float(command[1])), int(float(command[2]))
-                    pyautogui.moveRel(dx, dy)
-
-                # --- Scroll Action ---
-                elif action == 'scroll' and len(command) == 2:
-                    scroll_amount = int(command[1])
-                    if sys.platform == "win32":
-                        scroll_amount *= 20
-                    pyautogui.scroll(scroll_amount)
+                if not receiver.receive():
+                    continue  # Unpaired, forged or replayed
+                if rate:
+                    rate.received(receiver)  # Measures queue delay and per-client load
+                start = reliable.feed(receiver, apply) if reliable else 0
+                if start < 0:
+                    continue  # Held, buffered, duplicate or already applied
+
+                # Integer moves/scrolls are parsed in place without allocating
+                kind = receiver.parse_csv(start)
+                if kind == MMOVE:
+                    move_mouse(fields[0], fields[1])
+                elif kind == SCROLL:
+                    pyautogui.scroll(fields[0] * 20 if sys.platform == "win32" else fields[0])
+                else:
+                    handle_udp_command(receiver.text(start))
 
             except Exception as e:
-                print(f"UDP Error: {e} | Raw data: {data}")
+                print(f"UDP Error: {e} | Raw data: {bytes(receiver.view[:receiver.length])}")
+
+def handle_udp_command(command_str, reliable=False, session=None):
+    """
+    Handles one UDP command that didn't take the fast path.
+    Clicks, keys and holds are only accepted in reliable mode.
+    """
+    command = command_str.strip().split(',')
+    action = command[0]
+
+    # --- Mouse Movement Action ---
+    if action == 'mmove' and len(command) == 3:
+        dx, dy = int(float(command[1])), int(float(command[2]))
+        move_mouse(dx, dy)
+
+    # --- Scroll Action ---
+    elif action == 'scroll' and len(command) == 2:
+        scroll_amount = int(command[1])
+        if sys.platform == "win32":
+            scroll_amount *= 20
+        pyautogui.scroll(scroll_amount)
+
+    # --- Reliable-mode Clicks, Keys and Holds ---
+    elif reliable and (action in ('mclick', 'kpress') or action in HOLD_COMMANDS):
+        handle_tcp_command(command_str, session)
 
 def get_ip_address():
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -169,7 +341,8 @@ def register_service():
         service_name,
         addresses=[socket.inet_aton(local_ip)],
         port=TCP_PORT,
-        properties={'udp_port': str(UDP_PORT)}, # Send UDP port as metadata
+        properties={'udp_port': str(UDP_PORT), 'pairing': '1' if pairing else '0', # Send UDP port as metadata
+                    'reliable': '1' if RELIABLE_UDP else '0'},
         server=f"{hostname}.local.",
     )
 
@@ -184,6 +357,21 @@ def register_service():
 if __name__ == "__main__":
     print("--- Starting iOS Remote Control Server ---")
     print(f"OS Detected: {sys.platform}")
+
+    if REQUIRE_PAIRING:
+        try:
+            pairing = PairingServer()
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    held.start()
+    sessions = SessionRegistry(pairing, held.up)
+    sessions.start()
+    if PROFILING:
+        profiler = RuntimeProfiler(injection_targets(
+            pyautogui, 'moveRel', 'dragRel', 'scroll', 'click', 'mouseDown', 'mouseUp',
+            'press', 'hotkey', 'keyDown', 'keyUp'))
+        profiler.install_signals()
     
     # Start the Bonjour/Zeroconf service broadcasting in a separate thread
     zeroconf_thread = threading.Thread(target=register_service)